@@ -0,0 +1,12 @@
+import pytest
+
+
+@pytest.fixture(autouse=True, scope='session')
+def isolated_cache(tmp_path_factory):
+    from django.test import override_settings
+
+    from core.cache import isolated_caches
+
+    directory = tmp_path_factory.mktemp('cache')
+    with override_settings(CACHES=isolated_caches(str(directory))):
+        yield
@@ -0,0 +1,31 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connections
+
+executor = None
+
+
+def run_in_background(function):
+    """Выполняет function в общем пуле фоновых потоков.
+
+    Поток закрывает свои соединения с базой, чтобы они
+    не копились между задачами. При BACKGROUND_WORKERS = 0
+    function выполняется сразу в текущем потоке.
+    """
+    global executor
+    if not settings.BACKGROUND_WORKERS:
+        function()
+        return None
+    if executor is None:
+        executor = ThreadPoolExecutor(
+            max_workers=settings.BACKGROUND_WORKERS,
+            thread_name_prefix='background',
+        )
+
+    def task():
+        try:
+            function()
+        finally:
+            connections.close_all()
+    return executor.submit(task)
@@ -0,0 +1,481 @@
+import math
+import os
+import pickle
+import random
+import time
+from collections import OrderedDict, namedtuple
+from threading import Lock
+
+from django.conf import settings
+from django.core.cache import cache as default_cache
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+from django.core.cache.backends.filebased import FileBasedCache
+from django.db import DatabaseError
+from django.utils.module_loading import import_string
+
+from .background import run_in_background
+from .db import db_deadline
+
+JOURNAL_SEQ = 'core:journal:seq'
+JOURNAL_EVENT = 'core:journal:{}'
+CLEAR_ALL = '*'
+LOCK_KEY = '{}:lock'
+LOCK_POLL_INTERVAL = 0.05
+ADD_LOCK_SUFFIX = '.add'
+ADD_LOCK_TIMEOUT = 10
+
+CacheEntry = namedtuple('CacheEntry', 'value version expires delta')
+
+
+def is_fresh(entry, version, now, beta):
+    """Вероятностное раннее обновление (XFetch).
+
+    Чем дольше пересчитывается значение и чем ближе срок его
+    жизни, тем вероятнее, что запрос пересчитает его заранее,
+    пока остальные ещё получают текущую копию.
+    """
+    if entry.version != version:
+        return False
+    if entry.expires is None:
+        return True
+    jitter = entry.delta * beta * math.log(1 - random.random())
+    return now - jitter < entry.expires
+
+
+def is_stale(entry, version, now):
+    return entry.version != version or (
+        entry.expires is not None and now >= entry.expires
+    )
+
+
+def refreshed_meanwhile(cache, key, version, entry):
+    """Запись, которую успели пересчитать между чтением и взятием
+    блокировки, или None."""
+    current = cache.get(key)
+    if (current is not None and current.version == version
+            and (entry is None or current.expires != entry.expires)):
+        return current
+    return None
+
+
+def wait_for_entry(cache, key, version):
+    """Ждёт, пока значение пересчитает запрос, взявший блокировку."""
+    deadline = time.monotonic() + settings.CACHE_LOCK_TIMEOUT
+    while time.monotonic() < deadline:
+        time.sleep(LOCK_POLL_INTERVAL)
+        entry = cache.get(key)
+        if entry is not None and entry.version == version:
+            return entry
+    return None
+
+
+def store(cache, key, compute, timeout, version, cacheable):
+    started = time.monotonic()
+    value = compute()
+    delta = time.monotonic() - started
+    if cacheable is None or cacheable(value):
+        expires = None if timeout is None else time.time() + timeout
+        cache.set(
+            key,
+            CacheEntry(value, version, expires, delta),
+            None if timeout is None
+            else timeout + settings.CACHE_STALE_TIMEOUT,
+        )
+    return value
+
+
+def revalidate(entry, version, stale, refresh, refresh_in_background):
+    """Пересчитывает запись, держа прежнюю копию про запас."""
+    if entry is None:
+        return refresh(), False
+    if entry.version == version and refresh_in_background:
+        run_in_background(refresh)
+        return entry.value, stale
+    try:
+        with db_deadline(settings.CACHE_LATENCY_BUDGET):
+            return refresh(), False
+    except DatabaseError:
+        return entry.value, True
+
+
+def cache_fetch(key, compute, timeout, version=None, cacheable=None,
+                cache=default_cache, refresh_in_background=False):
+    """Значение из кеша с защитой от одновременного пересчёта.
+
+    Возвращает пару (значение, устарело ли оно).
+
+    Пересчитывает значение только запрос, взявший короткую
+    блокировку через add. Остальные тем временем отдают прежнее
+    значение, даже устаревшее или другой версии, а если его нет -
+    ждут результат не дольше CACHE_LOCK_TIMEOUT.
+
+    Запись живёт ещё CACHE_STALE_TIMEOUT после своего срока.
+    Истёкшую запись той же версии при refresh_in_background
+    пересчитывает фоновый поток, а запрос сразу получает старую.
+    Если пересчёт падает с ошибкой базы или не укладывается
+    в CACHE_LATENCY_BUDGET, тоже отдаётся старая запись.
+    Значения, для которых cacheable(value) ложно, не сохраняются.
+    """
+    now = time.time()
+    entry = cache.get(key)
+    if entry is not None and is_fresh(
+        entry, version, now, settings.CACHE_EARLY_REFRESH_BETA
+    ):
+        return entry.value, False
+
+    stale = entry is not None and is_stale(entry, version, now)
+    lock_key = LOCK_KEY.format(key)
+    locked = cache.add(lock_key, True, settings.CACHE_LOCK_TIMEOUT)
+    if not locked:
+        if entry is None:
+            entry = wait_for_entry(cache, key, version)
+        if entry is not None:
+            return entry.value, stale
+    else:
+        current = refreshed_meanwhile(cache, key, version, entry)
+        if current is not None:
+            cache.delete(lock_key)
+            return current.value, False
+
+    def refresh():
+        try:
+            return store(cache, key, compute, timeout, version, cacheable)
+        finally:
+            if locked:
+                cache.delete(lock_key)
+
+    return revalidate(entry, version, stale, refresh, refresh_in_background)
+
+
+def get_or_compute(*args, **kwargs):
+    """Значение из cache_fetch без признака устаревания."""
+    value, _ = cache_fetch(*args, **kwargs)
+    return value
+
+
+class LocalTier:
+    """L1 процесса: LRU-записи и состояние чтения журнала.
+
+    Один на LOCATION, как хранилище LocMemCache, чтобы все потоки
+    процесса видели одни и те же записи.
+    """
+
+    def __init__(self):
+        self.entries = OrderedDict()
+        self.lock = Lock()
+        self.poll_lock = Lock()
+        self.seq = None
+        self.published = set()
+        self.polled_at = 0
+
+
+def take_add_lock(path):
+    """Создаёт файл-блокировку через O_CREAT | O_EXCL.
+
+    Возвращает дескриптор или None, если файл уже есть. Блокировку
+    упавшего процесса снимает первый вызов после ADD_LOCK_TIMEOUT
+    секунд.
+    """
+    flags = os.O_CREAT | os.O_EXCL | os.O_WRONLY
+    try:
+        return os.open(path, flags)
+    except FileExistsError:
+        try:
+            age = time.time() - os.path.getmtime(path)
+        except FileNotFoundError:
+            age = ADD_LOCK_TIMEOUT + 1
+        if age <= ADD_LOCK_TIMEOUT:
+            return None
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+    try:
+        return os.open(path, flags)
+    except FileExistsError:
+        return None
+
+
+_local_tiers = {}
+_local_tiers_lock = Lock()
+
+
+def local_tier(location):
+    with _local_tiers_lock:
+        return _local_tiers.setdefault(location, LocalTier())
+
+
+class TwoTierCache(BaseCache):
+    """Кеш из двух уровней: LRU в памяти процесса перед общим кешем.
+
+    LOCATION - алиас общего кеша (L2) из settings.CACHES. Django
+    создаёт экземпляр кеша в каждом потоке, но L1 у них общий
+    на процесс. Каждая запись и удаление попадает в журнал в L2:
+    номер события плюс список изменённых ключей. Процессы раз
+    в POLL_INTERVAL секунд дочитывают журнал и выбрасывают эти
+    ключи из своего L1, так что сброс в одном процессе доходит
+    до всех остальных.
+
+    OPTIONS:
+    MAX_ENTRIES - размер L1;
+    L1_TIMEOUT - наибольшее время жизни записи в L1;
+    POLL_INTERVAL - как часто читать журнал;
+    JOURNAL_TIMEOUT - сколько хранится событие журнала. Процесс,
+    отставший больше чем на это время, очищает L1 целиком.
+    """
+
+    pickle_protocol = pickle.HIGHEST_PROTOCOL
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        self._l2_alias = location
+        self._l1_timeout = options.get('L1_TIMEOUT', 60)
+        self._poll_interval = options.get('POLL_INTERVAL', 1)
+        self._journal_timeout = options.get('JOURNAL_TIMEOUT', 300)
+        self._tier = local_tier(location)
+        self._l1 = self._tier.entries
+        self._lock = self._tier.lock
+
+    @property
+    def l2(self):
+        return caches[self._l2_alias]
+
+    def _l1_get(self, key):
+        with self._lock:
+            pickled, expires = self._l1.get(key, (None, 0))
+            if expires <= time.monotonic():
+                self._l1.pop(key, None)
+                return None
+            self._l1.move_to_end(key)
+        return pickled
+
+    def _l1_set(self, key, value, timeout):
+        timeout = self.get_backend_timeout(timeout)
+        lifetime = self._l1_timeout
+        if timeout is not None:
+            lifetime = min(lifetime, timeout - time.time())
+        if lifetime <= 0:
+            return
+        pickled = pickle.dumps(value, self.pickle_protocol)
+        with self._lock:
+            self._l1[key] = (pickled, time.monotonic() + lifetime)
+            self._l1.move_to_end(key)
+            while len(self._l1) > self._max_entries:
+                self._l1.popitem(last=False)
+
+    def _l1_delete(self, keys):
+        with self._lock:
+            for key in keys:
+                self._l1.pop(key, None)
+
+    def _l1_clear(self):
+        with self._lock:
+            self._l1.clear()
+
+    def _l2_incr(self, key, delta=1, version=None):
+        """incr общего кеша без срока жизни.
+
+        BaseCache.incr - это get и set со сроком по умолчанию,
+        а счётчики здесь (поколения тегов, номер журнала) должны
+        жить, пока их не сбросят. Собственный incr бэкенда
+        (LocMemCache, memcached) срок записи и так сохраняет.
+        """
+        if type(self.l2).incr is not BaseCache.incr:
+            return self.l2.incr(key, delta, version=version)
+        value = self.l2.get(key, version=version)
+        if value is None:
+            raise ValueError(f"Key '{key}' not found")
+        value += delta
+        self.l2.set(key, value, None, version=version)
+        return value
+
+    def _publish(self, keys):
+        """Записывает событие журнала и сбрасывает ключи в своём L1.
+
+        Номер события берётся через incr и занимается через _l2_add:
+        incr файлового кеша не атомарен, и если два процесса
+        получили один номер, проигравший берёт следующий.
+        """
+        self._l1_delete(keys)
+        while True:
+            try:
+                seq = self._l2_incr(JOURNAL_SEQ)
+            except ValueError:
+                self._l2_add(JOURNAL_SEQ, 0, None, None)
+                continue
+            if self._l2_add(JOURNAL_EVENT.format(seq), list(keys),
+                            self._journal_timeout, None):
+                self._tier.published.add(seq)
+                return
+
+    def _poll(self):
+        """Дочитывает журнал и выбрасывает из L1 изменённые ключи.
+
+        Журнал читает один поток процесса, остальные не ждут его.
+        """
+        tier = self._tier
+        now = time.monotonic()
+        if now - tier.polled_at < self._poll_interval:
+            return
+        if not tier.poll_lock.acquire(blocking=False):
+            return
+        try:
+            tier.polled_at = now
+            self._read_journal(tier)
+        finally:
+            tier.poll_lock.release()
+
+    def _read_journal(self, tier):
+        seq = self.l2.get(JOURNAL_SEQ, 0)
+        if tier.seq is None or seq < tier.seq:
+            tier.seq = seq
+            self._l1_clear()
+            return
+        if seq == tier.seq:
+            return
+
+        event_keys = [JOURNAL_EVENT.format(number)
+                      for number in range(tier.seq + 1, seq + 1)
+                      if number not in tier.published]
+        events = self.l2.get_many(event_keys)
+        tier.seq = seq
+        tier.published = {
+            number for number in tier.published if number > seq
+        }
+        if len(events) < len(event_keys) or any(
+            CLEAR_ALL in keys for keys in events.values()
+        ):
+            self._l1_clear()
+            return
+        self._l1_delete(
+            key for keys in events.values() for key in keys
+        )
+
+    def _l2_add(self, key, value, timeout, version):
+        """add общего кеша, атомарный и между процессами.
+
+        FileBasedCache.add - это проверка и запись двумя шагами.
+        Для него ключ на время add занимается файлом-блокировкой,
+        см. take_add_lock: кто не смог её взять, проиграл гонку
+        за этот ключ.
+        """
+        l2 = self.l2
+        if not isinstance(l2, FileBasedCache):
+            return l2.add(key, value, timeout, version=version)
+        path = l2._key_to_file(key, version) + ADD_LOCK_SUFFIX
+        try:
+            descriptor = take_add_lock(path)
+        except FileNotFoundError:
+            l2._createdir()
+            descriptor = take_add_lock(path)
+        if descriptor is None:
+            return False
+        try:
+            return l2.add(key, value, timeout, version=version)
+        finally:
+            os.close(descriptor)
+            os.remove(path)
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        added = self._l2_add(key, value, timeout, version)
+        if added:
+            full_key = self.make_key(key, version=version)
+            self._publish([full_key])
+            self._l1_set(full_key, value, timeout)
+        return added
+
+    def get(self, key, default=None, version=None):
+        self._poll()
+        full_key = self.make_key(key, version=version)
+        pickled = self._l1_get(full_key)
+        if pickled is not None:
+            return pickle.loads(pickled)
+        value = self.l2.get(key, self, version=version)
+        if value is self:
+            return default
+        self._l1_set(full_key, value, self._l1_timeout)
+        return value
+
+    def get_many(self, keys, version=None):
+        self._poll()
+        found = {}
+        missing = {}
+        for key in keys:
+            full_key = self.make_key(key, version=version)
+            pickled = self._l1_get(full_key)
+            if pickled is None:
+                missing[key] = full_key
+            else:
+                found[key] = pickle.loads(pickled)
+        if missing:
+            values = self.l2.get_many(missing, version=version)
+            for key, value in values.items():
+                self._l1_set(missing[key], value, self._l1_timeout)
+            found.update(values)
+        return found
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self.l2.set(key, value, timeout, version=version)
+        full_key = self.make_key(key, version=version)
+        self._publish([full_key])
+        self._l1_set(full_key, value, timeout)
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        if not data:
+            return []
+        failed = self.l2.set_many(data, timeout, version=version)
+        full_keys = {key: self.make_key(key, version=version) for key in data}
+        self._publish(list(full_keys.values()))
+        for key, value in data.items():
+            if key not in failed:
+                self._l1_set(full_keys[key], value, timeout)
+        return failed
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        return self.l2.touch(key, timeout, version=version)
+
+    def delete(self, key, version=None):
+        self.l2.delete(key, version=version)
+        self._publish([self.make_key(key, version=version)])
+
+    def delete_many(self, keys, version=None):
+        keys = list(keys)
+        self.l2.delete_many(keys, version=version)
+        self._publish([self.make_key(key, version=version) for key in keys])
+
+    def has_key(self, key, version=None):
+        return self.get(key, self, version=version) is not self
+
+    def incr(self, key, delta=1, version=None):
+        value = self._l2_incr(key, delta, version=version)
+        self._publish([self.make_key(key, version=version)])
+        return value
+
+    def clear(self):
+        self.l2.clear()
+        self._l1_clear()
+        self._tier.seq = None
+        self._tier.published.clear()
+        self._publish([CLEAR_ALL])
+
+
+def isolated_caches(directory):
+    """Настройки CACHES с теми же бэкендами, но пустыми хранилищами.
+
+    Файловые кеши переносятся в directory, TwoTierCache остаётся
+    поверх них, остальные заменяются на LocMemCache.
+    """
+    isolated = {}
+    for alias, params in settings.CACHES.items():
+        backend = import_string(params['BACKEND'])
+        if issubclass(backend, FileBasedCache):
+            params = dict(params, LOCATION=os.path.join(directory, alias))
+        elif not issubclass(backend, TwoTierCache):
+            params = {
+                'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                'LOCATION': f'isolated-{alias}',
+            }
+        isolated[alias] = params
+    return isolated
@@ -0,0 +1,26 @@
+import threading
+from contextlib import contextmanager
+
+from django.db import connection
+
+
+@contextmanager
+def db_deadline(seconds):
+    """Прерывает запросы к базе, не уложившиеся в seconds секунд.
+
+    Прерванный запрос падает с OperationalError. Работает для
+    SQLite, у соединений которого есть interrupt(); с другими
+    базами блок выполняется без ограничения.
+    """
+    connection.ensure_connection()
+    interrupt = getattr(connection.connection, 'interrupt', None)
+    if not seconds or interrupt is None:
+        yield
+        return
+    timer = threading.Timer(seconds, interrupt)
+    timer.daemon = True
+    timer.start()
+    try:
+        yield
+    finally:
+        timer.cancel()
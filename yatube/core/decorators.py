@@ -0,0 +1,126 @@
+import hashlib
+from functools import partial, wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DatabaseError
+from django.utils.cache import (get_conditional_response, patch_cache_control,
+                                patch_vary_headers)
+from django.utils.http import http_date, quote_etag
+
+from .cache import cache_fetch
+
+PAGE_KEY = 'core:page:{}'
+STALE_WARNING = '110 - "Response is Stale"'
+
+
+def static_page_state(request, *args, **kwargs):
+    """Состояние страницы, которая меняется только с выкладкой."""
+    return (), None
+
+
+def is_cacheable(response):
+    return (response.status_code == 200
+            and not response.streaming
+            and not response.cookies)
+
+
+def is_anonymous_read(request):
+    return (request.method in ('GET', 'HEAD')
+            and not request.user.is_authenticated)
+
+
+def page_validators(state, last_modified):
+    """ETag и Last-Modified страницы по её состоянию."""
+    fingerprint = repr(
+        (settings.CACHE_MIDDLEWARE_KEY_PREFIX, state)
+    ).encode()
+    etag = quote_etag(hashlib.md5(fingerprint).hexdigest())
+    timestamp = last_modified and int(last_modified.timestamp())
+    return etag, timestamp
+
+
+def set_validators(response, etag, timestamp):
+    response['ETag'] = etag
+    if timestamp:
+        response['Last-Modified'] = http_date(timestamp)
+    return response
+
+
+def render_page(view, request, args, kwargs, etag, timestamp):
+    response = view(request, *args, **kwargs)
+    if hasattr(response, 'render'):
+        response.render()
+    return set_validators(response, etag, timestamp)
+
+
+def with_cache_headers(response):
+    patch_cache_control(response, max_age=0)
+    patch_vary_headers(response, ('Cookie',))
+    return response
+
+
+def mark_stale(response):
+    response['Warning'] = STALE_WARNING
+    return with_cache_headers(response)
+
+
+def stale_page(key):
+    """Последняя закешированная копия страницы, если база недоступна."""
+    entry = cache.get(key)
+    return entry and mark_stale(entry.value)
+
+
+def cache_anonymous_page(page_state=static_page_state):
+    """Кеширует ответы view для анонимных GET-запросов.
+
+    page_state(request, *args, **kwargs) возвращает пару (состояние,
+    время последнего изменения) или None, если объекта страницы нет.
+    ETag - отпечаток состояния и версия закешированного ответа,
+    поэтому ответ пересчитывается вместе с данными страницы,
+    а повторный запрос с If-None-Match или If-Modified-Since
+    получает 304 без отрисовки шаблона.
+
+    Устаревший ответ, отданный пока страница пересчитывается или
+    пока база недоступна, помечается заголовком Warning.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if not is_anonymous_read(request):
+                return view(request, *args, **kwargs)
+
+            path = hashlib.md5(request.get_full_path().encode())
+            key = PAGE_KEY.format(path.hexdigest())
+            try:
+                page = page_state(request, *args, **kwargs)
+            except DatabaseError:
+                response = stale_page(key)
+                if response is None:
+                    raise
+                return response
+            if page is None:
+                return view(request, *args, **kwargs)
+            etag, timestamp = page_validators(*page)
+            response = get_conditional_response(
+                request, etag=etag, last_modified=timestamp
+            )
+            if response is not None:
+                return with_cache_headers(
+                    set_validators(response, etag, timestamp)
+                )
+
+            response, stale = cache_fetch(
+                key,
+                partial(render_page, view, request, args, kwargs,
+                        etag, timestamp),
+                settings.PAGE_CACHE_TIMEOUT,
+                version=etag,
+                cacheable=is_cacheable,
+                refresh_in_background=settings.CACHE_REFRESH_IN_BACKGROUND,
+            )
+            if stale:
+                return mark_stale(response)
+            return with_cache_headers(response)
+        return wrapper
+    return decorator
@@ -0,0 +1,112 @@
+from django.core.cache import InvalidCacheBackendError, caches
+from django.core.cache.utils import make_template_fragment_key
+from django.template import Library, TemplateSyntaxError, VariableDoesNotExist
+from django.templatetags.cache import CacheNode
+
+from core.cache import get_or_compute
+
+FRAGMENT_STATE = 'fragment_cache_state'
+
+register = Library()
+
+
+def skip_fragment_cache(context):
+    """Не даёт сохранить фрагменты {% cache %}, внутри которых
+    сейчас рендерится шаблон: например, в них попала заглушка."""
+    state = context.get(FRAGMENT_STATE)
+    if state is not None:
+        state['cacheable'] = False
+
+
+class StampedeSafeCacheNode(CacheNode):
+    """Фрагмент, который пересчитывает только один запрос за раз.
+
+    Версия фрагмента не входит в ключ: пока новая версия
+    отрисовывается, остальные запросы получают прежнюю.
+    Фрагмент, при рендере которого вызвали skip_fragment_cache,
+    отдаётся, но не сохраняется.
+    """
+
+    def __init__(self, nodelist, expire_time_var, fragment_name, vary_on,
+                 cache_name, version_var):
+        super().__init__(
+            nodelist, expire_time_var, fragment_name, vary_on, cache_name
+        )
+        self.version_var = version_var
+
+    def resolve(self, var, context):
+        try:
+            return var.resolve(context)
+        except VariableDoesNotExist:
+            raise TemplateSyntaxError(
+                f'"cache" tag got an unknown variable: {var.var!r}'
+            )
+
+    def render(self, context):
+        expire_time = self.resolve(self.expire_time_var, context)
+        if expire_time is not None:
+            try:
+                expire_time = int(expire_time)
+            except (ValueError, TypeError):
+                raise TemplateSyntaxError(
+                    f'"cache" tag got a non-integer timeout value: '
+                    f'{expire_time!r}'
+                )
+        cache_name = 'default'
+        if self.cache_name:
+            cache_name = self.resolve(self.cache_name, context)
+        try:
+            fragment_cache = caches[cache_name]
+        except InvalidCacheBackendError:
+            raise TemplateSyntaxError(
+                f'Invalid cache name specified for cache tag: {cache_name!r}'
+            )
+
+        vary_on = [var.resolve(context) for var in self.vary_on]
+        version = None
+        if self.version_var:
+            version = self.resolve(self.version_var, context)
+        state = {'cacheable': True}
+
+        def compute():
+            with context.push({FRAGMENT_STATE: state}):
+                content = self.nodelist.render(context)
+            if not state['cacheable']:
+                skip_fragment_cache(context)
+            return content
+
+        return get_or_compute(
+            make_template_fragment_key(self.fragment_name, vary_on),
+            compute,
+            expire_time,
+            version=version,
+            cacheable=lambda content: state['cacheable'],
+            cache=fragment_cache,
+        )
+
+
+@register.tag('cache')
+def do_cache(parser, token):
+    """Замена {% cache %} с защитой от одновременного пересчёта.
+
+    {% cache timeout name [var1 var2 ...] [version=var] [using="alias"] %}
+    """
+    nodelist = parser.parse(('endcache',))
+    parser.delete_first_token()
+    tokens = token.split_contents()
+    options = {}
+    while len(tokens) > 3 and tokens[-1].startswith(('version=', 'using=')):
+        name, value = tokens.pop().split('=', 1)
+        options[name] = parser.compile_filter(value)
+    if len(tokens) < 3:
+        raise TemplateSyntaxError(
+            f'{tokens[0]!r} tag requires at least 2 arguments.'
+        )
+    return StampedeSafeCacheNode(
+        nodelist,
+        parser.compile_filter(tokens[1]),
+        tokens[2],
+        [parser.compile_filter(token) for token in tokens[3:]],
+        options.get('using'),
+        options.get('version'),
+    )
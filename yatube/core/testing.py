@@ -0,0 +1,139 @@
+import abc
+import os
+import shutil
+import tempfile
+
+from django.core.cache import cache
+from django.db import connection
+from django.test import Client, override_settings
+from django.test import runner
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from .cache import isolated_caches
+
+_cache_directory = None
+
+
+def init_worker(counter):
+    """Даёт процессу --parallel свой каталог кеша внутри
+    каталога прогона."""
+    runner._init_worker(counter)
+    override_settings(CACHES=isolated_caches(
+        os.path.join(_cache_directory, f'worker-{runner._worker_id}')
+    )).enable()
+
+
+class IsolatedCacheTestSuite(runner.ParallelTestSuite):
+    init_worker = init_worker
+
+
+class IsolatedCacheTestRunner(runner.DiscoverRunner):
+    """Прогон тестов с отдельным пустым кешем.
+
+    Файловые кеши из CACHES переносятся во временный каталог:
+    cache.clear() в тестах не очищает рабочий кеш, а одновременные
+    прогоны и процессы --parallel не мешают друг другу.
+    """
+
+    parallel_test_suite = IsolatedCacheTestSuite
+
+    def setup_test_environment(self, **kwargs):
+        global _cache_directory
+        super().setup_test_environment(**kwargs)
+        _cache_directory = tempfile.mkdtemp(prefix='tests-cache-')
+        self.isolated_caches = override_settings(
+            CACHES=isolated_caches(_cache_directory)
+        )
+        self.isolated_caches.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self.isolated_caches.disable()
+        shutil.rmtree(_cache_directory, ignore_errors=True)
+        super().teardown_test_environment(**kwargs)
+
+
+def named_routes(namespace, urlpatterns):
+    """Имена маршрутов модуля urls вместе с именами их параметров."""
+    return {
+        f'{namespace}:{pattern.name}': tuple(pattern.pattern.converters)
+        for pattern in urlpatterns
+        if pattern.name
+    }
+
+
+class QueryBudgetMixin(abc.ABC):
+    """Проверка бюджета SQL-запросов для всех маршрутов приложений.
+
+    Подключается к TestCase вместе с описанием маршрутов:
+
+    url_modules - пары (namespace, urlpatterns), маршруты которых
+    обходит проверка;
+    query_budgets - наибольшее число запросов для каждого маршрута;
+    paginated_routes - маршруты, число запросов которых не должно
+    зависеть от размера страницы;
+    get_route_kwargs() - значения параметров маршрутов из тестовых
+    данных.
+
+    Тестовые данные готовит сам TestCase, запросы выполняются
+    от имени пользователя, которого возвращает get_user().
+    """
+
+    url_modules = ()
+    query_budgets = {}
+    paginated_routes = ()
+    page_sizes = (5, 20)
+
+    @abc.abstractmethod
+    def get_user(self):
+        """Пользователь, от имени которого выполняются запросы."""
+
+    @abc.abstractmethod
+    def get_route_kwargs(self):
+        """Словарь имя параметра -> значение для всех параметров
+        маршрутов из url_modules."""
+
+    def routes(self):
+        routes = {}
+        for namespace, urlpatterns in self.url_modules:
+            routes.update(named_routes(namespace, urlpatterns))
+        return routes
+
+    def count_queries(self, name, params):
+        kwargs = self.get_route_kwargs()
+        missing = set(params) - set(kwargs)
+        if missing:
+            self.fail(f'get_route_kwargs() не задаёт {missing} для {name}')
+        url = reverse(name, kwargs={param: kwargs[param] for param in params})
+        client = Client()
+        client.force_login(self.get_user())
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            client.get(url)
+        return len(queries)
+
+    def test_every_route_has_budget(self):
+        """Для каждого маршрута объявлен бюджет запросов."""
+        missing = set(self.routes()) - set(self.query_budgets)
+        self.assertFalse(missing, f'Не задан бюджет запросов: {missing}')
+
+    def test_routes_fit_budgets(self):
+        """Ни один маршрут не превышает свой бюджет запросов."""
+        for name, params in self.routes().items():
+            with self.subTest(route=name):
+                self.assertLessEqual(
+                    self.count_queries(name, params),
+                    self.query_budgets[name],
+                )
+
+    def test_queries_do_not_grow_with_page_size(self):
+        """Число запросов страниц со списками не растёт вместе
+        с размером страницы."""
+        routes = self.routes()
+        for name in self.paginated_routes:
+            with self.subTest(route=name):
+                counts = set()
+                for page_size in self.page_sizes:
+                    with override_settings(POSTS_PER_PAGE=page_size):
+                        counts.add(self.count_queries(name, routes[name]))
+                self.assertEqual(len(counts), 1)
@@ -1,9 +1,35 @@
 from django.contrib import admin
 
+from . import search
 from .models import Comment, Follow, Group, Post
+from .utils import EstimatedCountPaginator
 
 
-class PostAdmin(admin.ModelAdmin):
+class IndexedSearchMixin:
+    """Поиск в админке по полнотекстовому индексу вместо LIKE
+    по search_fields."""
+
+    search_index = None
+
+    def get_search_results(self, request, queryset, search_term):
+        matching = self.search_index.matching(search_term)
+        if matching is None:
+            return super().get_search_results(
+                request, queryset, search_term
+            )
+        return queryset.filter(pk__in=matching), False
+
+
+class ScalableAdmin(admin.ModelAdmin):
+    """Общие настройки списков для больших таблиц: оценка числа
+    строк вместо COUNT(*) и без второго подсчёта всей таблицы."""
+
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    empty_value_display = '-пусто-'
+
+
+class PostAdmin(IndexedSearchMixin, ScalableAdmin):
     list_display = (
         'pk',
         'text',
@@ -11,23 +37,25 @@ class PostAdmin(admin.ModelAdmin):
         'author',
         'group'
     )
-    list_editable = ('group',)
+    list_select_related = ('author', 'group')
+    autocomplete_fields = ('author', 'group')
     search_fields = ('text',)
+    search_index = search.posts
     list_filter = ('pub_date',)
-    empty_value_display = '-пусто-'
+    date_hierarchy = 'pub_date'
 
 
-class GroupAdmin(admin.ModelAdmin):
+class GroupAdmin(IndexedSearchMixin, ScalableAdmin):
     list_display = (
         'slug',
         'title',
         'description',
     )
     search_fields = ('title',)
-    empty_value_display = '-пусто-'
+    search_index = search.groups
 
 
-class CommentAdmin(admin.ModelAdmin):
+class CommentAdmin(IndexedSearchMixin, ScalableAdmin):
     list_display = (
         'pk',
         'author',
@@ -35,26 +63,23 @@ class CommentAdmin(admin.ModelAdmin):
         'post',
         'created',
     )
+    list_select_related = ('author', 'post')
     list_editable = ('text',)
+    autocomplete_fields = ('author', 'post')
     search_fields = ('text',)
-    list_filter = (
-        'author',
-        'text',
-        'post',
-        'created',
-    )
-    empty_value_display = '-пусто-'
+    search_index = search.comments
+    list_filter = ('created',)
+    date_hierarchy = 'created'
 
 
-class FollowAdmin(admin.ModelAdmin):
+class FollowAdmin(ScalableAdmin):
     list_display = (
         'user',
         'author',
     )
-    list_filter = (
-        'user',
-        'author',
-    )
+    list_select_related = ('user', 'author')
+    autocomplete_fields = ('user', 'author')
+    search_fields = ('=user__username', '=author__username')
 
 
 admin.site.register(Post, PostAdmin)
@@ -0,0 +1,276 @@
+"""Замеры view постов на синтетических наборах данных.
+
+Каждый набор из DATASETS генерируется seeding в отдельной тестовой
+базе и с отдельным пустым кешем, после чего view вызываются
+тестовым клиентом от имени залогиненного пользователя: кеш
+страниц для анонимов не мешает замеру, кеш фрагментов работает
+как в проде. Отдельно замеряется рендер навигации по страницам
+при разном их числе. Результаты сохраняются в JSON и сравниваются
+с прошлым прогоном.
+"""
+import datetime
+import math
+import shutil
+import tempfile
+import time
+from contextlib import contextmanager
+
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Count
+from django.template.backends.django import Template
+from django.template.loader import render_to_string
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from core.cache import isolated_caches
+
+from . import seeding
+from .models import Follow, Group, Post, User
+from .utils import WindowedPaginator
+
+DATASETS = {
+    'small': {
+        'users': 100, 'groups': 5, 'posts': 2000,
+        'comments': 4000, 'follows': 1000,
+    },
+    'medium': {
+        'users': 1000, 'groups': 20, 'posts': 20000,
+        'comments': 40000, 'follows': 10000,
+    },
+    'large': {
+        'users': 5000, 'groups': 50, 'posts': 100000,
+        'comments': 200000, 'follows': 50000,
+    },
+}
+VIEWS = (
+    'index', 'group_posts', 'profile', 'post_detail',
+    'follow_index', 'post_create', 'add_comment',
+)
+PERCENTILES = (50, 90, 99)
+NAVIGATION_PAGE_COUNTS = (10, 1000, 100000)
+REGRESSION_THRESHOLD = 0.2
+
+
+def percentile(values, rank):
+    """Перцентиль rank по ближайшему рангу."""
+    ordered = sorted(values)
+    index = max(math.ceil(len(ordered) * rank / 100) - 1, 0)
+    return ordered[index]
+
+
+@contextmanager
+def render_timer():
+    """Собирает длительности рендера шаблонов, которые рендерят
+    сами view. Вложенные шаблоны входят во время внешнего."""
+    durations = []
+    render = Template.render
+    depth = 0
+
+    def timed_render(self, *args, **kwargs):
+        nonlocal depth
+        depth += 1
+        started = time.perf_counter()
+        try:
+            return render(self, *args, **kwargs)
+        finally:
+            depth -= 1
+            if not depth:
+                durations.append(time.perf_counter() - started)
+
+    Template.render = timed_render
+    try:
+        yield durations
+    finally:
+        Template.render = render
+
+
+def view_requests():
+    """Запросы к view: имя -> (метод, url, данные).
+
+    Берутся самые тяжёлые объекты набора: группа и автор с наибольшим
+    числом постов, пост с наибольшим числом комментариев.
+    """
+    group = Group.objects.order_by('-posts_count', 'pk').first()
+    author = User.objects.annotate(
+        total=Count('posts')
+    ).order_by('-total', 'pk').first()
+    post = Post.objects.order_by('-comments_count', 'pk').first()
+    return {
+        'index': ('get', reverse('posts:index'), None),
+        'group_posts': (
+            'get', reverse('posts:group', args=[group.slug]), None
+        ),
+        'profile': (
+            'get', reverse('posts:profile', args=[author.username]), None
+        ),
+        'post_detail': (
+            'get', reverse('posts:post_detail', args=[post.pk]), None
+        ),
+        'follow_index': ('get', reverse('posts:follow_index'), None),
+        'post_create': (
+            'post', reverse('posts:post_create'), {'text': 'Замер'}
+        ),
+        'add_comment': (
+            'post', reverse('posts:add_comment', args=[post.pk]),
+            {'text': 'Замер'}
+        ),
+    }
+
+
+def benchmark_user():
+    """Пользователь с наибольшим числом подписок: его лента
+    подписок самая тяжёлая."""
+    user_id = Follow.objects.values('user').annotate(
+        total=Count('pk')
+    ).order_by('-total', 'user').values_list('user', flat=True).first()
+    return User.objects.get(pk=user_id)
+
+
+def measure(client, method, url, data, iterations, warmup, cold):
+    """Время ответа, число и время запросов и время рендера
+    в миллисекундах за iterations вызовов после warmup прогревочных."""
+    latencies, queries, db_times, render_times = [], [], [], []
+    for number in range(warmup + iterations):
+        if cold:
+            cache.clear()
+        with render_timer() as rendered, \
+                CaptureQueriesContext(connection) as captured:
+            started = time.perf_counter()
+            getattr(client, method)(url, data)
+            elapsed = time.perf_counter() - started
+        if number < warmup:
+            continue
+        latencies.append(elapsed * 1000)
+        queries.append(len(captured))
+        db_times.append(
+            sum(float(query['time']) for query in captured) * 1000
+        )
+        render_times.append(sum(rendered) * 1000)
+    stats = {
+        f'p{rank}_ms': round(percentile(latencies, rank), 3)
+        for rank in PERCENTILES
+    }
+    stats.update(
+        mean_ms=round(sum(latencies) / iterations, 3),
+        queries=max(queries),
+        db_ms=round(sum(db_times) / iterations, 3),
+        render_ms=round(sum(render_times) / iterations, 3),
+    )
+    return stats
+
+
+def run_views(iterations=30, warmup=3, cold=False, views=VIEWS):
+    """Замеры views на данных текущей базы: имя view -> статистика."""
+    requests = view_requests()
+    client = Client()
+    client.force_login(benchmark_user())
+    cache.clear()
+    with override_settings(DEBUG=False, ALLOWED_HOSTS=['testserver']):
+        return {
+            name: measure(client, *requests[name], iterations=iterations,
+                          warmup=warmup, cold=cold)
+            for name in views
+        }
+
+
+def navigation_render_times(page_counts=NAVIGATION_PAGE_COUNTS,
+                            iterations=200):
+    """Время рендера навигации по страницам в миллисекундах:
+    число страниц -> статистика. Текущей берётся средняя страница."""
+    results = {}
+    for num_pages in page_counts:
+        paginator = WindowedPaginator(range(num_pages * 10), 10)
+        page_obj = paginator.get_page(num_pages // 2)
+        page_obj.page_window = paginator.get_elided_page_range(
+            page_obj.number
+        )
+        durations = []
+        for _ in range(iterations):
+            started = time.perf_counter()
+            render_to_string(
+                'posts/includes/paginator.html', {'page_obj': page_obj}
+            )
+            durations.append((time.perf_counter() - started) * 1000)
+        results[num_pages] = {
+            f'p{rank}_ms': round(percentile(durations, rank), 4)
+            for rank in PERCENTILES
+        }
+    return results
+
+
+@contextmanager
+def isolated_cache():
+    """Отдельный пустой кеш на время замера.
+
+    Рабочий кеш не очищается и не засоряется синтетическими
+    фрагментами, лентами и поколениями тегов. L1 процесса
+    очищается на входе и на выходе.
+    """
+    directory = tempfile.mkdtemp(prefix='benchmarks-cache-')
+    try:
+        with override_settings(CACHES=isolated_caches(directory)):
+            cache.clear()
+            try:
+                yield
+            finally:
+                cache.clear()
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def run_dataset(sizes, seed=None, **options):
+    """Генерирует набор sizes в отдельной тестовой базе и с отдельным
+    кешем, замеряет views и удаляет и то и другое. Рабочие база
+    и кеш не затрагиваются."""
+    with isolated_cache():
+        old_name = connection.creation.create_test_db(
+            verbosity=0, autoclobber=True, serialize=False
+        )
+        try:
+            seeding.seed_dataset(seed=seed, **sizes)
+            return run_views(**options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+def run(datasets, seed=None, **options):
+    """Прогон по наборам DATASETS с именами datasets."""
+    return {
+        'created': datetime.datetime.now().isoformat(timespec='seconds'),
+        'options': dict(options, seed=seed),
+        'datasets': {
+            name: {
+                'sizes': DATASETS[name],
+                'views': run_dataset(DATASETS[name], seed=seed, **options),
+            }
+            for name in datasets
+        },
+        'navigation': navigation_render_times(),
+    }
+
+
+def compare(results, baseline, threshold=REGRESSION_THRESHOLD):
+    """Регрессии относительно baseline: строки с описанием views,
+    у которых p50 или p90 выросли больше чем на threshold или
+    выросло число запросов."""
+    regressions = []
+    for dataset, current in results['datasets'].items():
+        previous = baseline['datasets'].get(dataset, {}).get('views', {})
+        for view, stats in current['views'].items():
+            if view not in previous:
+                continue
+            old = previous[view]
+            for metric in ('p50_ms', 'p90_ms'):
+                if stats[metric] > old[metric] * (1 + threshold):
+                    regressions.append(
+                        f'{dataset}/{view}: {metric} '
+                        f'{old[metric]} -> {stats[metric]}'
+                    )
+            if stats['queries'] > old['queries']:
+                regressions.append(
+                    f'{dataset}/{view}: queries '
+                    f'{old["queries"]} -> {stats["queries"]}'
+                )
+    return regressions
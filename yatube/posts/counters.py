@@ -0,0 +1,75 @@
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from .models import (AuthorStats, Comment, Follow, Group, Post, StoredImage,
+                     User)
+
+
+def bump(queryset, field, delta=1):
+    """Атомарно сдвигает счётчик в базе, не уводя его ниже нуля."""
+    if delta < 0:
+        queryset = queryset.filter(**{f'{field}__gte': -delta})
+    queryset.update(**{field: F(field) + delta})
+
+
+def count_of(queryset, field):
+    """Подзапрос с числом строк queryset для каждого значения field."""
+    return Coalesce(
+        Subquery(
+            queryset.filter(**{field: OuterRef('pk')}).order_by().values(
+                field
+            ).annotate(total=Count('pk')).values('total')
+        ),
+        0
+    )
+
+
+def recount_images():
+    """Пересчитывает ссылки постов на файлы картинок."""
+    StoredImage.objects.bulk_create(
+        (
+            StoredImage(name=name)
+            for name in Post.objects.exclude(image='').order_by().values_list(
+                'image', flat=True
+            ).distinct()
+        ),
+        ignore_conflicts=True,
+    )
+    StoredImage.objects.update(
+        references=count_of(Post.objects.all(), 'image')
+    )
+
+
+def create_missing_stats(users=None):
+    """Создаёт пустые AuthorStats пользователям без них.
+
+    Нужна после bulk_create пользователей: сигнал post_save,
+    который обычно создаёт строку, при этом не срабатывает.
+    """
+    if users is None:
+        users = User.objects.all()
+    AuthorStats.objects.bulk_create(
+        (
+            AuthorStats(user_id=user_id)
+            for user_id in users.filter(
+                stats__isnull=True
+            ).values_list('pk', flat=True)
+        ),
+        ignore_conflicts=True,
+    )
+
+
+def recount():
+    """Пересчитывает все денормализованные счётчики по исходным
+    таблицам и создаёт недостающие AuthorStats и StoredImage."""
+    create_missing_stats()
+    AuthorStats.objects.update(
+        posts_count=count_of(Post.objects.all(), 'author'),
+        followers_count=count_of(Follow.objects.all(), 'author'),
+        following_count=count_of(Follow.objects.all(), 'user'),
+    )
+    Group.objects.update(posts_count=count_of(Post.objects.all(), 'group'))
+    Post.objects.update(
+        comments_count=count_of(Comment.objects.all(), 'post')
+    )
+    recount_images()
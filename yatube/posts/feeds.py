@@ -0,0 +1,373 @@
+import heapq
+import itertools
+from datetime import datetime
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Count
+
+from .models import CelebrityAuthor, FeedEntry, Follow, Post
+from .utils import cache_reset, cache_version
+
+FEED_BATCH_SIZE = 500
+FEED_ORDERING = ('-pub_date', 'pk')
+TIMELINE_KEY = 'posts:timeline:{}'
+FEED_TAG = 'feed:{}'
+
+# RANK, а не ROW_NUMBER: как и trim, граница по pub_date сохраняет
+# все посты с одинаковой датой.
+REBUILD_FEEDS = '''
+    INSERT INTO posts_feedentry (user_id, post_id, author_id, pub_date)
+    SELECT user_id, post_id, author_id, pub_date FROM (
+        SELECT posts_follow.user_id, posts_post.id AS post_id,
+               posts_post.author_id, posts_post.pub_date,
+               RANK() OVER (
+                   PARTITION BY posts_follow.user_id
+                   ORDER BY posts_post.pub_date DESC
+               ) AS position
+        FROM posts_follow
+        JOIN posts_post ON posts_post.author_id = posts_follow.author_id
+        WHERE posts_follow.author_id NOT IN (
+            SELECT author_id FROM posts_celebrityauthor
+        )
+    ) AS ranked
+    WHERE position <= %s
+'''
+TRIM_FEEDS = '''
+    DELETE FROM posts_feedentry WHERE id IN (
+        SELECT id FROM (
+            SELECT id, RANK() OVER (
+                PARTITION BY user_id ORDER BY pub_date DESC
+            ) AS position
+            FROM posts_feedentry
+            WHERE user_id IN (
+                SELECT user_id FROM posts_feedentry
+                GROUP BY user_id HAVING COUNT(*) > %s
+            )
+        ) AS ranked
+        WHERE position > %s
+    )
+'''
+
+
+def is_celebrity(author_id):
+    return CelebrityAuthor.objects.filter(author_id=author_id).exists()
+
+
+def push_post(post):
+    """Раскладывает новый пост в ленты всех подписчиков автора.
+
+    Посты популярных авторов не раскладываются: их подмешивает
+    follow_feed при чтении. Ленты здесь не обрезаются, чтобы запись
+    поста стоила одной вставки, их обрезает trim_feeds.
+    """
+    if is_celebrity(post.author_id):
+        return
+    follower_ids = Follow.objects.filter(
+        author_id=post.author_id
+    ).values_list('user_id', flat=True)
+    FeedEntry.objects.bulk_create(
+        (
+            FeedEntry(
+                user_id=follower_id,
+                post_id=post.pk,
+                author_id=post.author_id,
+                pub_date=post.pub_date,
+            )
+            for follower_id in follower_ids.iterator()
+        ),
+        batch_size=FEED_BATCH_SIZE,
+        ignore_conflicts=True,
+    )
+
+
+def feed_version(user_id):
+    """Версия кеша ленты подписок: одно поколение на подписчика."""
+    return cache_version(FEED_TAG.format(user_id))
+
+
+def reset_feeds(user_ids):
+    """Сбрасывает кеш лент подписок пользователей user_ids."""
+    cache_reset(*(FEED_TAG.format(user_id) for user_id in user_ids))
+
+
+def reset_follower_feeds(author_ids):
+    """Сбрасывает кеш лент подписок всех подписчиков авторов:
+    их посты, имена и группы видны в этих лентах."""
+    reset_feeds(
+        Follow.objects.filter(
+            author_id__in=author_ids
+        ).values_list('user_id', flat=True).distinct()
+    )
+
+
+def backfill(user_id, author_id):
+    """Добавляет в ленту последние посты автора после подписки."""
+    if is_celebrity(author_id):
+        return
+    posts = Post.objects.filter(author_id=author_id).order_by(
+        '-pub_date'
+    ).values_list('pk', 'pub_date')[:settings.POSTS_FEED_MAX_LENGTH]
+    FeedEntry.objects.bulk_create(
+        (
+            FeedEntry(
+                user_id=user_id,
+                post_id=post_id,
+                author_id=author_id,
+                pub_date=pub_date,
+            )
+            for post_id, pub_date in posts
+        ),
+        batch_size=FEED_BATCH_SIZE,
+        ignore_conflicts=True,
+    )
+    trim(user_id)
+
+
+def trim(user_id):
+    """Обрезает ленту до POSTS_FEED_MAX_LENGTH последних записей."""
+    boundary = FeedEntry.objects.filter(user_id=user_id).order_by(
+        '-pub_date'
+    ).values_list('pub_date', flat=True)[
+        settings.POSTS_FEED_MAX_LENGTH - 1:settings.POSTS_FEED_MAX_LENGTH
+    ]
+    boundary = list(boundary)
+    if boundary:
+        FeedEntry.objects.filter(
+            user_id=user_id,
+            pub_date__lt=boundary[0]
+        ).delete()
+
+
+def trim_feeds():
+    """Обрезает ленты длиннее POSTS_FEED_MAX_LENGTH с той же границей
+    по pub_date, что trim. Ленты в пределах длины не ранжируются.
+
+    Возвращает число удалённых записей.
+    """
+    limit = settings.POSTS_FEED_MAX_LENGTH
+    with connection.cursor() as cursor:
+        cursor.execute(TRIM_FEEDS, [limit, limit])
+        return cursor.rowcount
+
+
+def drop_author(user_id, author_id):
+    """Убирает из ленты посты автора после отписки."""
+    FeedEntry.objects.filter(user_id=user_id, author_id=author_id).delete()
+
+
+def rebuild():
+    """Пересобирает ленты всех пользователей по текущим подпискам.
+
+    Ленты собираются одним INSERT ... SELECT с тем же результатом,
+    что backfill и trim по каждой подписке.
+    """
+    FeedEntry.objects.all().delete()
+    with connection.cursor() as cursor:
+        cursor.execute(REBUILD_FEEDS, [settings.POSTS_FEED_MAX_LENGTH])
+
+
+def reclassify(threshold):
+    """Переводит авторов между раздачей постов при записи и
+    подмешиванием при чтении по числу подписчиков.
+
+    Возвращает множества id повышенных и пониженных авторов.
+    """
+    followers = dict(
+        Follow.objects.values('author').annotate(
+            followers_count=Count('pk')
+        ).filter(
+            followers_count__gte=threshold
+        ).values_list('author', 'followers_count')
+    )
+    current = set(
+        CelebrityAuthor.objects.values_list('author_id', flat=True)
+    )
+    promoted = set(followers) - current
+    demoted = current - set(followers)
+
+    CelebrityAuthor.objects.bulk_create(
+        CelebrityAuthor(
+            author_id=author_id,
+            followers_count=followers[author_id]
+        )
+        for author_id in promoted
+    )
+    FeedEntry.objects.filter(author_id__in=promoted).delete()
+    for author_id in current - demoted:
+        CelebrityAuthor.objects.filter(author_id=author_id).update(
+            followers_count=followers[author_id]
+        )
+
+    CelebrityAuthor.objects.filter(author_id__in=demoted).delete()
+    follows = Follow.objects.filter(
+        author_id__in=demoted
+    ).values_list('user_id', 'author_id')
+    for user_id, author_id in follows.iterator():
+        backfill(user_id, author_id)
+
+    return promoted, demoted
+
+
+def merge_key(ordering):
+    """Ключ для heapq.merge, повторяющий ordering по полям поста."""
+    def key(post):
+        values = []
+        for field in ordering:
+            value = getattr(post, field.lstrip('-'))
+            if isinstance(value, datetime):
+                value = value.timestamp()
+            values.append(-value if field.startswith('-') else value)
+        return tuple(values)
+    return key
+
+
+class MergedFeed:
+    """Ленивое слияние упорядоченных querysets постов.
+
+    Каждый источник читается только до конца запрошенного среза,
+    так что страница стоит по одному top-N запросу на источник.
+    Поддерживает то, что нужно паджинаторам: count, filter,
+    order_by и срезы.
+    """
+
+    ordered = True
+
+    def __init__(self, *sources, ordering=FEED_ORDERING):
+        self.sources = sources
+        self.ordering = ordering
+
+    def count(self):
+        return sum(source.count() for source in self.sources)
+
+    def filter(self, *args, **kwargs):
+        return MergedFeed(
+            *(source.filter(*args, **kwargs) for source in self.sources),
+            ordering=self.ordering
+        )
+
+    def order_by(self, *ordering):
+        return MergedFeed(
+            *(source.order_by(*ordering) for source in self.sources),
+            ordering=ordering
+        )
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            return self[index:index + 1][0]
+        merged = heapq.merge(
+            *(source[:index.stop] for source in self.sources),
+            key=merge_key(self.ordering)
+        )
+        return list(itertools.islice(merged, index.start, index.stop))
+
+
+def push_feed(user):
+    """Посты ленты подписок в порядке публикации.
+
+    Разложенные при записи посты берутся из FeedEntry, посты
+    популярных авторов подмешиваются при чтении.
+    """
+    pushed = Post.objects.filter(feed_entries__user=user).select_related(
+        'author', 'group'
+    ).order_by('-feed_entries__pub_date')
+    celebrity_ids = list(
+        Follow.objects.filter(
+            user=user,
+            author__celebrity__isnull=False,
+        ).values_list('author_id', flat=True)
+    )
+    if not celebrity_ids:
+        return pushed
+
+    pulled = Post.objects.filter(
+        author_id__in=celebrity_ids
+    ).select_related('author', 'group').order_by(*FEED_ORDERING)
+    return MergedFeed(pushed, pulled)
+
+
+def load_timeline(author_id):
+    """Последние посты автора как список ключей (-pub_date, id)."""
+    posts = Post.objects.filter(author_id=author_id).order_by(
+        *FEED_ORDERING
+    ).values_list('pub_date', 'pk')[:settings.POSTS_TIMELINE_LENGTH]
+    return [(-pub_date.timestamp(), pk) for pub_date, pk in posts]
+
+
+def refresh_timeline(author_id):
+    """Обновляет закешированную ленту автора после записи поста.
+
+    Ленты авторов нужны только бэкенду timelines, остальным
+    достаточно сбросить устаревшую копию.
+    """
+    key = TIMELINE_KEY.format(author_id)
+    if settings.POSTS_FEED_BACKEND != 'timelines':
+        cache.delete(key)
+        return
+    cache.set(key, load_timeline(author_id), settings.POSTS_TIMELINE_TIMEOUT)
+
+
+class TimelineFeed:
+    """Лента подписок, собранная слиянием кешированных лент авторов.
+
+    Слияние идёт кучей по ключам (-pub_date, id), из базы
+    загружаются только посты запрошенного среза.
+    """
+
+    ordered = True
+    supports_cursor = False
+
+    def __init__(self, timelines):
+        self.timelines = timelines
+
+    def count(self):
+        return sum(len(timeline) for timeline in self.timelines)
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            return self[index:index + 1][0]
+        keys = itertools.islice(
+            heapq.merge(*self.timelines), index.start, index.stop
+        )
+        post_ids = [pk for _, pk in keys]
+        posts = Post.objects.select_related('author', 'group').in_bulk(
+            post_ids
+        )
+        return [posts[pk] for pk in post_ids if pk in posts]
+
+
+def timeline_feed(user):
+    author_ids = list(
+        Follow.objects.filter(user=user).values_list('author_id', flat=True)
+    )
+    keys = {TIMELINE_KEY.format(author_id): author_id
+            for author_id in author_ids}
+    timelines = cache.get_many(keys)
+
+    missing = {
+        key: load_timeline(author_id)
+        for key, author_id in keys.items()
+        if key not in timelines
+    }
+    cache.set_many(missing, settings.POSTS_TIMELINE_TIMEOUT)
+    timelines.update(missing)
+    return TimelineFeed(list(timelines.values()))
+
+
+def follow_feed(user):
+    """Посты ленты подписок пользователя.
+
+    Способ сборки задаёт POSTS_FEED_BACKEND: 'push' - материализованная
+    лента с подмешиванием популярных авторов, 'timelines' - слияние
+    кешированных лент авторов, 'query' - выборка по подпискам
+    при каждом запросе.
+    """
+    backend = settings.POSTS_FEED_BACKEND
+    if backend == 'timelines':
+        return timeline_feed(user)
+    if backend == 'query':
+        return Post.objects.filter(
+            author__following__user=user
+        ).select_related('author', 'group')
+    return push_feed(user)
@@ -1,6 +1,11 @@
 from django import forms
+from django.core.files.uploadedfile import UploadedFile
+from django.db import transaction
+from PIL import Image
 
 from .models import Comment, Post
+from .thumbnails import schedule_thumbnails
+from .uploads import normalize_image
 
 
 class PostForm(forms.ModelForm):
@@ -20,6 +25,34 @@ class PostForm(forms.ModelForm):
             'image': 'Картинка для поста',
         }
 
+    def clean_image(self):
+        """Новая картинка сохраняется уже нормализованной."""
+        image = self.cleaned_data.get('image')
+        if isinstance(image, UploadedFile):
+            try:
+                return normalize_image(image)
+            except (OSError, Image.DecompressionBombError):
+                raise forms.ValidationError(
+                    'Не удалось прочитать картинку: файл повреждён '
+                    'или слишком большой.',
+                    code='invalid_image',
+                )
+        return image
+
+    def save(self, commit=True):
+        """Сохраняет пост и заранее готовит миниатюры новой картинки.
+
+        Имя файла окончательно известно только после сохранения
+        поста, поэтому очередь ставится после коммита.
+        """
+        post = super().save(commit)
+        if 'image' in self.changed_data:
+            def schedule():
+                if post.image:
+                    schedule_thumbnails(post.image.name)
+            transaction.on_commit(schedule)
+        return post
+
 
 class CommentForm(forms.ModelForm):
     class Meta:
@@ -0,0 +1,123 @@
+"""Учёт ссылок постов на файлы картинок.
+
+Одинаковые картинки лежат в хранилище в одном экземпляре
+(posts.storage), поэтому файл удаляется только тогда, когда
+на него не ссылается ни один пост.
+"""
+import logging
+import posixpath
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from sorl.thumbnail import delete as delete_with_thumbnails
+
+from . import counters
+from .models import ImageVariant, Post, StoredImage
+from .storage import content_name
+from .thumbnails import VARIANTS_KEY, image_key
+from .utils import cache_clear, post_tags
+
+logger = logging.getLogger(__name__)
+
+
+def acquire(name):
+    """Добавляет ссылку на файл."""
+    StoredImage.objects.bulk_create(
+        [StoredImage(name=name)], ignore_conflicts=True
+    )
+    counters.bump(StoredImage.objects.filter(name=name), 'references')
+
+
+def release(name):
+    """Снимает ссылку на файл; файл без ссылок удаляется после
+    коммита."""
+    counters.bump(StoredImage.objects.filter(name=name), 'references', -1)
+    transaction.on_commit(lambda: delete_unreferenced(name))
+
+
+def delete_unreferenced(name):
+    """Удаляет файл, на который не осталось ссылок.
+
+    Загрузка того же содержимого могла найти файл до удаления
+    строки, а взять ссылку после. Такой файл моложе
+    POSTS_IMAGE_REUSE_GRACE секунд остаётся вместе со строкой
+    без ссылок, его подберёт dedupe.
+    """
+    storage = Post._meta.get_field('image').storage
+    reused_since = time.time() - settings.POSTS_IMAGE_REUSE_GRACE
+    try:
+        with transaction.atomic():
+            deleted, _ = StoredImage.objects.filter(
+                name=name, references=0
+            ).delete()
+            if not deleted:
+                return
+            if not storage.discard(name, reused_since):
+                StoredImage.objects.create(name=name)
+                return
+        delete_image(name, delete_file=False)
+    except Exception:
+        logger.exception('Не удалось удалить картинку %s', name)
+
+
+def delete_image(name, delete_file=True):
+    """Удаляет файл вместе с миниатюрами и вариантами."""
+    delete_with_thumbnails(name, delete_file=delete_file)
+    ImageVariant.objects.filter(source=name).delete()
+    cache.delete_many([
+        VARIANTS_KEY.format(alias, image_key(name))
+        for alias in settings.POSTS_IMAGE_VARIANTS
+    ])
+
+
+def relink(name, new_name):
+    """Переводит посты на новый файл и удаляет старый."""
+    posts = Post.objects.filter(image=name)
+    tags = {
+        tag
+        for post in posts.only('pk', 'author_id', 'group_id')
+        for tag in post_tags(post)
+    }
+    with transaction.atomic():
+        posts.update(image=new_name)
+        StoredImage.objects.filter(name=name).delete()
+    delete_image(name)
+    cache_clear(*tags)
+
+
+def dedupe(dry_run=False):
+    """Переносит картинки постов под имена по хешу содержимого.
+
+    Одинаковые файлы сливаются в один, старые файлы удаляются
+    вместе с миниатюрами, ссылки пересчитываются. Возвращает
+    списки перенесённых и пропавших из хранилища файлов.
+    """
+    field = Post._meta.get_field('image')
+    names = Post.objects.exclude(image='').order_by().values_list(
+        'image', flat=True
+    ).distinct()
+    moved, missing = [], []
+    for name in list(names):
+        if not field.storage.exists(name):
+            missing.append(name)
+            continue
+        upload_name = field.generate_filename(None, posixpath.basename(name))
+        with field.storage.open(name) as content:
+            if dry_run:
+                new_name = content_name(upload_name, content)
+            else:
+                new_name = field.storage.save(upload_name, content)
+        if new_name == name:
+            continue
+        moved.append(name)
+        if not dry_run:
+            relink(name, new_name)
+    if not dry_run:
+        counters.recount_images()
+        for name in StoredImage.objects.filter(
+            references=0
+        ).values_list('name', flat=True):
+            delete_unreferenced(name)
+    return moved, missing
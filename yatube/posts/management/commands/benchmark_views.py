@@ -0,0 +1,90 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from posts import benchmarks
+
+
+class Command(BaseCommand):
+    help = ('Замеряет view постов на синтетических наборах данных '
+            'и сравнивает результат с прошлым прогоном')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--datasets',
+            nargs='+',
+            choices=list(benchmarks.DATASETS),
+            default=['small', 'medium'],
+        )
+        parser.add_argument(
+            '--views',
+            nargs='+',
+            choices=benchmarks.VIEWS,
+            default=list(benchmarks.VIEWS),
+        )
+        parser.add_argument('--iterations', type=int, default=30)
+        parser.add_argument('--warmup', type=int, default=3)
+        parser.add_argument(
+            '--cold',
+            action='store_true',
+            help='Очищать кеш перед каждым запросом',
+        )
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument(
+            '--output',
+            help='Файл для сохранения результатов в JSON',
+        )
+        parser.add_argument(
+            '--baseline',
+            help='JSON прошлого прогона для поиска регрессий',
+        )
+        parser.add_argument(
+            '--threshold',
+            type=float,
+            default=benchmarks.REGRESSION_THRESHOLD,
+            help='Допустимый рост p50 и p90, доля от прошлого значения',
+        )
+
+    def handle(self, *args, **options):
+        results = benchmarks.run(
+            options['datasets'],
+            seed=options['seed'],
+            iterations=options['iterations'],
+            warmup=options['warmup'],
+            cold=options['cold'],
+            views=options['views'],
+        )
+        for dataset, result in results['datasets'].items():
+            for view, stats in result['views'].items():
+                self.stdout.write(
+                    f'{dataset:<8} {view:<14} '
+                    f'p50 {stats["p50_ms"]:>9.2f} ms  '
+                    f'p90 {stats["p90_ms"]:>9.2f} ms  '
+                    f'p99 {stats["p99_ms"]:>9.2f} ms  '
+                    f'запросов {stats["queries"]:>3}  '
+                    f'рендер {stats["render_ms"]:>8.2f} ms'
+                )
+        for num_pages, stats in results['navigation'].items():
+            self.stdout.write(
+                f'навигация {num_pages:>7} стр.  '
+                f'p50 {stats["p50_ms"]:>7.3f} ms  '
+                f'p90 {stats["p90_ms"]:>7.3f} ms  '
+                f'p99 {stats["p99_ms"]:>7.3f} ms'
+            )
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as stream:
+                json.dump(results, stream, ensure_ascii=False, indent=2)
+
+        if not options['baseline']:
+            return
+        with open(options['baseline'], encoding='utf-8') as stream:
+            baseline = json.load(stream)
+        regressions = benchmarks.compare(
+            results, baseline, options['threshold']
+        )
+        if regressions:
+            raise CommandError(
+                'Регрессии относительно прошлого прогона:\n'
+                + '\n'.join(regressions)
+            )
+        self.stdout.write(self.style.SUCCESS('Регрессий не найдено'))
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from posts import images
+
+
+class Command(BaseCommand):
+    help = ('Переносит картинки постов в хранилище по хешу содержимого '
+            'и удаляет дубликаты')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Только показать, какие файлы будут перенесены',
+        )
+
+    def handle(self, *args, **options):
+        moved, missing = images.dedupe(dry_run=options['dry_run'])
+        for name in missing:
+            self.stderr.write(f'Файл не найден: {name}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Перенесено файлов: {len(moved)}, не найдено: {len(missing)}'
+        ))
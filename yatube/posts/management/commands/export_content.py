@@ -0,0 +1,30 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from posts import transfer
+
+
+class Command(BaseCommand):
+    help = ('Выгружает группы, пользователей, посты, комментарии '
+            'и подписки в NDJSON')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path',
+            nargs='?',
+            default='-',
+            help='Файл для выгрузки, по умолчанию stdout',
+        )
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        if options['path'] == '-':
+            exported = transfer.export_content(self.stdout)
+        else:
+            with open(options['path'], 'w', encoding='utf-8') as stream:
+                exported = transfer.export_content(stream)
+        # Итог идёт в stderr, чтобы не смешиваться с выгрузкой в stdout.
+        self.stderr.write(transfer.summary(
+            'Выгружено', exported, time.monotonic() - started
+        ))
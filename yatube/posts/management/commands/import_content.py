@@ -0,0 +1,33 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from posts import transfer
+
+
+class Command(BaseCommand):
+    help = ('Загружает NDJSON, выгруженный export_content, и пересчитывает '
+            'счётчики, ленты и поисковый индекс')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path',
+            nargs='?',
+            default='-',
+            help='Файл с выгрузкой, по умолчанию stdin',
+        )
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        try:
+            if options['path'] == '-':
+                imported = transfer.import_content(sys.stdin)
+            else:
+                with open(options['path'], encoding='utf-8') as stream:
+                    imported = transfer.import_content(stream)
+        except ValueError as error:
+            raise CommandError(error)
+        self.stdout.write(self.style.SUCCESS(transfer.summary(
+            'Загружено', imported, time.monotonic() - started
+        )))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from posts import feeds
+
+
+class Command(BaseCommand):
+    help = 'Пересобирает материализованные ленты подписок'
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            feeds.rebuild()
+        self.stdout.write(self.style.SUCCESS('Ленты подписок пересобраны'))
@@ -0,0 +1,28 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from posts import feeds
+
+
+class Command(BaseCommand):
+    help = (
+        'Отмечает авторов с числом подписчиков не меньше порога: их посты '
+        'подмешиваются в ленты при чтении, а не раскладываются при записи'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--threshold',
+            type=int,
+            default=settings.POSTS_FEED_CELEBRITY_THRESHOLD,
+            help='Порог числа подписчиков',
+        )
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            promoted, demoted = feeds.reclassify(options['threshold'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Популярных авторов добавлено: {len(promoted)}, '
+            f'снято: {len(demoted)}'
+        ))
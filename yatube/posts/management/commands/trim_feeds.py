@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from posts import feeds
+
+
+class Command(BaseCommand):
+    help = (
+        'Обрезает материализованные ленты подписок, выросшие '
+        'дальше POSTS_FEED_MAX_LENGTH записей'
+    )
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            deleted = feeds.trim_feeds()
+        self.stdout.write(self.style.SUCCESS(
+            f'Удалено записей лент: {deleted}'
+        ))
@@ -0,0 +1,40 @@
+from django.db import migrations
+
+TOKENIZER = "tokenize = 'unicode61 remove_diacritics 2'"
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0016_storedimage'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            sql=[
+                f'CREATE VIRTUAL TABLE posts_post_search '
+                f'USING fts5(text, {TOKENIZER})',
+                'INSERT INTO posts_post_search (rowid, text) '
+                'SELECT id, text FROM posts_post',
+            ],
+            reverse_sql='DROP TABLE posts_post_search',
+        ),
+        migrations.RunSQL(
+            sql=[
+                f'CREATE VIRTUAL TABLE posts_comment_search '
+                f'USING fts5(text, post_id UNINDEXED, {TOKENIZER})',
+                'INSERT INTO posts_comment_search (rowid, text, post_id) '
+                'SELECT id, text, post_id FROM posts_comment',
+            ],
+            reverse_sql='DROP TABLE posts_comment_search',
+        ),
+        migrations.RunSQL(
+            sql=[
+                f'CREATE VIRTUAL TABLE posts_group_search '
+                f'USING fts5(title, {TOKENIZER})',
+                'INSERT INTO posts_group_search (rowid, title) '
+                'SELECT id, title FROM posts_group',
+            ],
+            reverse_sql='DROP TABLE posts_group_search',
+        ),
+    ]
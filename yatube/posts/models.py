@@ -2,20 +2,49 @@ from django.contrib.auth import get_user_model
 from django.db import models
 from django.urls import reverse
 
+from .storage import ContentAddressedStorage
+
 
 User = get_user_model()
 
 
-class Group(models.Model):
+class CounterFieldsMixin:
+    """Не даёт обычному save() затирать счётчики, которые меняются
+    только атомарными UPDATE из posts.counters."""
+
+    counter_fields = ()
+
+    def save(self, *args, **kwargs):
+        if (
+            not self._state.adding
+            and not kwargs.get('force_insert')
+            and kwargs.get('update_fields') is None
+        ):
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key
+                and field.name not in self.counter_fields
+            ]
+        super().save(*args, **kwargs)
+
+
+class Group(CounterFieldsMixin, models.Model):
     title = models.CharField(max_length=200)
     slug = models.SlugField(unique=True)
     description = models.TextField()
+    posts_count = models.PositiveIntegerField(
+        'Количество постов',
+        default=0,
+        editable=False,
+    )
+
+    counter_fields = ('posts_count',)
 
     def __str__(self):
         return self.title
 
 
-class Post(models.Model):
+class Post(CounterFieldsMixin, models.Model):
     text = models.TextField(
         'Текст поста',
         help_text='Введите текст поста',
@@ -28,7 +57,8 @@ class Post(models.Model):
         User,
         on_delete=models.CASCADE,
         related_name='posts',
-        verbose_name='Автор'
+        verbose_name='Автор',
+        db_index=False,
     )
     group = models.ForeignKey(
         Group,
@@ -37,13 +67,22 @@ class Post(models.Model):
         on_delete=models.SET_NULL,
         related_name='posts',
         verbose_name='Группа',
-        help_text='Группа, к которой будет относиться пост'
+        help_text='Группа, к которой будет относиться пост',
+        db_index=False,
     )
     image = models.ImageField(
         'Картинка',
         upload_to='posts/',
+        storage=ContentAddressedStorage(),
         blank=True
     )
+    comments_count = models.PositiveIntegerField(
+        'Количество комментариев',
+        default=0,
+        editable=False,
+    )
+
+    counter_fields = ('comments_count',)
 
     def __str__(self) -> str:
         return self.text[:15]
@@ -56,6 +95,21 @@ class Post(models.Model):
         verbose_name = 'Пост'
         verbose_name_plural = 'Посты'
 
+        indexes = [
+            models.Index(
+                fields=['author', '-pub_date'],
+                name='post_author_pub_date_idx'
+            ),
+            models.Index(
+                fields=['group', '-pub_date'],
+                name='post_group_pub_date_idx'
+            ),
+            models.Index(
+                fields=['-pub_date', 'id'],
+                name='post_pub_date_id_idx'
+            ),
+        ]
+
 
 class Comment(models.Model):
     text = models.TextField(
@@ -66,7 +120,8 @@ class Comment(models.Model):
         Post,
         on_delete=models.CASCADE,
         related_name='comments',
-        verbose_name='Пост'
+        verbose_name='Пост',
+        db_index=False,
     )
     author = models.ForeignKey(
         User,
@@ -87,17 +142,26 @@ class Comment(models.Model):
         verbose_name = 'Комментарий'
         verbose_name_plural = 'Комментарии'
 
+        indexes = [
+            models.Index(
+                fields=['post', '-created'],
+                name='comment_post_created_idx'
+            ),
+        ]
+
 
 class Follow(models.Model):
     user = models.ForeignKey(
         User,
         related_name='follower',
         on_delete=models.CASCADE,
+        db_index=False,
     )
     author = models.ForeignKey(
         User,
         related_name='following',
         on_delete=models.CASCADE,
+        db_index=False,
     )
 
     def __str__(self) -> str:
@@ -118,3 +182,154 @@ class Follow(models.Model):
                 name='unique_subscribing'
             )
         ]
+
+        indexes = [
+            models.Index(
+                fields=['author', 'user'],
+                name='follow_author_user_idx'
+            ),
+        ]
+
+
+class AuthorStats(models.Model):
+    """Счётчики пользователя, которые иначе пришлось бы считать
+    через COUNT(*) на каждой странице."""
+    user = models.OneToOneField(
+        User,
+        primary_key=True,
+        related_name='stats',
+        on_delete=models.CASCADE,
+        verbose_name='Пользователь',
+    )
+    posts_count = models.PositiveIntegerField('Количество постов', default=0)
+    followers_count = models.PositiveIntegerField(
+        'Количество подписчиков',
+        default=0,
+    )
+    following_count = models.PositiveIntegerField(
+        'Количество подписок',
+        default=0,
+    )
+
+    def __str__(self) -> str:
+        return str(self.user)
+
+    class Meta:
+        verbose_name = 'Счётчики пользователя'
+        verbose_name_plural = 'Счётчики пользователей'
+
+
+class CelebrityAuthor(models.Model):
+    """Автор с большим числом подписчиков.
+
+    Его посты не раскладываются по лентам при публикации, а
+    подмешиваются в ленту подписок при чтении.
+    """
+    author = models.OneToOneField(
+        User,
+        primary_key=True,
+        related_name='celebrity',
+        on_delete=models.CASCADE,
+        verbose_name='Автор',
+    )
+    followers_count = models.PositiveIntegerField(
+        'Подписчиков при классификации',
+        default=0,
+    )
+
+    def __str__(self) -> str:
+        return str(self.author)
+
+    class Meta:
+        verbose_name = 'Популярный автор'
+        verbose_name_plural = 'Популярные авторы'
+
+
+class FeedEntry(models.Model):
+    """Запись материализованной ленты подписок пользователя.
+
+    Пост раскладывается в ленты подписчиков при публикации, поэтому
+    лента читается одним проходом по индексу (user, pub_date).
+    """
+    user = models.ForeignKey(
+        User,
+        related_name='feed_entries',
+        on_delete=models.CASCADE,
+        db_index=False,
+    )
+    post = models.ForeignKey(
+        Post,
+        related_name='feed_entries',
+        on_delete=models.CASCADE,
+    )
+    author = models.ForeignKey(
+        User,
+        related_name='+',
+        on_delete=models.CASCADE,
+    )
+    pub_date = models.DateTimeField('Дата публикации')
+
+    def __str__(self) -> str:
+        return f'{self.user} FEED {self.post_id}'
+
+    class Meta:
+        ordering = ('-pub_date',)
+        verbose_name = 'Запись ленты'
+        verbose_name_plural = 'Записи ленты'
+
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'post'],
+                name='unique_feed_entry'
+            )
+        ]
+
+        indexes = [
+            models.Index(
+                fields=['user', '-pub_date', 'post'],
+                name='feed_user_pub_date_idx'
+            )
+        ]
+
+
+class ImageVariant(models.Model):
+    """Производная картинки поста определённой ширины и формата.
+
+    Создаётся вместе с миниатюрами после загрузки и по ней строится
+    srcset, чтобы браузер скачивал самую лёгкую подходящую копию.
+    """
+    source = models.CharField('Исходная картинка', max_length=255)
+    alias = models.CharField('Назначение', max_length=50)
+    format = models.CharField('Формат', max_length=10)
+    width = models.PositiveIntegerField('Ширина')
+    height = models.PositiveIntegerField('Высота')
+    name = models.CharField('Файл', max_length=255)
+
+    def __str__(self) -> str:
+        return self.name
+
+    class Meta:
+        ordering = ('source', 'alias', 'format', 'width')
+        verbose_name = 'Вариант картинки'
+        verbose_name_plural = 'Варианты картинок'
+
+        constraints = [
+            models.UniqueConstraint(
+                fields=['source', 'alias', 'format', 'width'],
+                name='unique_image_variant'
+            )
+        ]
+
+
+class StoredImage(models.Model):
+    """Файл картинки в хранилище и число постов, которые на него
+    ссылаются. Файл удаляется, когда ссылок не остаётся."""
+    name = models.CharField('Файл', max_length=255, primary_key=True)
+    references = models.PositiveIntegerField('Ссылок', default=0)
+
+    def __str__(self) -> str:
+        return self.name
+
+    class Meta:
+        verbose_name = 'Файл картинки'
+        verbose_name_plural = 'Файлы картинок'
@@ -0,0 +1,65 @@
+"""Состояние страниц постов для кеша анонимных ответов.
+
+Каждая функция возвращает пару (состояние, время последнего
+изменения) одним лёгким запросом или None, если объекта нет.
+Правки, которые не меняют даты, учитываются через версии тегов
+из posts.utils.
+"""
+from django.db.models import Max, OuterRef, Subquery
+
+from .models import Comment, Group, Post, User
+from .utils import cache_version
+
+
+def latest(queryset, date_field):
+    """Самая свежая дата связанных записей.
+
+    Коррелированный подзапрос с LIMIT 1 идёт по составному индексу
+    (связь, -дата), в отличие от MAX с GROUP BY.
+    """
+    return Subquery(
+        queryset.order_by(f'-{date_field}').values(date_field)[:1]
+    )
+
+
+def first(queryset):
+    return next(iter(queryset[:1]), None)
+
+
+def index_state(request):
+    latest_date = Post.objects.aggregate(latest=Max('pub_date'))['latest']
+    return (latest_date, cache_version('posts')), latest_date
+
+
+def group_state(request, slug):
+    group = first(Group.objects.filter(slug=slug).annotate(
+        latest=latest(Post.objects.filter(group=OuterRef('pk')), 'pub_date')
+    ).values_list('pk', 'title', 'description', 'posts_count', 'latest'))
+    if group is None:
+        return None
+    return group + (cache_version(f'group:{group[0]}'),), group[-1]
+
+
+def profile_state(request, username):
+    author = first(User.objects.filter(username=username).annotate(
+        latest=latest(Post.objects.filter(author=OuterRef('pk')), 'pub_date')
+    ).values_list(
+        'pk', 'first_name', 'last_name', 'stats__posts_count',
+        'stats__followers_count', 'stats__following_count', 'latest'
+    ))
+    if author is None:
+        return None
+    return author + (cache_version(f'author:{author[0]}'),), author[-1]
+
+
+def post_state(request, post_id):
+    post = first(Post.objects.filter(pk=post_id).annotate(
+        latest=latest(Comment.objects.filter(post=OuterRef('pk')), 'created')
+    ).values_list(
+        'pub_date', 'comments_count', 'author__first_name',
+        'author__last_name', 'author__stats__posts_count', 'latest'
+    ))
+    if post is None:
+        return None
+    last_modified = max(date for date in (post[0], post[-1]) if date)
+    return post + (cache_version(f'post:{post_id}'),), last_modified
@@ -0,0 +1,143 @@
+"""Полнотекстовый поиск по постам, комментариям и группам.
+
+Тексты лежат в виртуальных таблицах SQLite FTS5 (миграция
+0017_search_index), rowid строки индекса - pk объекта. Индекс
+обновляется сигналами при сохранении и удалении, а целиком
+пересобирается командой rebuild_search.
+"""
+import re
+
+from django.db import connection
+from django.db.models.expressions import RawSQL
+
+from .models import Comment, Group, Post
+
+TOKEN = re.compile(r'\w+')
+COMMENT_WEIGHT = 0.5
+GROUP_WEIGHT = 0.25
+
+RANKED_POSTS = f'''
+    SELECT post_id, SUM(score) AS score FROM (
+        SELECT rowid AS post_id, bm25(posts_post_search) AS score
+        FROM posts_post_search
+        WHERE posts_post_search MATCH %s
+        UNION ALL
+        SELECT post_id, bm25(posts_comment_search) * {COMMENT_WEIGHT}
+        FROM posts_comment_search
+        WHERE posts_comment_search MATCH %s
+        UNION ALL
+        SELECT posts_post.id, bm25(posts_group_search) * {GROUP_WEIGHT}
+        FROM posts_group_search
+        JOIN posts_post ON posts_post.group_id = posts_group_search.rowid
+        WHERE posts_group_search MATCH %s
+    )
+    GROUP BY post_id
+'''
+
+
+class RawSubquery(RawSQL):
+    """Сырой подзапрос для pk__in: RawSQL сам берёт SQL в скобки,
+    и SQLite принимает IN ((SELECT ...)) за скалярный подзапрос."""
+
+    def as_sql(self, compiler, connection):
+        return self.sql, self.params
+
+
+def match_expression(query):
+    """Запрос FTS5 из пользовательской строки: все слова запроса
+    в кавычках, чтобы операторы FTS5 не разбирались. None, если
+    слов нет."""
+    tokens = TOKEN.findall(query or '')
+    if not tokens:
+        return None
+    return ' '.join(f'"{token}"' for token in tokens)
+
+
+class SearchIndex:
+    """FTS5-индекс текстового поля модели."""
+
+    def __init__(self, table, field, extra_fields=()):
+        self.table = table
+        self.fields = (field,) + tuple(extra_fields)
+
+    def _insert_sql(self):
+        columns = ', '.join(self.fields)
+        values = ', '.join(['%s'] * (len(self.fields) + 1))
+        return (f'INSERT OR REPLACE INTO {self.table} (rowid, {columns}) '
+                f'VALUES ({values})')
+
+    def index(self, instance):
+        with connection.cursor() as cursor:
+            cursor.execute(self._insert_sql(), [instance.pk] + [
+                getattr(instance, field) for field in self.fields
+            ])
+
+    def remove(self, pk):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.table} WHERE rowid = %s', [pk])
+
+    def rebuild(self, queryset):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.table}')
+            cursor.executemany(
+                self._insert_sql(),
+                queryset.order_by().values_list(
+                    'pk', *self.fields
+                ).iterator()
+            )
+
+    def matching(self, query):
+        """Подзапрос с pk объектов, подходящих под запрос, или None."""
+        match = match_expression(query)
+        if match is None:
+            return None
+        return RawSubquery(
+            f'SELECT rowid FROM {self.table} WHERE {self.table} MATCH %s',
+            (match,)
+        )
+
+
+posts = SearchIndex('posts_post_search', 'text')
+comments = SearchIndex('posts_comment_search', 'text', ('post_id',))
+groups = SearchIndex('posts_group_search', 'title')
+
+
+class SearchResults:
+    """Посты, найденные по тексту, комментариям и названию группы,
+    по убыванию релевантности (bm25). Считаются и нарезаются на
+    страницы в базе, поэтому подходят для Paginator."""
+
+    supports_cursor = False
+
+    def __init__(self, query):
+        self.match = match_expression(query)
+
+    def _execute(self, sql, params=()):
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [self.match] * 3 + list(params))
+            return cursor.fetchall()
+
+    def count(self):
+        if self.match is None:
+            return 0
+        return self._execute(f'SELECT COUNT(*) FROM ({RANKED_POSTS})')[0][0]
+
+    def __getitem__(self, page):
+        if self.match is None:
+            return []
+        limit = page.stop - page.start
+        rows = self._execute(
+            f'{RANKED_POSTS} ORDER BY score, post_id DESC LIMIT %s OFFSET %s',
+            (limit, page.start)
+        )
+        found = Post.objects.select_related('author', 'group').in_bulk(
+            [post_id for post_id, _ in rows]
+        )
+        return [found[post_id] for post_id, _ in rows if post_id in found]
+
+
+def rebuild():
+    """Пересобирает все индексы по исходным таблицам."""
+    posts.rebuild(Post.objects.all())
+    comments.rebuild(Comment.objects.all())
+    groups.rebuild(Group.objects.all())
@@ -0,0 +1,154 @@
+"""Синтетический набор данных для проверки на реалистичных объёмах.
+
+Активность авторов, популярность групп, постов и авторов в графе
+подписок распределены по степенному закону: немногие авторы пишут
+большую часть постов и собирают большую часть подписчиков.
+"""
+import datetime
+import random
+from collections import Counter
+from itertools import accumulate, islice
+
+from django.contrib.auth.hashers import make_password
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+from faker import Faker
+
+from . import counters, transfer
+from .models import Comment, Follow, Group, Post, User
+
+SEED_LOCALE = 'ru_RU'
+
+
+def power_law(count, skew):
+    """Накопленные веса рангов 1..count с показателем skew
+    для random.choices."""
+    return list(accumulate(1 / rank ** skew for rank in range(1, count + 1)))
+
+
+def max_pk(model):
+    return model.objects.aggregate(max_pk=Max('pk'))['max_pk'] or 0
+
+
+def insert(objects):
+    """Сохраняет объекты через bulk_create пачками
+    по TRANSFER_BATCH_SIZE, не держа весь набор в памяти.
+    Повторы по уникальным полям (подписки) пропускаются."""
+    objects = iter(objects)
+    inserted = 0
+    while True:
+        batch = list(islice(objects, transfer.TRANSFER_BATCH_SIZE))
+        if not batch:
+            return inserted
+        model = type(batch[0])
+        with transaction.atomic():
+            model.objects.bulk_create(batch, ignore_conflicts=True)
+            if model is User:
+                counters.create_missing_stats(User.objects.filter(
+                    username__in=[user.username for user in batch]
+                ))
+        inserted += len(batch)
+
+
+def seed_dataset(users, groups, posts, comments, follows, days=365,
+                 skew=1.1, seed=None):
+    """Добавляет к базе сгенерированные записи и пересчитывает
+    производные данные.
+
+    Посты и комментарии разбросаны по последним days дням.
+    Возвращает Counter созданных строк по моделям.
+    """
+    rng = random.Random(seed)
+    fake = Faker(SEED_LOCALE)
+    fake.seed_instance(seed)
+    now = timezone.now()
+    period = datetime.timedelta(days=days).total_seconds()
+    created = Counter()
+
+    first_user = max_pk(User) + 1
+    password = make_password(None)
+    created['auth.user'] = insert(
+        User(
+            username=f'{fake.user_name()}_{first_user + number}',
+            first_name=fake.first_name(),
+            last_name=fake.last_name(),
+            password=password,
+        )
+        for number in range(users)
+    )
+    user_ids = list(
+        User.objects.filter(pk__gte=first_user).values_list('pk', flat=True)
+    )
+    rng.shuffle(user_ids)
+    user_weights = power_law(len(user_ids), skew)
+
+    first_group = max_pk(Group) + 1
+    created['posts.group'] = insert(
+        Group(
+            title=fake.word().capitalize(),
+            slug=f'group-{first_group + number}',
+            description=fake.sentence(),
+        )
+        for number in range(groups)
+    )
+    group_ids = list(
+        Group.objects.filter(pk__gte=first_group).values_list('pk', flat=True)
+    )
+    group_weights = power_law(len(group_ids), skew)
+
+    def pick(ids, weights):
+        return rng.choices(ids, cum_weights=weights)[0]
+
+    def random_date(since=None):
+        since = since or now - datetime.timedelta(seconds=period)
+        return since + (now - since) * rng.random()
+
+    first_post = max_pk(Post) + 1
+    with transfer.explicit_auto_dates():
+        if user_ids:
+            created['posts.post'] = insert(
+                Post(
+                    author_id=pick(user_ids, user_weights),
+                    group_id=(pick(group_ids, group_weights)
+                              if group_ids and rng.random() < 0.7 else None),
+                    text=fake.paragraph(nb_sentences=rng.randint(1, 8)),
+                    pub_date=random_date(),
+                )
+                for _ in range(posts)
+            )
+        post_dates = list(Post.objects.filter(
+            pk__gte=first_post
+        ).values_list('pk', 'pub_date'))
+        post_weights = power_law(len(post_dates), skew)
+        if post_dates:
+            created['posts.comment'] = insert(
+                Comment(
+                    post_id=post_id,
+                    author_id=pick(user_ids, user_weights),
+                    text=fake.sentence(),
+                    created=random_date(pub_date),
+                )
+                for post_id, pub_date in (
+                    pick(post_dates, post_weights) for _ in range(comments)
+                )
+            )
+
+    pairs = set()
+    # Подписчики выбираются равномерно, а авторы - по популярности,
+    # поэтому число подписчиков у авторов сильно неравномерно.
+    # Попыток ограниченное число: при маленьком наборе пользователей
+    # follows уникальных пар может просто не существовать.
+    for _ in range(follows * 3 if len(user_ids) > 1 else 0):
+        if len(pairs) >= follows:
+            break
+        pair = (rng.choice(user_ids), pick(user_ids, user_weights))
+        if pair[0] != pair[1]:
+            pairs.add(pair)
+    created['posts.follow'] = insert(
+        Follow(user_id=user_id, author_id=author_id)
+        for user_id, author_id in pairs
+    )
+
+    transfer.rebuild_derived()
+    return created
@@ -0,0 +1,263 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import (post_delete, post_save, pre_delete,
+                                      pre_save)
+from django.dispatch import receiver
+
+from . import counters, feeds, images, search
+from .models import AuthorStats, Comment, Follow, Group, Post, User
+from .utils import cache_clear, post_tags
+
+AUTHOR_FIELDS = {'username', 'first_name', 'last_name'}
+
+
+def uses_push_feed():
+    return settings.POSTS_FEED_BACKEND == 'push'
+
+
+def clear_on_commit(tags):
+    """Сбрасывает теги кеша после фиксации транзакции, чтобы
+    параллельный запрос не закешировал старые данные под новой
+    версией."""
+    tags = set(tags)
+    transaction.on_commit(lambda: cache_clear(*tags))
+
+
+def reset_feeds_on_commit(author_ids):
+    """Сбрасывает кеш лент подписчиков авторов после фиксации
+    транзакции, по той же причине, что clear_on_commit."""
+    author_ids = set(author_ids)
+    transaction.on_commit(lambda: feeds.reset_follower_feeds(author_ids))
+
+
+@receiver(post_save, sender=User)
+def create_author_stats(sender, instance, created, **kwargs):
+    if created:
+        AuthorStats.objects.get_or_create(user=instance)
+
+
+@receiver(pre_save, sender=Post)
+def remember_post_group(sender, instance, **kwargs):
+    instance._previous_group_id = None
+    instance._previous_image = ''
+    if not instance._state.adding:
+        previous = Post.objects.filter(
+            pk=instance.pk
+        ).values_list('group_id', 'image').first()
+        if previous is not None:
+            instance._previous_group_id, instance._previous_image = previous
+
+
+@receiver(post_save, sender=Post)
+def push_post_to_feeds(sender, instance, created, **kwargs):
+    if created:
+        feeds.refresh_timeline(instance.author_id)
+        if uses_push_feed():
+            feeds.push_post(instance)
+
+
+@receiver(post_save, sender=Post)
+def count_post(sender, instance, created, **kwargs):
+    if created:
+        counters.bump(
+            AuthorStats.objects.filter(user_id=instance.author_id),
+            'posts_count'
+        )
+        previous_group_id = None
+    else:
+        previous_group_id = instance._previous_group_id
+        if previous_group_id == instance.group_id:
+            return
+
+    if previous_group_id:
+        counters.bump(
+            Group.objects.filter(pk=previous_group_id), 'posts_count', -1
+        )
+    if instance.group_id:
+        counters.bump(
+            Group.objects.filter(pk=instance.group_id), 'posts_count'
+        )
+
+
+@receiver(post_save, sender=Post)
+def count_image_references(sender, instance, created, **kwargs):
+    previous = '' if created else instance._previous_image
+    current = instance.image.name or ''
+    if previous == current:
+        return
+    if current:
+        images.acquire(current)
+    if previous:
+        images.release(previous)
+
+
+@receiver(post_delete, sender=Post)
+def release_post_image(sender, instance, **kwargs):
+    if instance.image:
+        images.release(instance.image.name)
+
+
+@receiver(post_delete, sender=Post)
+def drop_post_from_timeline(sender, instance, **kwargs):
+    feeds.refresh_timeline(instance.author_id)
+
+
+@receiver(post_delete, sender=Post)
+def uncount_post(sender, instance, **kwargs):
+    counters.bump(
+        AuthorStats.objects.filter(user_id=instance.author_id),
+        'posts_count',
+        -1
+    )
+    if instance.group_id:
+        counters.bump(
+            Group.objects.filter(pk=instance.group_id), 'posts_count', -1
+        )
+
+
+@receiver(post_save, sender=Comment)
+def count_comment(sender, instance, created, **kwargs):
+    if created:
+        counters.bump(
+            Post.objects.filter(pk=instance.post_id), 'comments_count'
+        )
+
+
+@receiver(post_delete, sender=Comment)
+def uncount_comment(sender, instance, **kwargs):
+    counters.bump(
+        Post.objects.filter(pk=instance.post_id), 'comments_count', -1
+    )
+
+
+@receiver(post_save, sender=Follow)
+def backfill_feed(sender, instance, created, **kwargs):
+    if created and uses_push_feed():
+        feeds.backfill(instance.user_id, instance.author_id)
+
+
+@receiver(post_save, sender=Follow)
+def count_follow(sender, instance, created, **kwargs):
+    if created:
+        counters.bump(
+            AuthorStats.objects.filter(user_id=instance.user_id),
+            'following_count'
+        )
+        counters.bump(
+            AuthorStats.objects.filter(user_id=instance.author_id),
+            'followers_count'
+        )
+
+
+@receiver(post_delete, sender=Follow)
+def drop_author_from_feed(sender, instance, **kwargs):
+    if uses_push_feed():
+        feeds.drop_author(instance.user_id, instance.author_id)
+
+
+@receiver(post_delete, sender=Follow)
+def uncount_follow(sender, instance, **kwargs):
+    counters.bump(
+        AuthorStats.objects.filter(user_id=instance.user_id),
+        'following_count',
+        -1
+    )
+    counters.bump(
+        AuthorStats.objects.filter(user_id=instance.author_id),
+        'followers_count',
+        -1
+    )
+
+
+@receiver(post_save, sender=Post)
+def index_post(sender, instance, **kwargs):
+    search.posts.index(instance)
+
+
+@receiver(post_delete, sender=Post)
+def unindex_post(sender, instance, **kwargs):
+    search.posts.remove(instance.pk)
+
+
+@receiver(post_save, sender=Comment)
+def index_comment(sender, instance, **kwargs):
+    search.comments.index(instance)
+
+
+@receiver(post_delete, sender=Comment)
+def unindex_comment(sender, instance, **kwargs):
+    search.comments.remove(instance.pk)
+
+
+@receiver(post_save, sender=Group)
+def index_group(sender, instance, **kwargs):
+    search.groups.index(instance)
+
+
+@receiver(post_delete, sender=Group)
+def unindex_group(sender, instance, **kwargs):
+    search.groups.remove(instance.pk)
+
+
+@receiver(post_save, sender=Post)
+def clear_post_cache(sender, instance, created, **kwargs):
+    tags = post_tags(instance)
+    if not created and instance._previous_group_id:
+        tags.append(f'group:{instance._previous_group_id}')
+    clear_on_commit(tags)
+    reset_feeds_on_commit([instance.author_id])
+
+
+@receiver(post_delete, sender=Post)
+def clear_deleted_post_cache(sender, instance, **kwargs):
+    clear_on_commit(post_tags(instance))
+    reset_feeds_on_commit([instance.author_id])
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def clear_comment_cache(sender, instance, **kwargs):
+    clear_on_commit([f'post:{instance.post_id}'])
+
+
+@receiver(post_save, sender=Follow)
+@receiver(post_delete, sender=Follow)
+def clear_follow_cache(sender, instance, **kwargs):
+    user_ids = [instance.user_id]
+    transaction.on_commit(lambda: feeds.reset_feeds(user_ids))
+
+
+@receiver(post_save, sender=Group)
+@receiver(pre_delete, sender=Group)
+def clear_group_cache(sender, instance, **kwargs):
+    """Группа видна в карточках постов на главной, в профилях
+    авторов, которые в ней писали, и в лентах их подписчиков."""
+    author_ids = list(Post.objects.filter(
+        group=instance.pk
+    ).values_list('author_id', flat=True).distinct())
+    clear_on_commit(
+        ['posts', f'group:{instance.pk}']
+        + [f'author:{author_id}' for author_id in author_ids]
+    )
+    reset_feeds_on_commit(author_ids)
+
+
+@receiver(post_save, sender=User)
+def clear_author_cache(sender, instance, created, update_fields, **kwargs):
+    """Имя автора видно в карточках его постов во всех лентах
+    и в комментариях под чужими постами. Вход на сайт сохраняет
+    только last_login и кеш не трогает."""
+    if created or (update_fields and not AUTHOR_FIELDS & update_fields):
+        return
+    group_ids = Post.objects.filter(
+        author=instance.pk, group__isnull=False
+    ).values_list('group_id', flat=True).distinct()
+    post_ids = Comment.objects.filter(
+        author=instance.pk
+    ).values_list('post_id', flat=True).distinct()
+    clear_on_commit(
+        ['posts', f'author:{instance.pk}']
+        + [f'group:{group_id}' for group_id in group_ids]
+        + [f'post:{post_id}' for post_id in post_ids]
+    )
+    reset_feeds_on_commit([instance.pk])
@@ -0,0 +1,64 @@
+import hashlib
+import os
+import posixpath
+
+from django.core.files.storage import FileSystemStorage
+
+
+def content_name(name, content):
+    """Имя файла по хешу содержимого: каталог и расширение из name,
+    остальное - SHA-256 файла, разложенный по подкаталогам."""
+    digest = hashlib.sha256()
+    for chunk in content.chunks():
+        digest.update(chunk)
+    content.seek(0)
+    directory, basename = posixpath.split(name)
+    extension = posixpath.splitext(basename)[1].lower()
+    digest = digest.hexdigest()
+    return posixpath.join(directory, digest[:2], digest + extension)
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """Хранилище, в котором одинаковые файлы лежат в одном экземпляре.
+
+    Файл сохраняется под именем из хеша содержимого, повторная
+    загрузка того же содержимого возвращает имя уже лежащего
+    файла. Поэтому и миниатюры, привязанные к имени, создаются
+    один раз. Сколько постов ссылается на файл, считает
+    posts.images.
+
+    Повторная загрузка обновляет mtime лежащего файла одним
+    вызовом utime: так discard видит, что файл только что
+    переиспользовали, а если он уже удалён, файл пишется заново.
+    """
+
+    tombstone_suffix = '.deleted'
+
+    def _save(self, name, content):
+        name = content_name(name, content)
+        try:
+            os.utime(self.path(name))
+        except FileNotFoundError:
+            return super()._save(name, content)
+        return name
+
+    def discard(self, name, reused_since):
+        """Удаляет файл, если его не переиспользовали после
+        reused_since (timestamp). Возвращает, удалён ли файл.
+
+        Файл сначала атомарно переименовывается, и только потом
+        проверяется его mtime, поэтому загрузка либо успела
+        обновить mtime и файл остаётся, либо не нашла файл
+        и записала его заново.
+        """
+        path = self.path(name)
+        tombstone = path + self.tombstone_suffix
+        try:
+            os.replace(path, tombstone)
+        except FileNotFoundError:
+            return True
+        if os.path.getmtime(tombstone) >= reused_since:
+            os.replace(tombstone, path)
+            return False
+        os.remove(tombstone)
+        return True
@@ -0,0 +1,62 @@
+import hashlib
+
+from django import template
+from django.conf import settings
+from django.core.cache import cache
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+from core.templatetags.fragment_cache import skip_fragment_cache
+from posts.thumbnails import attach_thumbnails
+
+CARD_KEY = 'posts:card:{}:{}'
+CARD_TEMPLATE = 'includes/post.html'
+
+register = template.Library()
+
+
+def card_key(post):
+    """Ключ карточки поста.
+
+    Версия ключа - отпечаток всего, что выводит карточка: правка
+    текста, смена картинки, группы или имени автора дают новый
+    ключ, а старая карточка просто истекает.
+    """
+    group_slug = post.group.slug if post.group_id else ''
+    fingerprint = '\x1f'.join((
+        post.text,
+        post.pub_date.isoformat(),
+        post.image.name or '',
+        group_slug,
+        post.author.get_full_name(),
+    ))
+    version = hashlib.md5(fingerprint.encode()).hexdigest()
+    return CARD_KEY.format(post.pk, version)
+
+
+@register.simple_tag(takes_context=True)
+def post_cards(context, posts):
+    """Пары (пост, карточка) для страницы постов.
+
+    Готовые карточки читаются одним get_many, отрисовываются
+    только отсутствующие в кеше. Карточка с заглушкой вместо
+    ещё не готовой миниатюры не кешируется, как и фрагмент
+    {% cache %} вокруг неё. Миниатюры для них ищутся одним
+    пакетным запросом.
+    """
+    keys = [(card_key(post), post) for post in posts]
+    cards = cache.get_many([key for key, _ in keys])
+    missing = {}
+    attach_thumbnails(
+        (post for key, post in keys if key not in cards), 'card'
+    )
+    for key, post in keys:
+        if key in cards:
+            continue
+        cards[key] = render_to_string(CARD_TEMPLATE, {'post': post})
+        if post.thumbnail or not post.image:
+            missing[key] = cards[key]
+        else:
+            skip_fragment_cache(context)
+    cache.set_many(missing, settings.POSTS_CARD_CACHE_TIMEOUT)
+    return [(post, mark_safe(cards[key])) for key, post in keys]
@@ -0,0 +1,19 @@
+from django import template
+from django.conf import settings
+
+from posts.thumbnails import attach_thumbnails
+
+register = template.Library()
+
+
+@register.inclusion_tag('includes/post_picture.html')
+def post_picture(post, alias='card'):
+    """<picture> с вариантами картинки поста или заглушка.
+
+    Посты страниц приходят с уже найденными пакетно миниатюрами,
+    для одиночного поста они ищутся здесь.
+    """
+    if not hasattr(post, 'thumbnail'):
+        attach_thumbnails([post], alias)
+    variants = settings.POSTS_IMAGE_VARIANTS.get(alias, {})
+    return {'post': post, 'sizes': variants.get('sizes')}
@@ -0,0 +1,76 @@
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import Client, TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from posts.models import Comment, Follow, Group, Post
+from posts.utils import EstimatedCountPaginator
+
+User = get_user_model()
+
+
+class AdminChangelistTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.admin = User.objects.create_superuser(
+            'admin', 'admin@yatube.ru', 'password'
+        )
+        cls.group = Group.objects.create(
+            title='test title',
+            slug='test-slug',
+            description='test description'
+        )
+
+    def setUp(self):
+        self.client = Client()
+        self.client.force_login(self.admin)
+
+    def add_rows(self, number):
+        for _ in range(number):
+            author = User.objects.create(
+                username=f'author_{User.objects.count()}'
+            )
+            post = Post.objects.create(
+                author=author, group=self.group, text='text'
+            )
+            Comment.objects.create(post=post, author=author, text='text')
+            Follow.objects.create(user=self.admin, author=author)
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_queries_do_not_grow_with_rows(self):
+        """Число запросов списков в админке не зависит от числа строк"""
+        urls = [
+            reverse(f'admin:posts_{model}_changelist')
+            for model in ('post', 'comment', 'follow', 'group')
+        ]
+        self.add_rows(2)
+        counts = {url: self.count_queries(url) for url in urls}
+        self.add_rows(10)
+        for url in urls:
+            with self.subTest(url=url):
+                self.assertEqual(self.count_queries(url), counts[url])
+
+    def test_estimated_count(self):
+        """Число строк всей таблицы оценивается по диапазону ключей,
+        отфильтрованной - считается до предела"""
+        self.add_rows(5)
+        Post.objects.filter(pk=Post.objects.order_by('pk')[1].pk).delete()
+
+        paginator = EstimatedCountPaginator(Post.objects.all(), 2)
+        self.assertEqual(paginator.count, 5)
+
+        paginator = EstimatedCountPaginator(
+            Post.objects.filter(group=self.group), 2
+        )
+        paginator.count_limit = 3
+        self.assertEqual(paginator.count, 3)
+
+        paginator = EstimatedCountPaginator(Post.objects.none(), 2)
+        self.assertEqual(paginator.count, 0)
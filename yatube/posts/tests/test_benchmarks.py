@@ -0,0 +1,87 @@
+import copy
+
+from django.core.cache import cache
+from django.test import TestCase
+
+from posts import benchmarks, seeding
+from posts.models import Comment, Post
+
+
+class BenchmarkTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        seeding.seed_dataset(
+            users=20, groups=3, posts=100, comments=200, follows=60, seed=1
+        )
+
+    def test_run_views(self):
+        """Замер проходит по всем view и собирает перцентили,
+        запросы и время рендера"""
+        posts_count = Post.objects.count()
+        comments_count = Comment.objects.count()
+        results = benchmarks.run_views(iterations=3, warmup=1)
+
+        self.assertEqual(list(results), list(benchmarks.VIEWS))
+        for view, stats in results.items():
+            with self.subTest(view=view):
+                self.assertGreater(stats['queries'], 0)
+                self.assertLessEqual(stats['p50_ms'], stats['p99_ms'])
+        self.assertGreater(results['index']['render_ms'], 0)
+        self.assertEqual(results['post_create']['render_ms'], 0)
+        self.assertEqual(Post.objects.count(), posts_count + 4)
+        self.assertEqual(Comment.objects.count(), comments_count + 4)
+
+    def test_isolated_cache_keeps_working_cache(self):
+        """Замер пишет в отдельный кеш, рабочий не очищается
+        и не засоряется"""
+        cache.set('working', 'value')
+        self.addCleanup(cache.delete, 'working')
+
+        with benchmarks.isolated_cache():
+            self.assertIsNone(cache.get('working'))
+            cache.set('synthetic', 'value')
+
+        self.assertEqual(cache.get('working'), 'value')
+        self.assertIsNone(cache.get('synthetic'))
+
+    def test_navigation_render_times(self):
+        """Замер навигации возвращает перцентили
+        для каждого числа страниц"""
+        results = benchmarks.navigation_render_times(
+            page_counts=(10, 1000), iterations=5
+        )
+
+        self.assertEqual(list(results), [10, 1000])
+        for stats in results.values():
+            self.assertLessEqual(stats['p50_ms'], stats['p99_ms'])
+
+    def test_percentile(self):
+        """Перцентиль считается по ближайшему рангу"""
+        values = list(range(1, 101))
+        self.assertEqual(benchmarks.percentile(values, 50), 50)
+        self.assertEqual(benchmarks.percentile(values, 99), 99)
+        self.assertEqual(benchmarks.percentile([7], 90), 7)
+
+    def test_compare_flags_regressions(self):
+        """Регрессией считается рост p50/p90 выше порога
+        и рост числа запросов"""
+        stats = {
+            'p50_ms': 10, 'p90_ms': 20, 'p99_ms': 30, 'queries': 4,
+        }
+        baseline = {'datasets': {'small': {'views': {
+            'index': dict(stats), 'profile': dict(stats),
+        }}}}
+        results = copy.deepcopy(baseline)
+        views = results['datasets']['small']['views']
+        views['index']['p50_ms'] = 11
+        views['profile'].update(p90_ms=25, queries=5)
+        views['post_detail'] = dict(stats)
+
+        self.assertEqual(
+            benchmarks.compare(results, baseline, threshold=0.2),
+            [
+                'small/profile: p90_ms 20 -> 25',
+                'small/profile: queries 4 -> 5',
+            ]
+        )
@@ -1,10 +1,25 @@
-from django.core.cache import cache
+import os
+import threading
+import time
+from unittest import mock, skipUnless
 
 from django.contrib.auth import get_user_model
-from django.test import Client, TestCase
+from django.core.cache import cache, caches
+from django.core.cache.backends.filebased import FileBasedCache
+from django.core.cache.utils import make_template_fragment_key
+from django.db import DatabaseError, connection
+from django.template import Context, Template
+from django.test import (Client, SimpleTestCase, TestCase,
+                         TransactionTestCase, override_settings)
 from django.urls import reverse
 
-from posts.models import Post
+from core.cache import (ADD_LOCK_SUFFIX, JOURNAL_EVENT, JOURNAL_SEQ, LOCK_KEY,
+                        CacheEntry, TwoTierCache, cache_fetch,
+                        get_or_compute, is_fresh)
+from core.decorators import STALE_WARNING
+from posts.models import Follow, Group, Post
+from posts.templatetags.post_cards import card_key
+from posts.utils import cache_clear, cache_reset, cache_version
 
 User = get_user_model()
 
@@ -37,3 +52,617 @@ class PostsCacheTests(TestCase):
         response_3 = self.guest_client.get(reverse('posts:index'))
 
         self.assertNotEqual(response_2.content, response_3.content)
+
+
+class CacheInvalidationTests(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create(username='author')
+        self.follower = User.objects.create(username='follower')
+        self.group = Group.objects.create(
+            title='group',
+            slug='group',
+            description='description'
+        )
+        self.post = Post.objects.create(
+            author=self.author,
+            text='old_text',
+            group=self.group
+        )
+        self.author_client = Client()
+        self.author_client.force_login(self.author)
+        self.follower_client = Client()
+        self.follower_client.force_login(self.follower)
+
+    def test_version_changes_only_with_its_tags(self):
+        """Сброс тега меняет версию только зависящих от него фрагментов"""
+        version = cache_version('author:1', 'group:1')
+        other_version = cache_version('author:2')
+
+        cache_clear('group:1')
+
+        self.assertNotEqual(cache_version('author:1', 'group:1'), version)
+        self.assertEqual(cache_version('author:2'), other_version)
+
+        cache_reset('author:1')
+
+        self.assertNotEqual(cache_version('author:1'), version)
+        self.assertEqual(cache_version('author:2'), other_version)
+
+    def test_post_create_refreshes_index(self):
+        """Новый пост сразу появляется на закешированной главной"""
+        self.guest_client = Client()
+        self.guest_client.get(reverse('posts:index'))
+
+        self.author_client.post(
+            reverse('posts:post_create'),
+            data={'text': 'new_text'}
+        )
+
+        response = self.guest_client.get(reverse('posts:index'))
+        self.assertContains(response, 'new_text')
+
+    def test_post_edit_refreshes_follow_index(self):
+        """Правка поста сразу видна в закешированной ленте подписок"""
+        Follow.objects.create(user=self.follower, author=self.author)
+        self.follower_client.get(reverse('posts:follow_index'))
+
+        self.author_client.post(
+            reverse('posts:post_edit', kwargs={'post_id': self.post.pk}),
+            data={'text': 'new_text', 'group': self.group.pk}
+        )
+
+        response = self.follower_client.get(reverse('posts:follow_index'))
+        self.assertContains(response, 'new_text')
+        self.assertNotContains(response, 'old_text')
+
+    def test_new_post_and_group_refresh_follow_index(self):
+        """Новый пост автора и правка группы сразу видны
+        в закешированной ленте подписок"""
+        Follow.objects.create(user=self.follower, author=self.author)
+        self.follower_client.get(reverse('posts:follow_index'))
+
+        Post.objects.create(author=self.author, text='new_text')
+        self.group.slug = 'new-group'
+        self.group.save()
+
+        response = self.follower_client.get(reverse('posts:follow_index'))
+        self.assertContains(response, 'new_text')
+        self.assertContains(
+            response, reverse('posts:group', kwargs={'slug': 'new-group'})
+        )
+
+    def test_follow_and_unfollow_refresh_follow_index(self):
+        """Подписка и отписка сразу меняют закешированную ленту"""
+        response = self.follower_client.get(reverse('posts:follow_index'))
+        self.assertNotContains(response, 'old_text')
+
+        self.follower_client.get(
+            reverse('posts:profile_follow', kwargs={'username': 'author'})
+        )
+        response = self.follower_client.get(reverse('posts:follow_index'))
+        self.assertContains(response, 'old_text')
+
+        self.follower_client.get(
+            reverse('posts:profile_unfollow', kwargs={'username': 'author'})
+        )
+        response = self.follower_client.get(reverse('posts:follow_index'))
+        self.assertNotContains(response, 'old_text')
+
+    def test_orm_changes_refresh_cached_pages(self):
+        """Правки в обход view (админка, shell) сразу видны
+        на закешированных страницах"""
+        Follow.objects.create(user=self.follower, author=self.author)
+        guest_client = Client()
+        group_url = reverse('posts:group', kwargs={'slug': 'group'})
+        for url in (reverse('posts:index'), group_url):
+            guest_client.get(url)
+        self.follower_client.get(reverse('posts:follow_index'))
+
+        self.author.first_name = 'Новое'
+        self.author.last_name = 'Имя'
+        self.author.save()
+
+        for url in (reverse('posts:index'), group_url):
+            with self.subTest(url=url):
+                self.assertContains(guest_client.get(url), 'Новое Имя')
+        response = self.follower_client.get(reverse('posts:follow_index'))
+        self.assertContains(response, 'Новое Имя')
+
+        Post.objects.get(pk=self.post.pk).delete()
+
+        for url in (reverse('posts:index'), group_url):
+            with self.subTest(url=url):
+                self.assertNotContains(guest_client.get(url), 'old_text')
+
+    def test_login_keeps_cache_versions(self):
+        """Вход на сайт сохраняет last_login, но не сбрасывает кеш"""
+        version = cache_version('posts', f'author:{self.author.pk}')
+
+        Client().force_login(self.author)
+
+        self.assertEqual(
+            cache_version('posts', f'author:{self.author.pk}'), version
+        )
+
+
+class PostCardsCacheTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+
+        cls.user = User.objects.create(username='author')
+        cls.group = Group.objects.create(
+            title='group',
+            slug='group',
+            description='description'
+        )
+        cls.post = Post.objects.create(
+            author=cls.user,
+            text='test_text',
+            group=cls.group
+        )
+        cls.authorized_client = Client()
+        cls.authorized_client.force_login(cls.user)
+        cls.group_url = reverse('posts:group', kwargs={'slug': 'group'})
+
+    def setUp(self):
+        cache.clear()
+
+    def get_post(self):
+        return Post.objects.select_related('author', 'group').get(
+            pk=self.post.pk
+        )
+
+    def test_page_is_assembled_from_cached_cards(self):
+        """Страница собирается из закешированных карточек постов"""
+        self.authorized_client.get(self.group_url)
+        key = card_key(self.get_post())
+        self.assertIn('test_text', cache.get(key))
+
+        cache.set(key, 'cached_card')
+        response = self.authorized_client.get(self.group_url)
+        self.assertContains(response, 'cached_card')
+
+    def test_card_key_changes_with_rendered_fields(self):
+        """Ключ карточки меняется вместе с выводимыми в ней полями"""
+        key = card_key(self.get_post())
+        other_group = Group.objects.create(
+            title='other',
+            slug='other',
+            description='description'
+        )
+        changes = (
+            ('text', Post.objects.filter(pk=self.post.pk), 'new_text'),
+            ('image', Post.objects.filter(pk=self.post.pk), 'posts/a.gif'),
+            ('group', Post.objects.filter(pk=self.post.pk), other_group),
+            ('first_name', User.objects.filter(pk=self.user.pk), 'Name'),
+        )
+        for field, queryset, value in changes:
+            with self.subTest(field=field):
+                queryset.update(**{field: value})
+                new_key = card_key(self.get_post())
+                self.assertNotEqual(new_key, key)
+                key = new_key
+
+
+class AnonymousPageCacheTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+
+        cls.user = User.objects.create(username='author')
+        cls.group = Group.objects.create(
+            title='group',
+            slug='group',
+            description='description'
+        )
+        cls.post = Post.objects.create(
+            author=cls.user,
+            text='test_text',
+            group=cls.group
+        )
+        cls.urls = (
+            reverse('posts:index'),
+            reverse('posts:group', kwargs={'slug': 'group'}),
+            reverse('posts:profile', kwargs={'username': 'author'}),
+            reverse('posts:post_detail', kwargs={'post_id': cls.post.pk}),
+            reverse('about:author'),
+            reverse('about:tech'),
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.guest_client = Client()
+        self.authorized_client = Client()
+        self.authorized_client.force_login(self.user)
+
+    def test_repeated_request_gets_not_modified(self):
+        """Повторный запрос с ETag получает 304 без отрисовки"""
+        for url in self.urls:
+            with self.subTest(url=url):
+                response = self.guest_client.get(url)
+                self.assertTrue(response.has_header('ETag'))
+
+                with self.assertTemplateNotUsed('base.html'):
+                    not_modified = self.guest_client.get(
+                        url, HTTP_IF_NONE_MATCH=response['ETag']
+                    )
+                self.assertEqual(not_modified.status_code, 304)
+
+    def test_cached_page_is_served_without_rendering(self):
+        """Анонимная страница отдаётся из кеша без отрисовки шаблона"""
+        for url in self.urls:
+            with self.subTest(url=url):
+                response = self.guest_client.get(url)
+                with self.assertTemplateNotUsed('base.html'):
+                    cached = self.guest_client.get(url)
+                self.assertEqual(cached.content, response.content)
+
+    def test_last_modified_follows_newest_post(self):
+        """Last-Modified страницы поста - дата последнего комментария"""
+        url = reverse('posts:post_detail', kwargs={'post_id': self.post.pk})
+        response = self.guest_client.get(url)
+        self.assertTrue(response.has_header('Last-Modified'))
+
+        not_modified = self.guest_client.get(
+            url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified']
+        )
+        self.assertEqual(not_modified.status_code, 304)
+
+    def test_new_post_changes_etag(self):
+        """Новый пост меняет ETag главной и страниц группы и автора"""
+        etags = {url: self.guest_client.get(url)['ETag']
+                 for url in self.urls[:3]}
+        Post.objects.create(
+            author=self.user,
+            text='new_text',
+            group=self.group
+        )
+        for url, etag in etags.items():
+            with self.subTest(url=url):
+                response = self.guest_client.get(url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, 200)
+                self.assertNotEqual(response['ETag'], etag)
+
+    def test_authorized_requests_are_not_cached(self):
+        """Страницы авторизованного пользователя не кешируются"""
+        for url in self.urls:
+            with self.subTest(url=url):
+                response = self.authorized_client.get(url)
+                self.assertFalse(response.has_header('ETag'))
+
+
+def other_process(params):
+    """Экземпляр кеша со своим L1, как в отдельном процессе."""
+    with mock.patch.dict('core.cache._local_tiers', clear=True):
+        return TwoTierCache('shared', params)
+
+
+def publish_deletes(params, keys):
+    """Сбрасывает ключи по одному из отдельного процесса."""
+    instance = other_process(params)
+    for key in keys:
+        instance.delete(key)
+
+
+class TwoTierCacheTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        params = {'OPTIONS': {'MAX_ENTRIES': 2, 'POLL_INTERVAL': 0}}
+        self.first = other_process(params)
+        self.second = other_process(params)
+
+    def test_values_are_shared_between_processes(self):
+        """Запись одного процесса видна другому через общий уровень"""
+        self.first.set('key', 'value')
+        self.assertEqual(self.second.get('key'), 'value')
+        self.assertEqual(self.second.get_many(['key', 'missing']),
+                         {'key': 'value'})
+
+    def test_invalidation_reaches_other_processes(self):
+        """Сброс в одном процессе выбрасывает ключ из L1 другого"""
+        self.first.set('key', 'old')
+        self.assertEqual(self.second.get('key'), 'old')
+
+        self.first.set('key', 'new')
+        self.assertEqual(self.second.get('key'), 'new')
+
+        self.first.delete('key')
+        self.assertIsNone(self.second.get('key'))
+
+    def test_cache_clear_reaches_other_processes(self):
+        """Версии тегов из cache_clear сразу видны другим процессам"""
+        self.first.set('posts:generation:posts', 1, None)
+        self.assertEqual(self.second.get('posts:generation:posts'), 1)
+
+        self.first.incr('posts:generation:posts')
+        self.assertEqual(self.second.get('posts:generation:posts'), 2)
+
+        self.first.clear()
+        self.assertIsNone(self.second.get('posts:generation:posts'))
+
+    def test_first_level_is_shared_between_threads(self):
+        """Экземпляры кеша разных потоков читают один L1"""
+        instances = []
+        thread = threading.Thread(
+            target=lambda: instances.append(caches['default'])
+        )
+        thread.start()
+        thread.join()
+
+        self.assertIsNot(instances[0], caches['default'])
+        instances[0].set('key', 'value')
+        self.assertIs(instances[0]._l1, caches['default']._l1)
+        self.assertIn(cache.make_key('key'), caches['default']._l1)
+
+    def test_incr_keeps_counter_without_expiry(self):
+        """incr не ставит счётчику срок жизни по умолчанию"""
+        self.first.set('posts:generation:posts', 1, None)
+        self.first.incr('posts:generation:posts')
+
+        later = time.time() + 3600
+        with mock.patch('time.time', return_value=later):
+            self.assertEqual(
+                self.second.l2.get('posts:generation:posts'), 2
+            )
+
+    def test_add_is_atomic_between_processes(self):
+        """Одновременный add одного ключа из разных процессов
+        удаётся только одному"""
+        has_key = FileBasedCache.has_key
+
+        def slow_has_key(*args, **kwargs):
+            found = has_key(*args, **kwargs)
+            time.sleep(0.05)
+            return found
+
+        results = []
+
+        def add(instance):
+            results.append(instance.add('key', 'value'))
+
+        with mock.patch.object(FileBasedCache, 'has_key', slow_has_key):
+            threads = [
+                threading.Thread(target=add, args=(instance,))
+                for instance in (self.first, self.second) * 3
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(sorted(results), [False] * 5 + [True])
+
+    @skipUnless(hasattr(os, 'fork'), 'нужен fork')
+    def test_journal_keeps_events_of_concurrent_processes(self):
+        """События журнала из параллельных процессов не теряются"""
+        params = {'OPTIONS': {'POLL_INTERVAL': 0}}
+        keys = [f'key-{number}' for number in range(200)]
+        pids = []
+        for start in range(4):
+            pid = os.fork()
+            if not pid:
+                try:
+                    publish_deletes(params, keys[start::4])
+                finally:
+                    os._exit(0)
+            pids.append(pid)
+        for pid in pids:
+            os.waitpid(pid, 0)
+
+        seq = self.first.l2.get(JOURNAL_SEQ)
+        events = self.first.l2.get_many(
+            [JOURNAL_EVENT.format(number) for number in range(1, seq + 1)]
+        )
+        published = {key for keys in events.values() for key in keys}
+        self.assertEqual(
+            {self.first.make_key(key) for key in keys} - published, set()
+        )
+
+    def test_add_lock_of_crashed_process_expires(self):
+        """Занятый другим процессом ключ не добавляется, пока
+        его блокировка не устарела"""
+        lock_path = self.first.l2._key_to_file('key') + ADD_LOCK_SUFFIX
+        os.makedirs(os.path.dirname(lock_path), exist_ok=True)
+        open(lock_path, 'w').close()
+        self.addCleanup(
+            lambda: os.path.exists(lock_path) and os.remove(lock_path)
+        )
+
+        self.assertFalse(self.first.add('key', 'value'))
+
+        os.utime(lock_path, (0, 0))
+        self.assertTrue(self.first.add('key', 'value'))
+        self.assertFalse(os.path.exists(lock_path))
+
+    def test_first_level_is_bounded_lru(self):
+        """L1 хранит не больше MAX_ENTRIES последних ключей"""
+        for key in ('a', 'b', 'c'):
+            self.first.set(key, key)
+        self.assertEqual(list(self.first._l1), [':1:b', ':1:c'])
+
+    def test_values_are_copied(self):
+        """Изменение полученного объекта не меняет значение в L1"""
+        self.first.set('key', ['value'])
+        self.first.get('key').append('changed')
+        self.assertEqual(self.first.get('key'), ['value'])
+
+
+class StampedeProtectionTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        self.calls = 0
+
+    def compute(self, value='new'):
+        self.calls += 1
+        return value
+
+    def test_single_flight_recomputation(self):
+        """Одновременные промахи пересчитывает только один запрос"""
+        def slow_compute():
+            time.sleep(0.2)
+            return self.compute()
+
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(
+                get_or_compute('key', slow_compute, 60)
+            ))
+            for _ in range(5)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(results, ['new'] * 5)
+
+    def test_previous_value_is_served_while_locked(self):
+        """Пока значение пересчитывается, отдаётся прежняя версия"""
+        get_or_compute('key', lambda: self.compute('old'), 60, version=1)
+        cache.add(LOCK_KEY.format('key'), True)
+
+        value = get_or_compute('key', self.compute, 60, version=2)
+
+        self.assertEqual(value, 'old')
+        self.assertEqual(self.calls, 1)
+
+    def test_new_version_is_computed_when_unlocked(self):
+        """Новая версия пересчитывается, если никто не держит блокировку"""
+        get_or_compute('key', lambda: self.compute('old'), 60, version=1)
+
+        value = get_or_compute('key', self.compute, 60, version=2)
+
+        self.assertEqual(value, 'new')
+        self.assertEqual(get_or_compute('key', self.compute, 60, version=2),
+                         'new')
+        self.assertEqual(self.calls, 2)
+
+    @override_settings(CACHE_LOCK_TIMEOUT=0.1)
+    def test_waiter_computes_after_lock_timeout(self):
+        """Без прежнего значения запрос ждёт не дольше CACHE_LOCK_TIMEOUT"""
+        cache.add(LOCK_KEY.format('key'), True)
+
+        self.assertEqual(get_or_compute('key', self.compute, 60), 'new')
+
+    def test_uncacheable_values_are_not_stored(self):
+        """Значения, не прошедшие cacheable, не сохраняются"""
+        get_or_compute('key', self.compute, 60, cacheable=lambda value: False)
+        get_or_compute('key', self.compute, 60, cacheable=lambda value: False)
+
+        self.assertEqual(self.calls, 2)
+
+    def test_early_refresh_probability(self):
+        """Дорогие значения у конца срока обновляются заранее"""
+        now = time.time()
+        expensive = CacheEntry('value', None, now + 1, 10 ** 6)
+        cheap = CacheEntry('value', None, now + 3600, 0.01)
+
+        self.assertFalse(is_fresh(expensive, None, now, beta=1))
+        self.assertTrue(is_fresh(cheap, None, now, beta=1))
+
+    def test_fragment_tag_serves_previous_version_while_locked(self):
+        """Тег cache отдаёт прежнюю версию фрагмента во время пересчёта"""
+        template = Template(
+            '{% load fragment_cache %}'
+            '{% cache 60 fragment version=version %}{{ value }}{% endcache %}'
+        )
+        self.assertEqual(
+            template.render(Context({'version': 1, 'value': 'old'})), 'old'
+        )
+        self.assertEqual(
+            template.render(Context({'version': 2, 'value': 'new'})), 'new'
+        )
+
+        cache.add(
+            LOCK_KEY.format(make_template_fragment_key('fragment')), True
+        )
+        self.assertEqual(
+            template.render(Context({'version': 3, 'value': 'newer'})), 'new'
+        )
+
+
+class StaleWhileRevalidateTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def put_expired(self, value, version=None):
+        cache.set('key', CacheEntry(value, version, time.time() - 1, 0), 60)
+
+    def test_expired_entry_is_refreshed_in_background(self):
+        """Истёкшая запись отдаётся сразу, а пересчитывается в фоне"""
+        self.put_expired('old')
+
+        value, stale = cache_fetch(
+            'key', lambda: 'new', 60, refresh_in_background=True
+        )
+        self.assertEqual((value, stale), ('old', True))
+
+        deadline = time.monotonic() + 5
+        while cache.get('key').value != 'new':
+            self.assertLess(time.monotonic(), deadline)
+            time.sleep(0.01)
+
+    def test_stale_entry_is_served_on_database_error(self):
+        """При ошибке базы отдаётся прежняя запись"""
+        self.put_expired('old', version=1)
+
+        def compute():
+            raise DatabaseError
+
+        value, stale = cache_fetch('key', compute, 60, version=2)
+        self.assertEqual((value, stale), ('old', True))
+
+    def test_database_error_without_entry_is_raised(self):
+        """Без прежней записи ошибка базы не скрывается"""
+        def compute():
+            raise DatabaseError
+
+        with self.assertRaises(DatabaseError):
+            cache_fetch('key', compute, 60)
+
+    @override_settings(CACHE_LATENCY_BUDGET=0.1)
+    def test_slow_query_falls_back_to_stale_entry(self):
+        """Запрос, не уложившийся в бюджет, прерывается ради прежней записи"""
+        self.put_expired('old', version=1)
+
+        def compute():
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    'WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL '
+                    'SELECT i + 1 FROM n WHERE i < 1000000000) '
+                    'SELECT COUNT(*) FROM n'
+                )
+            return 'new'
+
+        started = time.monotonic()
+        value, stale = cache_fetch('key', compute, 60, version=2)
+        self.assertEqual((value, stale), ('old', True))
+        self.assertLess(time.monotonic() - started, 5)
+
+    def test_stale_page_is_served_when_database_fails(self):
+        """Если база недоступна, анонимные ленты отдаются из кеша"""
+        group = Group.objects.create(
+            title='group',
+            slug='group',
+            description='description'
+        )
+        urls = (
+            reverse('posts:index'),
+            reverse('posts:group', kwargs={'slug': group.slug}),
+        )
+        client = Client()
+        responses = {url: client.get(url) for url in urls}
+
+        with mock.patch.object(
+            Post.objects, 'aggregate', side_effect=DatabaseError
+        ), mock.patch.object(
+            Group.objects, 'filter', side_effect=DatabaseError
+        ):
+            for url, response in responses.items():
+                with self.subTest(url=url):
+                    stale = client.get(url)
+                    self.assertEqual(stale['Warning'], STALE_WARNING)
+                    self.assertEqual(stale.content, response.content)
@@ -8,6 +8,7 @@ from django.test import Client, TestCase, override_settings
 from django.urls import reverse
 
 from posts.models import Comment, Group, Post
+from posts.storage import content_name
 
 User = get_user_model()
 
@@ -79,7 +80,8 @@ class PostsFormsTestCase(TestCase):
         )
         self.assertEqual(Post.objects.count(), post_count + 1)
         self.assertEqual(Post.objects.get(pk=2).text, form_data['text'])
-        self.assertEqual(Post.objects.get(pk=2).image, 'posts/small.gif')
+        image = Post.objects.get(pk=2).image
+        self.assertEqual(image.name, content_name('posts/small.gif', image))
         self.assertIsNone(Post.objects.get(pk=2).group)
 
     def test_post_editing_form_updates_database(self):
@@ -0,0 +1,389 @@
+import os
+import shutil
+import tempfile
+from io import BytesIO, StringIO
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files.storage import FileSystemStorage
+from django.core.management import call_command
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.test import (Client, TestCase, TransactionTestCase,
+                         override_settings)
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from PIL import Image
+
+from posts.models import ImageVariant, Post, StoredImage
+from posts.storage import content_name
+from posts.templatetags.post_cards import card_key
+from posts.thumbnails import (PostThumbnailEngine, attach_thumbnails,
+                              generate_thumbnails, variant_formats)
+
+User = get_user_model()
+
+TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
+
+
+def make_image(name='photo.jpg', size=(1200, 800), image_format='JPEG',
+               **options):
+    buffer = BytesIO()
+    Image.new('RGB', size, color=(200, 40, 40)).save(
+        buffer, image_format, **options
+    )
+    return SimpleUploadedFile(
+        name=name,
+        content=buffer.getvalue(),
+        content_type=f'image/{image_format.lower()}'
+    )
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT, BACKGROUND_WORKERS=0)
+class ThumbnailPregenerationTests(TransactionTestCase):
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(username='author')
+        self.client = Client()
+        self.client.force_login(self.user)
+
+    def test_thumbnails_are_ready_after_upload(self):
+        """Миниатюры готовы сразу после сохранения формы с картинкой"""
+        self.client.post(
+            reverse('posts:post_create'),
+            data={'text': 'text', 'image': make_image()}
+        )
+        post = Post.objects.get()
+
+        thumbnail = attach_thumbnails([post], 'card')[0].thumbnail
+        self.assertIsNotNone(thumbnail)
+        self.assertEqual((thumbnail.width, thumbnail.height), (960, 339))
+
+        response = self.client.get(reverse('posts:index'))
+        self.assertContains(response, thumbnail.url)
+
+    def test_variants_are_generated(self):
+        """После загрузки есть варианты всех ширин в поддерживаемых
+        форматах, а карточка выводит их в srcset"""
+        self.client.post(
+            reverse('posts:post_create'),
+            data={'text': 'text', 'image': make_image()}
+        )
+        post = Post.objects.get()
+        formats = variant_formats('card')
+        self.assertIn('JPEG', formats)
+
+        variants = ImageVariant.objects.filter(source=post.image.name)
+        self.assertEqual(
+            sorted(variants.values_list('format', 'width', 'height')),
+            sorted(
+                (image_format, width, size)
+                for image_format in formats
+                for width, size in ((320, 113), (640, 226), (960, 339))
+            )
+        )
+
+        response = self.client.get(reverse('posts:index'))
+        self.assertContains(response, '<picture>')
+        for variant in variants:
+            self.assertContains(
+                response, f'{variant.name} {variant.width}w'
+            )
+
+    def test_missing_file_is_tolerated(self):
+        """Пропавший файл картинки не ломает создание миниатюр"""
+        generate_thumbnails('posts/missing.jpg')
+
+        post = Post.objects.create(
+            author=self.user,
+            text='text',
+            image='posts/missing.jpg'
+        )
+        self.assertIsNone(attach_thumbnails([post], 'card')[0].thumbnail)
+        self.assertFalse(ImageVariant.objects.exists())
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class ThumbnailPlaceholderTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create(username='author')
+        cls.post = Post.objects.create(
+            author=cls.user,
+            text='text',
+            image=make_image()
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.client.force_login(self.user)
+
+    def test_placeholder_until_thumbnail_is_ready(self):
+        """Пока миниатюры нет, страницы показывают заглушку"""
+        urls = (
+            reverse('posts:index'),
+            reverse('posts:post_detail', kwargs={'post_id': self.post.pk}),
+        )
+        for url in urls:
+            with self.subTest(url=url):
+                response = self.client.get(url)
+                self.assertContains(response, 'Картинка обрабатывается')
+
+    def test_card_with_placeholder_is_not_cached(self):
+        """Карточка с заглушкой не кешируется, а после создания
+        миниатюры выводится с картинкой"""
+        profile_url = reverse('posts:profile', kwargs={'username': 'author'})
+        self.client.get(profile_url)
+        post = Post.objects.select_related('author', 'group').get()
+        self.assertIsNone(cache.get(card_key(post)))
+
+        generate_thumbnails(post.image.name)
+        response = self.client.get(profile_url)
+        self.assertNotContains(response, 'Картинка обрабатывается')
+        self.assertIsNotNone(cache.get(card_key(post)))
+
+    def test_page_fragment_with_placeholder_is_not_cached(self):
+        """Фрагмент ленты с заглушкой не кешируется целиком,
+        поэтому готовая миниатюра появляется без сброса версии"""
+        index_url = reverse('posts:index')
+        self.assertContains(
+            self.client.get(index_url), 'Картинка обрабатывается'
+        )
+
+        generate_thumbnails(self.post.image.name)
+        self.assertNotContains(
+            self.client.get(index_url), 'Картинка обрабатывается'
+        )
+
+    def test_ready_thumbnail_refreshes_anonymous_pages(self):
+        """Готовая миниатюра сбрасывает закешированные
+        для анонимов страницы с заглушкой"""
+        guest_client = Client()
+        urls = (
+            reverse('posts:index'),
+            reverse('posts:profile', kwargs={'username': 'author'}),
+            reverse('posts:post_detail', kwargs={'post_id': self.post.pk}),
+        )
+        for url in urls:
+            guest_client.get(url)
+
+        generate_thumbnails(self.post.image.name)
+
+        for url in urls:
+            with self.subTest(url=url):
+                self.assertNotContains(
+                    guest_client.get(url), 'Картинка обрабатывается'
+                )
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class BatchedThumbnailLookupTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create(username='author')
+        cls.posts = [
+            Post.objects.create(
+                author=cls.user,
+                text=f'text {number}',
+                image=make_image(f'photo{number}.jpg', (1200, 800 + number))
+            )
+            for number in range(3)
+        ]
+        for post in cls.posts[:2]:
+            generate_thumbnails(post.image.name)
+        cls.plain_post = Post.objects.create(author=cls.user, text='text')
+
+    def setUp(self):
+        cache.clear()
+
+    def test_one_query_for_page(self):
+        """Миниатюры и варианты страницы ищутся одним запросом
+        к kvstore и одним к описаниям вариантов, повторно - только
+        в кеше"""
+        posts = self.posts + [self.plain_post]
+        with CaptureQueriesContext(connection) as queries:
+            attach_thumbnails(posts, 'card')
+        self.assertEqual(len(queries), 2)
+        self.assertEqual(
+            [post.thumbnail is not None for post in posts],
+            [True, True, False, False]
+        )
+        self.assertTrue(posts[0].thumbnail.exists())
+        self.assertNotEqual(posts[0].thumbnail.name, posts[0].image.name)
+
+        with self.assertNumQueries(0):
+            attach_thumbnails(self.posts[:2], 'card')
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT,
+                   POSTS_IMAGE_MAX_SIZE=(2560, 2560))
+class UploadNormalizationTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create(username='author')
+
+    def setUp(self):
+        self.client = Client()
+        self.client.force_login(self.user)
+
+    def test_upload_is_rotated_downscaled_and_stripped(self):
+        """Загруженная картинка повёрнута по EXIF, уменьшена
+        и сохранена без метаданных"""
+        exif = Image.Exif()
+        exif[0x0112] = 6
+        self.client.post(
+            reverse('posts:post_create'),
+            data={
+                'text': 'text',
+                'image': make_image(
+                    'camera.jpg', (4000, 3000), exif=exif.tobytes()
+                ),
+            }
+        )
+        post = Post.objects.get()
+        self.assertEqual(
+            post.image.name, content_name('posts/camera.jpg', post.image)
+        )
+        with Image.open(post.image.path) as image:
+            self.assertEqual(image.format, 'JPEG')
+            self.assertEqual(image.size, (1920, 2560))
+            self.assertNotIn('exif', image.info)
+
+    def test_png_metadata_is_stripped(self):
+        """EXIF не переносится и в PNG"""
+        exif = Image.Exif()
+        exif[0x0112] = 6
+        self.client.post(
+            reverse('posts:post_create'),
+            data={
+                'text': 'text',
+                'image': make_image(
+                    'screen.png', (400, 300), 'PNG', exif=exif.tobytes()
+                ),
+            }
+        )
+        with Image.open(Post.objects.get().image.path) as image:
+            image.load()
+            self.assertEqual(image.size, (300, 400))
+            self.assertNotIn('exif', image.info)
+
+    def test_broken_image_is_form_error(self):
+        """Обрезанный файл картинки - ошибка формы, а не 500"""
+        upload = make_image('broken.jpg', (400, 300))
+        upload = SimpleUploadedFile(
+            'broken.jpg', upload.read()[:1000], content_type='image/jpeg'
+        )
+        response = self.client.post(
+            reverse('posts:post_create'),
+            data={'text': 'text', 'image': upload}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.context['form'].has_error('image'))
+        self.assertFalse(Post.objects.exists())
+
+    def test_draft_decoding_for_thumbnails(self):
+        """Движок миниатюр декодирует JPEG в уменьшенном масштабе"""
+        upload = make_image(size=(4000, 3000))
+        with Image.open(upload) as image:
+            thumbnail = PostThumbnailEngine().create(
+                image, (960, 339), {
+                    'crop': 'center', 'upscale': True, 'cropbox': None,
+                    'colorspace': 'RGB', 'format': 'JPEG',
+                    'orientation': True, 'padding': False,
+                    'rounded': None, 'blur': None,
+                }
+            )
+            self.assertEqual(image.size, (1000, 750))
+        self.assertEqual(thumbnail.size, (960, 339))
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class ContentAddressedStorageTests(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(username='author')
+
+    @override_settings(POSTS_IMAGE_REUSE_GRACE=0)
+    def test_same_image_is_stored_once(self):
+        """Одинаковые картинки хранятся одним файлом, который
+        удаляется вместе с последним ссылающимся постом"""
+        first, second = (
+            Post.objects.create(
+                author=self.user, text='text', image=make_image(name)
+            )
+            for name in ('meme.jpg', 'repost.jpg')
+        )
+        self.assertEqual(first.image.name, second.image.name)
+        name = first.image.name
+        self.assertEqual(StoredImage.objects.get(name=name).references, 2)
+
+        first.delete()
+        self.assertTrue(second.image.storage.exists(name))
+        second.delete()
+        self.assertFalse(second.image.storage.exists(name))
+        self.assertFalse(StoredImage.objects.exists())
+
+    def test_reused_file_survives_last_release(self):
+        """Файл, который нашла загрузка, ещё не взявшая ссылку,
+        не удаляется вместе с последним ссылавшимся постом"""
+        post = Post.objects.create(
+            author=self.user, text='text', image=make_image()
+        )
+        name, storage = post.image.name, post.image.storage
+        os.utime(storage.path(name), (0, 0))
+
+        self.assertEqual(storage.save('posts/again.jpg', make_image()), name)
+        post.delete()
+
+        self.assertTrue(storage.exists(name))
+        Post.objects.create(author=self.user, text='text', image=name)
+        self.assertEqual(StoredImage.objects.get(name=name).references, 1)
+
+    def test_unused_file_is_deleted(self):
+        """Файл, который давно не загружали, удаляется сразу"""
+        post = Post.objects.create(
+            author=self.user, text='text', image=make_image()
+        )
+        name, storage = post.image.name, post.image.storage
+        os.utime(storage.path(name), (0, 0))
+
+        post.delete()
+
+        self.assertFalse(storage.exists(name))
+        self.assertFalse(os.path.exists(
+            storage.path(name) + storage.tombstone_suffix
+        ))
+        self.assertFalse(StoredImage.objects.exists())
+
+    def test_dedupe_command(self):
+        """Команда переносит старые файлы под имена по хешу
+        и сливает дубликаты"""
+        storage = FileSystemStorage(location=TEMP_MEDIA_ROOT)
+        legacy = []
+        for name in ('posts/a.jpg', 'posts/b.jpg'):
+            legacy.append(storage.save(name, make_image()))
+            Post.objects.create(author=self.user, text='text', image=name)
+
+        call_command('dedupe_images', stdout=StringIO())
+
+        names = set(Post.objects.values_list('image', flat=True))
+        self.assertEqual(len(names), 1)
+        name = names.pop()
+        with storage.open(name) as content:
+            self.assertEqual(name, content_name('posts/a.jpg', content))
+        for old_name in legacy:
+            self.assertFalse(storage.exists(old_name))
+        self.assertEqual(
+            list(StoredImage.objects.values_list('name', 'references')),
+            [(name, 2)]
+        )
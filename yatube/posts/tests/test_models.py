@@ -1,7 +1,10 @@
+from io import StringIO
+
 from django.contrib.auth import get_user_model
+from django.core.management import call_command
 from django.test import TestCase
 
-from ..models import Group, Post
+from ..models import AuthorStats, Comment, Follow, Group, Post
 
 User = get_user_model()
 
@@ -61,3 +64,83 @@ class PostModelTest(TestCase):
                     self.post._meta.get_field(field).help_text,
                     expected_value
                 )
+
+
+class CountersTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='author')
+        cls.reader = User.objects.create_user(username='reader')
+        cls.group_1 = Group.objects.create(
+            title='Группа 1',
+            slug='group-1',
+            description='Тестовое описание',
+        )
+        cls.group_2 = Group.objects.create(
+            title='Группа 2',
+            slug='group-2',
+            description='Тестовое описание',
+        )
+
+    def assertCounters(self, author_posts, group_1_posts, group_2_posts):
+        self.assertEqual(
+            AuthorStats.objects.get(user=self.author).posts_count,
+            author_posts
+        )
+        self.group_1.refresh_from_db()
+        self.group_2.refresh_from_db()
+        self.assertEqual(self.group_1.posts_count, group_1_posts)
+        self.assertEqual(self.group_2.posts_count, group_2_posts)
+
+    def test_post_counters_follow_create_edit_and_delete(self):
+        """Счётчики постов автора и групп следуют за созданием,
+        сменой группы и удалением поста."""
+        post = Post.objects.create(
+            author=self.author, text='Тестовый пост', group=self.group_1
+        )
+        self.assertCounters(1, 1, 0)
+
+        post.group = self.group_2
+        post.save()
+        self.assertCounters(1, 0, 1)
+
+        post.delete()
+        self.assertCounters(0, 0, 0)
+
+    def test_comment_counter_survives_post_edit(self):
+        """Счётчик комментариев растёт и не затирается
+        сохранением загруженного ранее поста."""
+        post = Post.objects.create(author=self.author, text='Тестовый пост')
+        Comment.objects.create(post=post, author=self.reader, text='Ок')
+
+        post.text = 'Новый текст'
+        post.save()
+        post.refresh_from_db()
+        self.assertEqual(post.comments_count, 1)
+
+    def test_follow_counters(self):
+        """Подписка и отписка меняют счётчики подписчиков и подписок."""
+        Follow.objects.create(user=self.reader, author=self.author)
+        self.assertEqual(
+            AuthorStats.objects.get(user=self.author).followers_count, 1
+        )
+        self.assertEqual(
+            AuthorStats.objects.get(user=self.reader).following_count, 1
+        )
+
+        Follow.objects.filter(user=self.reader).delete()
+        self.assertEqual(
+            AuthorStats.objects.get(user=self.author).followers_count, 0
+        )
+
+    def test_recount_repairs_drift(self):
+        """Команда recount восстанавливает разошедшиеся счётчики."""
+        Post.objects.bulk_create([
+            Post(author=self.author, text='Тестовый пост', group=self.group_1)
+            for _ in range(3)
+        ])
+        self.assertCounters(0, 0, 0)
+
+        call_command('recount', stdout=StringIO())
+        self.assertCounters(3, 3, 0)
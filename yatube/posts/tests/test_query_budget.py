@@ -0,0 +1,103 @@
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+
+from about.urls import urlpatterns as about_urls
+from core.testing import QueryBudgetMixin
+from posts.models import Comment, Follow, Group, Post
+from posts.urls import urlpatterns as posts_urls
+from users.urls import urlpatterns as users_urls
+
+User = get_user_model()
+
+
+class QueryBudgetTest(QueryBudgetMixin, TestCase):
+    url_modules = (
+        ('posts', posts_urls),
+        ('auth', users_urls),
+        ('about', about_urls),
+    )
+    query_budgets = {
+        'posts:index': 4,
+        'posts:group': 5,
+        'posts:profile': 5,
+        'posts:post_detail': 4,
+        'posts:search': 2,
+        'posts:add_comment': 5,
+        'posts:post_create': 5,
+        'posts:post_edit': 7,
+        'posts:follow_index': 6,
+        'posts:profile_follow': 12,
+        'posts:profile_unfollow': 10,
+        'auth:signup': 2,
+        'auth:logout': 4,
+        'auth:login': 2,
+        'auth:password_change': 2,
+        'auth:password_change_done': 2,
+        'auth:password_reset_form': 2,
+        'about:author': 2,
+        'about:tech': 2,
+    }
+    paginated_routes = (
+        'posts:index',
+        'posts:group',
+        'posts:profile',
+        'posts:follow_index',
+    )
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+
+        cls.reader = User.objects.create(username='reader')
+        authors = [
+            User.objects.create(
+                username=f'author_{i}',
+                first_name=f'Имя {i}',
+                last_name=f'Фамилия {i}',
+            )
+            for i in range(5)
+        ]
+        groups = [
+            Group.objects.create(
+                title=f'Группа {i}',
+                slug=f'group-{i}',
+                description='Тестовое описание',
+            )
+            for i in range(3)
+        ]
+        for author in authors:
+            Follow.objects.create(user=cls.reader, author=author)
+        # Лента подписок и страница поста собраны из постов
+        # и комментариев разных авторов, чтобы число запросов
+        # не зависело от их числа.
+        for author in authors[1:]:
+            Follow.objects.create(user=authors[0], author=author)
+        for i in range(60):
+            post = Post.objects.create(
+                author=authors[i % len(authors)],
+                group=groups[i % len(groups)] if i % 4 else None,
+                text=f'Тестовый пост {i}',
+            )
+            for j in range(i % 3):
+                Comment.objects.create(
+                    post=post,
+                    author=authors[j],
+                    text=f'Комментарий {j}',
+                )
+        cls.author = authors[0]
+        cls.group = groups[0]
+        cls.post = cls.author.posts.first()
+        for author in authors:
+            Comment.objects.create(
+                post=cls.post, author=author, text='Комментарий'
+            )
+
+    def get_user(self):
+        return self.author
+
+    def get_route_kwargs(self):
+        return {
+            'slug': self.group.slug,
+            'username': self.reader.username,
+            'post_id': self.post.pk,
+        }
@@ -0,0 +1,98 @@
+import re
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
+from django.test import Client, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from posts.models import Comment, Follow, Group, Post
+from posts.urls import urlpatterns
+
+User = get_user_model()
+
+LARGE_TABLES = (
+    'posts_post',
+    'posts_comment',
+    'posts_follow',
+    'posts_feedentry',
+)
+FULL_SCAN = re.compile(
+    r'^SCAN (TABLE )?({})\b(?!.* USING )'.format('|'.join(LARGE_TABLES))
+)
+
+
+class QueryPlanTest(TestCase):
+    """Запросы каждой страницы posts.urls идут по индексам: без полного
+    прохода по большим таблицам и без сортировки во временном B-дереве.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+
+        cls.user = User.objects.create(username='reader')
+        cls.author = User.objects.create(username='author')
+        cls.group = Group.objects.create(
+            title='test title',
+            slug='test-slug',
+            description='test description'
+        )
+        Follow.objects.create(user=cls.user, author=cls.author)
+        for i in range(12):
+            post = Post.objects.create(
+                author=cls.author,
+                text=f'test_text {i}',
+                group=cls.group
+            )
+        cls.post = post
+        Comment.objects.create(post=post, author=cls.user, text='comment')
+
+        cls.client = Client()
+        cls.client.force_login(cls.author)
+
+    def setUp(self):
+        cache.clear()
+
+    def url_kwargs(self):
+        return {
+            'slug': self.group.slug,
+            'username': self.user.username,
+            'post_id': self.post.pk,
+        }
+
+    def urls(self):
+        kwargs = self.url_kwargs()
+        for pattern in urlpatterns:
+            url_kwargs = {
+                name: kwargs[name] for name in pattern.pattern.converters
+            }
+            yield reverse(f'posts:{pattern.name}', kwargs=url_kwargs)
+
+    def assertIndexedPlans(self, url, queries):
+        cursor = connection.cursor()
+        for query in queries:
+            sql = query['sql']
+            if not sql.startswith('SELECT') or 'posts_' not in sql:
+                continue
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+            for *_, detail in cursor.fetchall():
+                with self.subTest(url=url, sql=sql, plan=detail):
+                    self.assertNotIn('USE TEMP B-TREE', detail)
+                    self.assertIsNone(FULL_SCAN.match(detail))
+
+    def check_urls(self):
+        for url in self.urls():
+            with CaptureQueriesContext(connection) as queries:
+                self.client.get(url)
+            self.assertIndexedPlans(url, queries)
+
+    def test_views_use_indexes(self):
+        """Страницы с номерной паджинацией используют индексы."""
+        self.check_urls()
+
+    @override_settings(POSTS_CURSOR_PAGINATION=True)
+    def test_views_use_indexes_with_cursor_pagination(self):
+        """Страницы с курсорной паджинацией используют индексы."""
+        self.check_urls()
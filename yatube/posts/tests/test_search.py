@@ -0,0 +1,89 @@
+from django.contrib.auth import get_user_model
+from django.test import Client, TestCase, override_settings
+from django.urls import reverse
+
+from posts.models import Comment, Group, Post
+
+User = get_user_model()
+
+
+class SearchTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create(username='author')
+        cls.group = Group.objects.create(
+            title='Рыбалка',
+            slug='fishing',
+            description='test description'
+        )
+        cls.repeated = Post.objects.create(
+            author=cls.user, text='Щука, щука и ещё раз щука'
+        )
+        cls.once = Post.objects.create(
+            author=cls.user, text='Поймал щуку? Нет, щука ушла'
+        )
+        cls.commented = Post.objects.create(author=cls.user, text='Улов')
+        Comment.objects.create(
+            post=cls.commented, author=cls.user, text='Отличная щука'
+        )
+        cls.grouped = Post.objects.create(
+            author=cls.user, text='Утро на реке', group=cls.group
+        )
+        cls.other = Post.objects.create(author=cls.user, text='Пирог')
+
+    def setUp(self):
+        self.client = Client()
+
+    def search(self, query, **params):
+        response = self.client.get(
+            reverse('posts:search'), {'q': query, **params}
+        )
+        return list(response.context['page_obj'])
+
+    def test_ranked_search(self):
+        """Посты ищутся по тексту, комментариям и группе, более
+        релевантные идут первыми"""
+        self.assertEqual(
+            self.search('щука'), [self.repeated, self.once, self.commented]
+        )
+        self.assertEqual(self.search('РЫБАЛКА'), [self.grouped])
+        self.assertEqual(self.search('пирог щука'), [])
+
+    def test_index_follows_changes(self):
+        """Индекс обновляется при правке и удалении"""
+        self.other.text = 'Пирог с щукой'
+        self.other.save()
+        self.assertIn(self.other, self.search('пирог'))
+        Post.objects.get(pk=self.repeated.pk).delete()
+        self.assertNotIn(self.repeated, self.search('щука'))
+        Comment.objects.filter(post=self.commented).delete()
+        self.assertNotIn(self.commented, self.search('щука'))
+
+    def test_operators_are_plain_words(self):
+        """Синтаксис FTS5 в запросе не ломает поиск"""
+        for query in ('"щука', 'щука OR NOT', 'text:*', ''):
+            with self.subTest(query=query):
+                response = self.client.get(
+                    reverse('posts:search'), {'q': query}
+                )
+                self.assertEqual(response.status_code, 200)
+
+    @override_settings(POSTS_PER_PAGE=2)
+    def test_pagination_keeps_query(self):
+        """Страницы результатов сохраняют запрос"""
+        self.assertEqual(self.search('щука', page=2), [self.commented])
+        response = self.client.get(reverse('posts:search'), {'q': 'щука'})
+        self.assertContains(response, '?q=%D1%89%D1%83%D0%BA%D0%B0&amp;page=2')
+
+    def test_admin_search_uses_index(self):
+        """Поиск в админке идёт по индексу"""
+        admin = User.objects.create_superuser('admin', 'a@a.ru', 'password')
+        self.client.force_login(admin)
+        response = self.client.get(
+            reverse('admin:posts_post_changelist'), {'q': 'щука'}
+        )
+        self.assertEqual(
+            set(response.context['cl'].result_list),
+            {self.repeated, self.once}
+        )
@@ -0,0 +1,68 @@
+from io import StringIO
+
+from django.core.management import call_command
+from django.db.models import Count
+from django.test import TestCase
+from django.utils import timezone
+
+from posts.models import AuthorStats, Comment, Follow, Group, Post, User
+from posts.search import SearchResults
+
+
+class SeedDatasetTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        call_command(
+            'seed_dataset',
+            users=30,
+            groups=4,
+            posts=300,
+            comments=500,
+            follows=200,
+            seed=1,
+            stdout=StringIO(),
+        )
+
+    def test_counts(self):
+        """Создано столько записей, сколько запрошено"""
+        self.assertEqual(User.objects.count(), 30)
+        self.assertEqual(Group.objects.count(), 4)
+        self.assertEqual(Post.objects.count(), 300)
+        self.assertEqual(Comment.objects.count(), 500)
+        self.assertEqual(Follow.objects.count(), 200)
+
+    def test_activity_is_skewed(self):
+        """Самый активный автор пишет намного больше медианного,
+        подписки тоже сосредоточены на немногих авторах"""
+        for queryset in (
+            User.objects.annotate(total=Count('posts')),
+            User.objects.annotate(total=Count('following')),
+        ):
+            with self.subTest(queryset=queryset):
+                totals = sorted(
+                    queryset.values_list('total', flat=True), reverse=True
+                )
+                self.assertGreater(totals[0], 3 * totals[len(totals) // 2])
+
+    def test_dates_are_consistent(self):
+        """Комментарии не старше своих постов, даты не в будущем"""
+        self.assertFalse(Post.objects.filter(
+            pub_date__gt=timezone.now()
+        ).exists())
+        self.assertGreater(len({
+            post.pub_date.date() for post in Post.objects.all()
+        }), 100)
+        for comment in Comment.objects.select_related('post'):
+            self.assertGreaterEqual(comment.created, comment.post.pub_date)
+
+    def test_derived_state_is_rebuilt(self):
+        """Счётчики и поисковый индекс пересчитаны после вставки"""
+        author = User.objects.annotate(
+            total=Count('posts')
+        ).order_by('-total').first()
+        self.assertEqual(
+            AuthorStats.objects.get(user=author).posts_count, author.total
+        )
+        word = Post.objects.first().text.split()[0].strip('.')
+        self.assertGreater(SearchResults(word).count(), 0)
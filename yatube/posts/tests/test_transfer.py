@@ -0,0 +1,140 @@
+import json
+import os
+import tempfile
+from collections import defaultdict
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import TestCase
+
+from posts import transfer
+from posts.models import AuthorStats, Comment, FeedEntry, Follow, Group, Post
+from posts.search import SearchResults
+
+User = get_user_model()
+
+
+class ContentTransferTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        author = User.objects.create(username='author', first_name='Имя')
+        reader = User.objects.create(username='reader')
+        group = Group.objects.create(
+            title='Рыбалка', slug='fishing', description='test description'
+        )
+        post = Post.objects.create(
+            author=author, group=group, text='Поймал щуку'
+        )
+        Post.objects.create(author=author, text='Второй пост')
+        Comment.objects.create(post=post, author=reader, text='Отлично')
+        Follow.objects.create(user=reader, author=author)
+
+    def snapshot(self):
+        return {
+            model: list(model.objects.order_by('pk').values())
+            for model in (Group, User, Post, Comment, Follow)
+        }
+
+    def test_round_trip(self):
+        """Выгрузка и загрузка переносят все записи с датами и ключами,
+        а производные данные пересчитываются"""
+        before = self.snapshot()
+        output = StringIO()
+        call_command('export_content', stdout=output, stderr=StringIO())
+        lines = output.getvalue().splitlines()
+        self.assertEqual(len(lines), 7)
+        self.assertEqual(json.loads(lines[0])['model'], 'posts.group')
+
+        for model in (Follow, Comment, Post, Group, User):
+            model.objects.all().delete()
+        with open(self.tmp_path(lines), encoding='utf-8') as stream:
+            call_command('import_content', stream.name, stdout=StringIO())
+
+        self.assertEqual(self.snapshot(), before)
+        author = User.objects.get(username='author')
+        self.assertEqual(AuthorStats.objects.get(user=author).posts_count, 2)
+        post = Post.objects.get(text='Поймал щуку')
+        self.assertEqual(post.comments_count, 1)
+        self.assertEqual(FeedEntry.objects.count(), 2)
+        self.assertEqual(len(SearchResults('щуку')[0:10]), 1)
+
+    def test_import_is_idempotent(self):
+        """Повторная загрузка той же выгрузки ничего не дублирует"""
+        output = StringIO()
+        call_command('export_content', stdout=output, stderr=StringIO())
+        path = self.tmp_path(output.getvalue().splitlines())
+        with open(path, encoding='utf-8') as stream:
+            imported = transfer.import_content(stream)
+        self.assertEqual(sum(imported.values()), 0)
+        self.assertEqual(Post.objects.count(), 2)
+        self.assertEqual(Follow.objects.count(), 1)
+
+    def test_import_into_non_empty_base(self):
+        """Записи с занятыми pk получают новые ключи, связи идут
+        на локальные строки, а совпавший username - тот же автор"""
+        author = User.objects.get(username='author')
+        group = Group.objects.get()
+        post = Post.objects.get(group=group)
+        records = [
+            ('posts.group', group.pk, {
+                'title': 'Охота', 'slug': 'hunting', 'description': '',
+            }),
+            ('auth.user', author.pk, {
+                'username': 'newbie', 'password': '', 'first_name': 'Новичок',
+            }),
+            ('auth.user', 999, {'username': 'author', 'password': ''}),
+            ('posts.post', post.pk, {
+                'text': 'Подстрелил утку', 'author_id': author.pk,
+                'group_id': group.pk, 'pub_date': '2020-01-01T00:00:00+00:00',
+            }),
+            ('posts.comment', 1, {
+                'post_id': post.pk, 'author_id': 999, 'text': 'Ого',
+                'created': '2020-01-02T00:00:00+00:00',
+            }),
+            ('posts.follow', 1, {'user_id': author.pk, 'author_id': 999}),
+        ]
+        stream = StringIO('\n'.join(
+            json.dumps({'model': model, 'pk': pk, 'fields': fields})
+            for model, pk, fields in records
+        ))
+
+        imported = transfer.import_content(stream)
+
+        self.assertEqual(imported, {
+            'posts.group': 1, 'auth.user': 1, 'posts.post': 1,
+            'posts.comment': 1, 'posts.follow': 1,
+        })
+        self.assertEqual(Post.objects.get(pk=post.pk).text, 'Поймал щуку')
+        new_post = Post.objects.get(text='Подстрелил утку')
+        newbie = User.objects.get(username='newbie')
+        self.assertEqual(new_post.author, newbie)
+        self.assertEqual(new_post.group.slug, 'hunting')
+        self.assertEqual(new_post.comments.get().author, author)
+        self.assertTrue(
+            Follow.objects.filter(user=newbie, author=author).exists()
+        )
+
+    def tmp_path(self, lines):
+        stream = tempfile.NamedTemporaryFile(
+            'w', suffix='.ndjson', delete=False, encoding='utf-8'
+        )
+        with stream:
+            stream.write('\n'.join(lines) + '\n')
+        self.addCleanup(os.remove, stream.name)
+        return stream.name
+
+    def test_bulk_created_users_get_stats(self):
+        """Пользователи из пачки получают AuthorStats сразу,
+        не дожидаясь пересчёта"""
+        transfer.save_batch(
+            [(101, User(username='bulk_1')), (102, User(username='bulk_2'))],
+            defaultdict(dict)
+        )
+        self.assertEqual(
+            AuthorStats.objects.filter(
+                user__username__startswith='bulk_'
+            ).count(),
+            2
+        )
@@ -1,16 +1,25 @@
 import shutil
 import tempfile
 import time
+from io import StringIO
 
 from django import forms
 
 from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files.base import ContentFile
 from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.template.loader import render_to_string
 from django.test import Client, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 
-from posts.models import Follow, Group, Post
+from posts.models import CelebrityAuthor, FeedEntry, Follow, Group, Post
+from posts.storage import content_name
+from posts.utils import WindowedPaginator
 
 User = get_user_model()
 
@@ -47,6 +56,9 @@ class PostsTest(TestCase):
             content=small_gif,
             content_type='image/gif'
         )
+        cls.image_name = content_name(
+            'posts/small.gif', ContentFile(small_gif)
+        )
 
         Post.objects.create(
             pk=1,
@@ -112,7 +124,7 @@ class PostsTest(TestCase):
                 self.assertEqual(test_post.pk, 2)
                 self.assertEqual(test_post.author, self.user)
                 self.assertEqual(test_post.text, 'test_text_2' * 100)
-                self.assertEqual(test_post.image, 'posts/small.gif')
+                self.assertEqual(test_post.image, self.image_name)
 
     def test_post_detail_page_shows_correct_context(self):
         """Шаблон post_detail сформирован с правильным контекстом."""
@@ -123,7 +135,7 @@ class PostsTest(TestCase):
         self.assertEqual(test_post.pk, 2)
         self.assertEqual(test_post.author, self.user)
         self.assertEqual(test_post.text, 'test_text_2' * 100)
-        self.assertEqual(test_post.image, 'posts/small.gif')
+        self.assertEqual(test_post.image, self.image_name)
 
     def test_post_create_page_shows_correct_context_while_creating(self):
         """Шаблон post_create сформирован с правильным контекстом
@@ -217,6 +229,138 @@ class PaginatorViewsTest(TestCase):
                 self.assertEqual(posts_count, 1)
 
 
+@override_settings(POSTS_CURSOR_PAGINATION=True)
+class CursorPaginatorViewsTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+
+        cls.user = User.objects.create(username='dummy')
+        cls.authorized_client = Client()
+        cls.authorized_client.force_login(cls.user)
+
+        cls.group = Group.objects.create(
+            title='test title',
+            slug='test-slug',
+            description='test description'
+        )
+
+        Post.objects.bulk_create([
+            Post(
+                pk=i,
+                author=cls.user,
+                text='test_text' * 100,
+                group=cls.group
+            )
+            for i in range(1, 12)
+        ])
+
+    def setUp(self):
+        cache.clear()
+
+    def test_cursor_pages_split_posts_without_count(self):
+        """Курсорный паджинатор делит ленты index/group_list/profile
+        на страницы без запроса COUNT(*)."""
+        pages = [
+            reverse('posts:index'),
+            reverse('posts:group', args=['test-slug']),
+            reverse('posts:profile', args=['dummy']),
+        ]
+
+        for page in pages:
+            with self.subTest(page=page):
+                with CaptureQueriesContext(connection) as queries:
+                    response = self.client.get(page)
+                first_page = response.context['page_obj']
+                self.assertEqual(len(first_page), 10)
+                self.assertFalse(first_page.has_previous())
+                self.assertFalse(any(
+                    'COUNT(' in query['sql'] for query in queries
+                ))
+
+                response = self.client.get(
+                    page, {'cursor': first_page.next_cursor}
+                )
+                second_page = response.context['page_obj']
+                self.assertEqual(len(second_page), 1)
+                self.assertFalse(second_page.has_next())
+
+                response = self.client.get(
+                    page, {'cursor': second_page.previous_cursor}
+                )
+                self.assertEqual(
+                    list(response.context['page_obj']), list(first_page)
+                )
+
+    def test_follow_index_uses_cursor_pages(self):
+        """Лента подписок тоже листается курсором."""
+        follower = User.objects.create(username='follower')
+        Follow.objects.create(user=follower, author=self.user)
+        client = Client()
+        client.force_login(follower)
+
+        response = client.get(reverse('posts:follow_index'))
+        first_page = response.context['page_obj']
+        self.assertEqual(len(first_page), 10)
+
+        response = client.get(
+            reverse('posts:follow_index'),
+            {'cursor': first_page.next_cursor}
+        )
+        self.assertEqual(len(response.context['page_obj']), 1)
+
+    def test_broken_cursor_shows_first_page(self):
+        """Испорченный курсор открывает первую страницу."""
+        response = self.client.get(
+            reverse('posts:index'), {'cursor': 'broken'}
+        )
+        page_obj = response.context['page_obj']
+        self.assertEqual(len(page_obj), 10)
+        self.assertFalse(page_obj.has_previous())
+
+
+class PaginatorWindowTest(TestCase):
+    PAGE_COUNTS = (10, 1000, 100000)
+
+    @staticmethod
+    def render_navigation(num_pages, number):
+        page_obj = WindowedPaginator(
+            range(num_pages * 10), 10
+        ).get_page(number)
+        page_obj.page_window = page_obj.paginator.get_elided_page_range(
+            page_obj.number
+        )
+        return render_to_string(
+            'posts/includes/paginator.html', {'page_obj': page_obj}
+        )
+
+    def test_navigation_is_windowed(self):
+        """Навигация показывает окно вокруг текущей страницы,
+        первую и последнюю страницы и пропуски между ними."""
+        window = WindowedPaginator(range(1000), 10).get_elided_page_range(
+            50, on_each_side=2, on_ends=1
+        )
+        self.assertEqual(
+            window, [1, '…', 48, 49, 50, 51, 52, '…', 100]
+        )
+
+    def test_navigation_size_stays_flat(self):
+        """Число пунктов и ссылок навигации не растёт
+        с количеством страниц."""
+        items = {}
+        links = {}
+        for num_pages in self.PAGE_COUNTS:
+            navigation = self.render_navigation(num_pages, num_pages // 2)
+            items[num_pages] = navigation.count('<li')
+            links[num_pages] = navigation.count('href=')
+            self.assertIn(f'page={num_pages}"', navigation)
+
+        self.assertEqual(len(set(items.values())), 1)
+        # Начиная с тысячи страниц окно всегда с пропусками
+        # с обеих сторон, поэтому и число ссылок одинаково.
+        self.assertEqual(links[1000], links[100000])
+
+
 class PostGroupTest(TestCase):
     @classmethod
     def setUpClass(cls):
@@ -330,3 +474,199 @@ class FollowTest(TestCase):
 
         self.assertContains(follower_response, test_post)
         self.assertNotContains(not_follower_response, test_post)
+
+
+class FollowFeedTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+
+        cls.author = User.objects.create(username='author')
+        cls.follower = User.objects.create(username='follower')
+
+        cls.follower_client = Client()
+        cls.follower_client.force_login(cls.follower)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_new_post_is_pushed_to_follower_feed(self):
+        """Новый пост автора сразу записывается в ленты подписчиков."""
+        Follow.objects.create(user=self.follower, author=self.author)
+        post = Post.objects.create(author=self.author, text='test_text')
+
+        self.assertTrue(
+            FeedEntry.objects.filter(user=self.follower, post=post).exists()
+        )
+        response = self.follower_client.get(reverse('posts:follow_index'))
+        self.assertEqual(list(response.context['page_obj']), [post])
+
+    def test_unfollow_drops_author_posts_from_feed(self):
+        """После отписки посты автора пропадают из ленты."""
+        Post.objects.create(author=self.author, text='test_text')
+        self.follower_client.get(
+            reverse('posts:profile_follow', args=[self.author.username])
+        )
+        self.assertEqual(
+            FeedEntry.objects.filter(user=self.follower).count(), 1
+        )
+
+        self.follower_client.get(
+            reverse('posts:profile_unfollow', args=[self.author.username])
+        )
+        self.assertFalse(
+            FeedEntry.objects.filter(user=self.follower).exists()
+        )
+
+    @override_settings(POSTS_FEED_MAX_LENGTH=2)
+    def test_backfill_is_trimmed_to_feed_length(self):
+        """При подписке лента дополняется не больше чем
+        POSTS_FEED_MAX_LENGTH последними постами."""
+        for i in range(3):
+            Post.objects.create(author=self.author, text=f'test_text {i}')
+            time.sleep(0.001)
+        Follow.objects.create(user=self.follower, author=self.author)
+
+        response = self.follower_client.get(reverse('posts:follow_index'))
+        self.assertEqual(
+            [post.text for post in response.context['page_obj']],
+            ['test_text 2', 'test_text 1'],
+        )
+
+    @override_settings(POSTS_FEED_MAX_LENGTH=2)
+    def test_pushed_feeds_are_trimmed_to_feed_length(self):
+        """trim_feeds обрезает до POSTS_FEED_MAX_LENGTH только ленты,
+        выросшие при раздаче новых постов."""
+        reader = User.objects.create(username='reader')
+        Follow.objects.create(user=self.follower, author=self.author)
+        for i in range(3):
+            Post.objects.create(author=self.author, text=f'test_text {i}')
+            time.sleep(0.001)
+        Follow.objects.create(user=reader, author=self.author)
+        self.assertEqual(
+            FeedEntry.objects.filter(user=self.follower).count(), 3
+        )
+        reader_entries = set(
+            FeedEntry.objects.filter(user=reader).values_list('pk', flat=True)
+        )
+
+        call_command('trim_feeds', stdout=StringIO())
+        self.assertEqual(
+            set(FeedEntry.objects.filter(
+                user=reader
+            ).values_list('pk', flat=True)),
+            reader_entries,
+        )
+        self.assertEqual(
+            list(FeedEntry.objects.filter(
+                user=self.follower
+            ).values_list('post__text', flat=True)),
+            ['test_text 2', 'test_text 1'],
+        )
+
+    @override_settings(POSTS_FEED_MAX_LENGTH=2)
+    def test_rebuild_matches_backfill(self):
+        """Пересборка лент даёт те же записи, что раздача при
+        подписке, и пропускает популярных авторов."""
+        celebrity = User.objects.create(username='celebrity')
+        CelebrityAuthor.objects.create(author=celebrity, followers_count=1)
+        for author in (self.author, celebrity):
+            for i in range(3):
+                Post.objects.create(author=author, text=f'test_text {i}')
+                time.sleep(0.001)
+            Follow.objects.create(user=self.follower, author=author)
+        entries = FeedEntry.objects.values_list(
+            'user', 'post', 'author', 'pub_date'
+        )
+        expected = set(entries)
+        self.assertEqual(len(expected), 2)
+
+        call_command('rebuild_feeds', stdout=StringIO())
+        self.assertEqual(set(entries), expected)
+
+    def test_celebrity_posts_are_merged_at_read_time(self):
+        """Посты популярного автора не раскладываются по лентам,
+        а подмешиваются при чтении в порядке публикации."""
+        celebrity = User.objects.create(username='celebrity')
+        fan = User.objects.create(username='fan')
+        Follow.objects.create(user=self.follower, author=self.author)
+        Follow.objects.create(user=self.follower, author=celebrity)
+        Follow.objects.create(user=fan, author=celebrity)
+        old_post = Post.objects.create(author=celebrity, text='old')
+        time.sleep(0.001)
+
+        call_command('reclassify_authors', threshold=2, stdout=StringIO())
+        self.assertTrue(CelebrityAuthor.objects.filter(
+            author=celebrity
+        ).exists())
+        self.assertFalse(FeedEntry.objects.filter(author=celebrity).exists())
+
+        regular_post = Post.objects.create(author=self.author, text='new')
+        time.sleep(0.001)
+        new_post = Post.objects.create(author=celebrity, text='newest')
+        self.assertFalse(FeedEntry.objects.filter(post=new_post).exists())
+
+        response = self.follower_client.get(reverse('posts:follow_index'))
+        self.assertEqual(
+            list(response.context['page_obj']),
+            [new_post, regular_post, old_post],
+        )
+
+        Follow.objects.filter(user=fan).delete()
+        call_command('reclassify_authors', threshold=2, stdout=StringIO())
+        self.assertFalse(CelebrityAuthor.objects.exists())
+        self.assertEqual(
+            FeedEntry.objects.filter(
+                user=self.follower, author=celebrity
+            ).count(),
+            2
+        )
+
+
+@override_settings(POSTS_FEED_BACKEND='timelines')
+class TimelineFeedTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+
+        cls.author_1 = User.objects.create(username='author_1')
+        cls.author_2 = User.objects.create(username='author_2')
+        cls.follower = User.objects.create(username='follower')
+
+        cls.follower_client = Client()
+        cls.follower_client.force_login(cls.follower)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_feed_merges_author_timelines(self):
+        """Лента собирается слиянием лент авторов без записи FeedEntry."""
+        Follow.objects.create(user=self.follower, author=self.author_1)
+        Follow.objects.create(user=self.follower, author=self.author_2)
+        posts = []
+        for i in range(12):
+            author = self.author_1 if i % 3 else self.author_2
+            posts.append(
+                Post.objects.create(author=author, text=f'test_text {i}')
+            )
+            time.sleep(0.001)
+        posts.reverse()
+
+        self.assertFalse(FeedEntry.objects.exists())
+        response = self.follower_client.get(reverse('posts:follow_index'))
+        self.assertEqual(list(response.context['page_obj']), posts[:10])
+        response = self.follower_client.get(
+            reverse('posts:follow_index'), {'page': 2}
+        )
+        self.assertEqual(list(response.context['page_obj']), posts[10:])
+
+    def test_timeline_follows_post_deletion(self):
+        """Удалённый пост пропадает из кешированной ленты автора."""
+        Follow.objects.create(user=self.follower, author=self.author_1)
+        post = Post.objects.create(author=self.author_1, text='test_text')
+        response = self.follower_client.get(reverse('posts:follow_index'))
+        self.assertEqual(list(response.context['page_obj']), [post])
+
+        post.delete()
+        response = self.follower_client.get(reverse('posts:follow_index'))
+        self.assertEqual(len(response.context['page_obj']), 0)
@@ -0,0 +1,274 @@
+import hashlib
+import logging
+import math
+from collections import defaultdict
+from functools import partial
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from PIL import Image
+from sorl.thumbnail import default, get_thumbnail
+from sorl.thumbnail.base import ThumbnailBackend
+from sorl.thumbnail.conf import defaults as default_settings
+from sorl.thumbnail.conf import settings as sorl_settings
+from sorl.thumbnail.engines import pil_engine
+from sorl.thumbnail.images import ImageFile, deserialize_image_file
+from sorl.thumbnail.kvstores import cached_db_kvstore
+from sorl.thumbnail.kvstores.base import add_prefix
+from sorl.thumbnail.models import KVStore as KVStoreModel
+
+from core.background import run_in_background
+
+from .feeds import reset_follower_feeds
+from .models import ImageVariant, Post
+from .utils import cache_clear, post_tags
+
+THUMBNAILS_LOCK_KEY = 'posts:thumbnails:{}'
+VARIANTS_KEY = 'posts:variants:{}:{}'
+MIME_TYPES = {
+    'JPEG': 'image/jpeg',
+    'PNG': 'image/png',
+    'GIF': 'image/gif',
+    'WEBP': 'image/webp',
+}
+EMPTY = cached_db_kvstore.EMPTY_VALUE
+
+logger = logging.getLogger(__name__)
+
+
+class PostKVStore(cached_db_kvstore.KVStore):
+    """kvstore sorl с пакетным чтением записей о производных."""
+
+    def get_many(self, image_files):
+        """Готовые производные по списку ImageFile.
+
+        Записи читаются одним get_many из кеша, промахи - одним
+        запросом к базе. Возвращает словарь ключ ImageFile ->
+        производная только для найденных.
+        """
+        keys = {add_prefix(image_file.key): image_file.key
+                for image_file in image_files}
+        values = self.cache.get_many(list(keys))
+        missing = [key for key in keys if key not in values]
+        if missing:
+            found = dict(KVStoreModel.objects.filter(
+                key__in=missing
+            ).values_list('key', 'value'))
+            fetched = {key: found.get(key, EMPTY) for key in missing}
+            self.cache.set_many(fetched, sorl_settings.THUMBNAIL_CACHE_TIMEOUT)
+            values.update(fetched)
+        return {
+            keys[key]: deserialize_image_file(value)
+            for key, value in values.items() if value != EMPTY
+        }
+
+
+class PostThumbnailEngine(pil_engine.Engine):
+    """Движок PIL, который декодирует JPEG сразу в уменьшенном
+    масштабе (draft), а не в полном размере."""
+
+    def create(self, image, geometry, options):
+        if image.format == 'JPEG' and not options.get('cropbox'):
+            x_image, y_image = map(float, image.size)
+            if self.flip_dimensions(image):
+                x_image, y_image = y_image, x_image
+            factor = self._calculate_scaling_factor(
+                x_image, y_image, geometry, options
+            )
+            if factor < 1:
+                image.draft(image.mode, tuple(
+                    math.ceil(side * factor) for side in image.size
+                ))
+        return super().create(image, geometry, options)
+
+
+class PostThumbnailBackend(ThumbnailBackend):
+    """Бэкенд sorl, который умеет найти готовую производную,
+    не создавая её."""
+
+    def thumbnail_file(self, file_, geometry_string, **options):
+        """ImageFile производной, которую вернул бы get_thumbnail."""
+        source = ImageFile(file_)
+        if sorl_settings.THUMBNAIL_PRESERVE_FORMAT:
+            options.setdefault('format', self._get_format(source))
+        for key, value in self.default_options.items():
+            options.setdefault(key, value)
+        for key, attr in self.extra_options:
+            value = getattr(sorl_settings, attr)
+            if value != getattr(default_settings, attr):
+                options.setdefault(key, value)
+        name = self._get_thumbnail_filename(source, geometry_string, options)
+        return ImageFile(name, default.storage)
+
+    def get_ready_thumbnails(self, files, geometry_string, **options):
+        """Готовые производные для списка картинок, None для
+        несозданных. Один поход в kvstore на весь список."""
+        thumbnails = [
+            self.thumbnail_file(file_, geometry_string, **options)
+            for file_ in files
+        ]
+        ready = default.kvstore.get_many(thumbnails)
+        return [ready.get(thumbnail.key) for thumbnail in thumbnails]
+
+
+def image_key(name):
+    return hashlib.md5(name.encode()).hexdigest()
+
+
+def variant_formats(alias):
+    """Форматы вариантов, которые умеет сохранять установленный Pillow."""
+    Image.init()
+    return [image_format
+            for image_format in settings.POSTS_IMAGE_VARIANTS[alias]['formats']
+            if image_format in Image.SAVE]
+
+
+def variant_geometries(alias):
+    """Геометрии вариантов: ширины из POSTS_IMAGE_VARIANTS
+    с пропорциями миниатюры alias."""
+    geometry, _ = settings.POSTS_THUMBNAILS[alias]
+    width, height = (int(side) for side in geometry.split('x'))
+    for variant_width in settings.POSTS_IMAGE_VARIANTS[alias]['widths']:
+        yield f'{variant_width}x{round(height * variant_width / width)}'
+
+
+def generate_variants(name, alias):
+    """Создаёт варианты картинки и сохраняет их описание.
+
+    Описание пишется, только когда готовы все варианты, поэтому
+    srcset никогда не ссылается на несозданный файл.
+    """
+    _, options = settings.POSTS_THUMBNAILS[alias]
+    variants = []
+    for image_format in variant_formats(alias):
+        for geometry in variant_geometries(alias):
+            thumbnail = default.kvstore.get(get_thumbnail(
+                name, geometry, **dict(options, format=image_format)
+            ))
+            if thumbnail is None:
+                logger.warning('Не удалось прочитать картинку %s', name)
+                return
+            variants.append(ImageVariant(
+                source=name,
+                alias=alias,
+                format=image_format,
+                width=thumbnail.width,
+                height=thumbnail.height,
+                name=thumbnail.name,
+            ))
+    with transaction.atomic():
+        ImageVariant.objects.filter(source=name, alias=alias).delete()
+        ImageVariant.objects.bulk_create(variants)
+    cache.delete(VARIANTS_KEY.format(alias, image_key(name)))
+
+
+def generate_thumbnails(name):
+    """Создаёт все производные из POSTS_THUMBNAILS и варианты
+    из POSTS_IMAGE_VARIANTS для картинки.
+
+    Страницы с постами этой картинки закешированы с заглушкой,
+    поэтому в конце сбрасываются их теги и ленты подписчиков авторов.
+    """
+    for geometry, options in settings.POSTS_THUMBNAILS.values():
+        try:
+            get_thumbnail(name, geometry, **options)
+        except Exception:
+            logger.exception('Не удалось создать миниатюру %s', name)
+    for alias in settings.POSTS_IMAGE_VARIANTS:
+        try:
+            generate_variants(name, alias)
+        except Exception:
+            logger.exception('Не удалось создать варианты %s', name)
+    posts = list(
+        Post.objects.filter(image=name).only('pk', 'author_id', 'group_id')
+    )
+    cache_clear(*{tag for post in posts for tag in post_tags(post)})
+    reset_follower_feeds({post.author_id for post in posts})
+
+
+def schedule_thumbnails(name):
+    """Ставит создание производных в фоновый пул после коммита.
+
+    Повторно картинка ставится в очередь не раньше, чем через
+    POSTS_THUMBNAIL_RETRY_TIMEOUT, так что битые и пропавшие
+    файлы не занимают воркеры.
+    """
+    if cache.add(THUMBNAILS_LOCK_KEY.format(image_key(name)), True,
+                 settings.POSTS_THUMBNAIL_RETRY_TIMEOUT):
+        transaction.on_commit(
+            lambda: run_in_background(partial(generate_thumbnails, name))
+        )
+
+
+def picture_sources(variants, alias):
+    """Пары (MIME-тип, srcset) для тегов <source> в порядке форматов
+    из POSTS_IMAGE_VARIANTS."""
+    sources = []
+    for image_format in settings.POSTS_IMAGE_VARIANTS[alias]['formats']:
+        srcset = ', '.join(
+            f'{default.storage.url(name)} {width}w'
+            for variant_format, width, name in variants
+            if variant_format == image_format
+        )
+        if srcset:
+            sources.append((MIME_TYPES[image_format], srcset))
+    return sources
+
+
+def image_sources(names, alias):
+    """Источники <picture> для картинок: имя -> [(MIME-тип, srcset)].
+
+    Описания вариантов читаются одним get_many из кеша, промахи -
+    одним запросом к базе. Картинки без вариантов в ответ не попадают.
+    """
+    if alias not in settings.POSTS_IMAGE_VARIANTS:
+        return {}
+    keys = {VARIANTS_KEY.format(alias, image_key(name)): name
+            for name in names}
+    variants = cache.get_many(list(keys))
+    missing = {keys[key]: key for key in keys if key not in variants}
+    if missing:
+        found = defaultdict(list)
+        for source, *variant in ImageVariant.objects.filter(
+            source__in=missing, alias=alias
+        ).values_list('source', 'format', 'width', 'name'):
+            found[source].append(tuple(variant))
+        fetched = {key: found[name] for name, key in missing.items()}
+        cache.set_many(fetched, None)
+        variants.update(fetched)
+    return {
+        keys[key]: picture_sources(value, alias)
+        for key, value in variants.items() if value
+    }
+
+
+def attach_thumbnails(posts, alias):
+    """Проставляет post.thumbnail и post.image_sources всем постам
+    страницы.
+
+    Производные и описания вариантов ищутся пакетно. Картинка
+    считается готовой, когда есть и миниатюра, и варианты, иначе
+    она ставится в очередь, а post.thumbnail остаётся None.
+    """
+    posts = list(posts)
+    with_images = [post for post in posts if post.image]
+    names = [post.image.name for post in with_images]
+    geometry, options = settings.POSTS_THUMBNAILS[alias]
+    thumbnails = default.backend.get_ready_thumbnails(
+        names, geometry, **options
+    ) if names else []
+    sources = image_sources(names, alias) if names else {}
+    for post in posts:
+        post.thumbnail = None
+        post.image_sources = []
+    for post, thumbnail in zip(with_images, thumbnails):
+        post.image_sources = sources.get(post.image.name, [])
+        if thumbnail is None or (
+            alias in settings.POSTS_IMAGE_VARIANTS
+            and not post.image_sources
+        ):
+            schedule_thumbnails(post.image.name)
+        else:
+            post.thumbnail = thumbnail
+    return posts
@@ -0,0 +1,240 @@
+"""Перенос контента между экземплярами в формате NDJSON.
+
+Каждая строка - объект {"model": ..., "pk": ..., "fields": {...}}.
+Модели выгружаются в порядке зависимостей, поэтому при загрузке
+связанные строки уже на месте. Запись сопоставляется с локальной
+по естественному ключу из NATURAL_KEYS (username, slug, автор
+и дата поста...), внешние ключи переводятся на локальные pk.
+Исходный pk сохраняется, только если он свободен, так что загрузка
+в непустую базу ничего не теряет и не путает связи.
+Чтение идёт через iterator(), запись - пачками bulk_create в своих
+транзакциях; в памяти держится только соответствие pk.
+
+bulk_create не вызывает сигналы, поэтому счётчики, ленты и
+поисковый индекс после загрузки пересчитываются целиком.
+Файлы картинок переносятся отдельно, вместе с MEDIA_ROOT.
+"""
+import datetime
+import json
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management.color import no_style
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, transaction
+
+from . import counters, feeds, search
+from .models import Comment, Follow, Group, Post, User
+
+TRANSFER_BATCH_SIZE = 1000
+
+MODELS = (
+    (Group, ('title', 'slug', 'description')),
+    (User, (
+        'password', 'last_login', 'is_superuser', 'username', 'first_name',
+        'last_name', 'email', 'is_staff', 'is_active', 'date_joined',
+    )),
+    (Post, ('text', 'pub_date', 'author_id', 'group_id', 'image')),
+    (Comment, ('post_id', 'author_id', 'text', 'created')),
+    (Follow, ('user_id', 'author_id')),
+)
+REGISTRY = {model._meta.label_lower: model for model, _ in MODELS}
+# Первое поле ключа самое избирательное: по нему идёт поиск в базе.
+NATURAL_KEYS = {
+    Group: ('slug',),
+    User: ('username',),
+    Post: ('pub_date', 'author_id'),
+    Comment: ('created', 'post_id', 'author_id'),
+    Follow: ('user_id', 'author_id'),
+}
+
+
+class TransferEncoder(DjangoJSONEncoder):
+    """DjangoJSONEncoder без округления дат до миллисекунд."""
+
+    def default(self, o):
+        if isinstance(o, datetime.datetime):
+            return o.isoformat()
+        return super().default(o)
+
+
+def export_content(stream):
+    """Пишет все записи в stream, возвращает Counter строк по моделям."""
+    exported = Counter()
+    for model, fields in MODELS:
+        label = model._meta.label_lower
+        rows = model._default_manager.order_by('pk').values_list(
+            'pk', *fields
+        )
+        for pk, *values in rows.iterator(chunk_size=TRANSFER_BATCH_SIZE):
+            record = {
+                'model': label, 'pk': pk, 'fields': dict(zip(fields, values))
+            }
+            stream.write(json.dumps(
+                record, cls=TransferEncoder, ensure_ascii=False
+            ) + '\n')
+            exported[label] += 1
+    return exported
+
+
+@contextmanager
+def explicit_auto_dates():
+    """Даты с auto_now_add берутся из файла, а не ставятся заново."""
+    fields = [
+        field
+        for model, _ in MODELS
+        for field in model._meta.concrete_fields
+        if getattr(field, 'auto_now_add', False)
+    ]
+    for field in fields:
+        field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field in fields:
+            field.auto_now_add = True
+
+
+def build(record, pks):
+    """Пара (исходный pk, несохранённый объект) с внешними ключами,
+    переведёнными на локальные pk через pks."""
+    model = REGISTRY[record['model']]
+    values = {}
+    for name, value in record['fields'].items():
+        field = model._meta.get_field(name)
+        if field.is_relation and value is not None:
+            label = field.related_model._meta.label_lower
+            if value not in pks[label]:
+                raise ValueError(f'{label} {value} нет в выгрузке')
+            value = pks[label][value]
+        values[name] = field.to_python(value)
+    return record['pk'], model(**values)
+
+
+def natural_key(instance):
+    return tuple(
+        getattr(instance, field) for field in NATURAL_KEYS[type(instance)]
+    )
+
+
+def local_pks(model, instances):
+    """Локальные pk строк с теми же естественными ключами:
+    ключ -> pk."""
+    fields = NATURAL_KEYS[model]
+    rows = model.objects.filter(**{
+        f'{fields[0]}__in': {getattr(instance, fields[0])
+                             for instance in instances}
+    }).values_list('pk', *fields)
+    return {tuple(values): pk for pk, *values in rows}
+
+
+def save_batch(batch, pks):
+    """Сохраняет пачку пар (исходный pk, объект) одной модели.
+
+    Записи, уже существующие по естественному ключу, не
+    вставляются. Соответствие исходных pk локальным дописывается
+    в pks. Возвращает число вставленных строк.
+    """
+    if not batch:
+        return 0
+    model = type(batch[0][1])
+    with transaction.atomic():
+        existing = local_pks(model, [instance for _, instance in batch])
+        new = {}
+        for source_pk, instance in batch:
+            key = natural_key(instance)
+            if key not in existing:
+                new.setdefault(key, (source_pk, instance))
+        taken = set(model.objects.filter(
+            pk__in=[source_pk for source_pk, _ in new.values()]
+        ).values_list('pk', flat=True))
+        for source_pk, instance in new.values():
+            instance.pk = None if source_pk in taken else source_pk
+        model.objects.bulk_create(
+            [instance for _, instance in new.values()]
+        )
+        saved = local_pks(model, [instance for _, instance in batch])
+        if model is User:
+            counters.create_missing_stats(
+                User.objects.filter(pk__in=saved.values())
+            )
+    pks[model._meta.label_lower].update(
+        (source_pk, saved[natural_key(instance)])
+        for source_pk, instance in batch
+    )
+    return len(new)
+
+
+def reset_sequences():
+    """Сдвигает счётчики первичных ключей за вставленные явно pk
+    (нужно PostgreSQL, для SQLite запросов нет)."""
+    statements = connection.ops.sequence_reset_sql(
+        no_style(), [model for model, _ in MODELS]
+    )
+    with connection.cursor() as cursor:
+        for statement in statements:
+            cursor.execute(statement)
+
+
+def import_content(stream):
+    """Загружает записи из stream пачками по TRANSFER_BATCH_SIZE.
+
+    Записи, которые уже есть в базе по естественному ключу,
+    пропускаются, так что повторная загрузка того же файла ничего
+    не дублирует. Возвращает Counter вставленных строк по моделям.
+    """
+    imported = Counter()
+    pks = defaultdict(dict)
+    batch = []
+    with explicit_auto_dates():
+        for number, line in enumerate(stream, 1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+                model = REGISTRY[record['model']]
+            except (KeyError, TypeError, ValueError) as error:
+                raise ValueError(f'Строка {number}: {error!r}')
+            if batch and (type(batch[0][1]) is not model
+                          or len(batch) >= TRANSFER_BATCH_SIZE):
+                imported[batch_label(batch)] += save_batch(batch, pks)
+                batch = []
+            try:
+                batch.append(build(record, pks))
+            except (KeyError, TypeError, ValueError) as error:
+                raise ValueError(f'Строка {number}: {error!r}')
+        if batch:
+            imported[batch_label(batch)] += save_batch(batch, pks)
+    reset_sequences()
+    rebuild_derived()
+    return imported
+
+
+def batch_label(batch):
+    return type(batch[0][1])._meta.label_lower
+
+
+def summary(action, counts, elapsed):
+    """Итог переноса: строки по моделям и скорость в строках/с."""
+    elapsed = max(elapsed, 1e-6)
+    total = sum(counts.values())
+    lines = [f'{label}: {count}' for label, count in counts.items()]
+    lines.append(
+        f'{action} строк: {total} за {elapsed:.2f} с '
+        f'({total / elapsed:.0f} строк/с)'
+    )
+    return '\n'.join(lines)
+
+
+def rebuild_derived():
+    """Пересчитывает всё, что при обычном сохранении обновляют
+    сигналы: счётчики, популярных авторов, ленты и поисковый индекс."""
+    with transaction.atomic():
+        counters.recount()
+        feeds.reclassify(settings.POSTS_FEED_CELEBRITY_THRESHOLD)
+        if settings.POSTS_FEED_BACKEND == 'push':
+            feeds.rebuild()
+        search.rebuild()
+    cache.clear()
@@ -0,0 +1,61 @@
+"""Нормализация картинок, загруженных к постам.
+
+Оригинал с камеры не хранится как есть: картинка поворачивается
+по EXIF, уменьшается до POSTS_IMAGE_MAX_SIZE и один раз
+перекодируется без метаданных. Миниатюры потом строятся уже
+из этой копии.
+"""
+from django.conf import settings
+from PIL import Image, ImageOps
+
+
+def encoder_options(image, image_format):
+    """Параметры сохранения: качество из настроек, цветовой профиль
+    и прозрачность переносятся, остальные метаданные - нет."""
+    options = {
+        key: image.info[key]
+        for key in ('icc_profile', 'transparency') if key in image.info
+    }
+    # PNG и WebP иначе сами переносят info['exif'] в новый файл.
+    options['exif'] = b''
+    if image_format in ('JPEG', 'WEBP'):
+        options['quality'] = settings.POSTS_IMAGE_QUALITY
+    if image_format == 'JPEG':
+        options.update(optimize=True, progressive=True)
+    if image_format == 'PNG':
+        options['optimize'] = True
+    return options
+
+
+def normalize_image(upload):
+    """Перезаписывает загруженный файл нормализованной картинкой.
+
+    Имя и формат файла сохраняются. Анимированные картинки
+    и форматы, которые Pillow не умеет записывать, остаются как есть.
+    Битый или слишком большой файл даёт OSError
+    или Image.DecompressionBombError.
+    """
+    upload.seek(0)
+    with Image.open(upload) as image:
+        image_format = image.format
+        Image.init()
+        if (image_format not in Image.SAVE
+                or getattr(image, 'is_animated', False)):
+            upload.seek(0)
+            return upload
+        max_size = settings.POSTS_IMAGE_MAX_SIZE
+        image.draft(image.mode, max_size)
+        normalized = ImageOps.exif_transpose(image)
+    normalized.thumbnail(max_size, Image.LANCZOS)
+    if image_format == 'JPEG' and normalized.mode not in ('RGB', 'L'):
+        normalized = normalized.convert('RGB')
+
+    upload.seek(0)
+    upload.truncate()
+    normalized.save(
+        upload, image_format, **encoder_options(normalized, image_format)
+    )
+    upload.size = upload.tell()
+    upload.flush()
+    upload.seek(0)
+    return upload
@@ -1,16 +1,236 @@
+import time
+
+from django.conf import settings
+from django.core import signing
 from django.core.cache import cache
-from django.core.cache.utils import make_template_fragment_key
 from django.core.paginator import Paginator
+from django.db.models import Max, Min, Q
+from django.utils.functional import cached_property
+from django.utils.dateparse import parse_datetime
+
+PAGES_ON_ENDS = 1
+CURSOR_SALT = 'posts.cursor'
+GENERATION_KEY = 'posts:generation:{}'
+
+
+def post_tags(post):
+    """Теги кеша, которые зависят от поста."""
+    tags = ['posts', f'author:{post.author_id}', f'post:{post.pk}']
+    if post.group_id:
+        tags.append(f'group:{post.group_id}')
+    return tags
+
+
+def cache_version(*tags) -> str:
+    """Версия закешированного фрагмента, зависящего от тегов.
+
+    Версия меняется, когда cache_clear сбрасывает любой из тегов,
+    поэтому фрагменты можно хранить часами: устаревшая версия
+    просто перестаёт читаться.
+    """
+    keys = [GENERATION_KEY.format(tag) for tag in tags]
+    generations = cache.get_many(keys)
+    for key in keys:
+        if key not in generations:
+            initial = time.time_ns()
+            cache.add(key, initial, None)
+            generations[key] = cache.get(key, initial)
+    return '.'.join(str(generations[key]) for key in keys)
+
+
+def cache_clear(*tags):
+    """Сбрасывает все фрагменты, зависящие от тегов."""
+    for tag in tags:
+        key = GENERATION_KEY.format(tag)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, time.time_ns(), None)
+
+
+def cache_reset(*tags):
+    """Сбрасывает теги, как cache_clear, но одним delete_many.
+
+    Поколения заводятся заново при следующем чтении, поэтому
+    сброс тысяч тегов стоит одного удаления на тег без чтений.
+    """
+    if tags:
+        cache.delete_many([GENERATION_KEY.format(tag) for tag in tags])
+
+
+class WindowedPaginator(Paginator):
+    """Paginator, который отдаёт не все номера страниц, а окно вокруг
+    текущей с первой/последней страницей и пропусками между ними."""
+
+    ELLIPSIS = '…'
+
+    def get_elided_page_range(self, number=1, on_each_side=2,
+                              on_ends=PAGES_ON_ENDS):
+        number = self.validate_number(number)
+        if self.num_pages <= (on_each_side + on_ends) * 2:
+            return list(self.page_range)
+
+        window = []
+        if number > on_each_side + on_ends + 2:
+            window.extend(range(1, on_ends + 1))
+            window.append(self.ELLIPSIS)
+            window.extend(range(number - on_each_side, number + 1))
+        else:
+            window.extend(range(1, number + 1))
+
+        if number < self.num_pages - on_each_side - on_ends - 1:
+            window.extend(range(number + 1, number + on_each_side + 1))
+            window.append(self.ELLIPSIS)
+            window.extend(
+                range(self.num_pages - on_ends + 1, self.num_pages + 1)
+            )
+        else:
+            window.extend(range(number + 1, self.num_pages + 1))
+        return window
+
+
+class EstimatedCountPaginator(Paginator):
+    """Paginator для больших таблиц без точного COUNT(*).
+
+    Для всей таблицы число строк оценивается по диапазону
+    первичного ключа - два шага по индексу. Отфильтрованный список
+    считается точно, но не дальше count_limit строк.
+    """
+
+    count_limit = 10000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list.order_by()
+        if not queryset.query.has_filters():
+            bounds = queryset.aggregate(first=Min('pk'), last=Max('pk'))
+            if bounds['last'] is None:
+                return 0
+            return bounds['last'] - bounds['first'] + 1
+        return queryset[:self.count_limit].count()
 
 
-def cache_clear(cache_key: str, user=None):
-    key = make_template_fragment_key(cache_key, [user])
-    cache.delete(key)
+class CursorPage:
+    """Страница ленты, построенная по курсору без OFFSET и COUNT(*)."""
+
+    is_cursor = True
+
+    def __init__(self, object_list, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __repr__(self):
+        return f'<CursorPage {self.previous_cursor}:{self.next_cursor}>'
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+class CursorPaginator:
+    """Постраничный вывод постов по ключу (pub_date, id).
+
+    Курсор - подписанный токен с ключом крайнего поста страницы
+    и направлением перехода, поэтому глубина страницы не влияет
+    на стоимость запроса.
+    """
+
+    ordering = ('-pub_date', 'pk')
+
+    def __init__(self, object_list, per_page):
+        self.object_list = object_list
+        self.per_page = per_page
+
+    @staticmethod
+    def encode_cursor(post, direction):
+        return signing.dumps(
+            [post.pub_date.isoformat(), post.pk, direction],
+            salt=CURSOR_SALT,
+        )
+
+    @staticmethod
+    def decode_cursor(cursor):
+        try:
+            pub_date, pk, direction = signing.loads(cursor, salt=CURSOR_SALT)
+        except (signing.BadSignature, TypeError, ValueError):
+            return None
+        pub_date = parse_datetime(pub_date)
+        if pub_date is None or direction not in ('next', 'previous'):
+            return None
+        return pub_date, pk, direction
+
+    def get_page(self, cursor=None):
+        """Возвращает страницу по курсору; неверный курсор - первая."""
+        position = self.decode_cursor(cursor) if cursor else None
+        if position is None:
+            return self._forward_page(self.object_list, from_cursor=False)
+
+        pub_date, pk, direction = position
+        if direction == 'next':
+            post_list = self.object_list.filter(
+                Q(pub_date__lt=pub_date) | Q(pub_date=pub_date, pk__gt=pk)
+            )
+            return self._forward_page(post_list, from_cursor=True)
+
+        post_list = self.object_list.filter(
+            Q(pub_date__gt=pub_date) | Q(pub_date=pub_date, pk__lt=pk)
+        )
+        return self._backward_page(post_list)
+
+    def _forward_page(self, post_list, from_cursor):
+        posts = list(
+            post_list.order_by(*self.ordering)[:self.per_page + 1]
+        )
+        next_cursor = previous_cursor = None
+        if len(posts) > self.per_page:
+            posts = posts[:self.per_page]
+            next_cursor = self.encode_cursor(posts[-1], 'next')
+        if from_cursor and posts:
+            previous_cursor = self.encode_cursor(posts[0], 'previous')
+        return CursorPage(posts, next_cursor, previous_cursor)
+
+    def _backward_page(self, post_list):
+        reverse_ordering = ('pub_date', '-pk')
+        posts = list(
+            post_list.order_by(*reverse_ordering)[:self.per_page + 1]
+        )
+        next_cursor = previous_cursor = None
+        if len(posts) > self.per_page:
+            posts = posts[:self.per_page]
+            previous_cursor = self.encode_cursor(posts[-1], 'previous')
+        posts.reverse()
+        if posts:
+            next_cursor = self.encode_cursor(posts[-1], 'next')
+        return CursorPage(posts, next_cursor, previous_cursor)
 
 
 def paginator(post_list, request):
-    NUMBER_OF_POSTS_TO_SHOW = 10
-    paginator = Paginator(post_list, NUMBER_OF_POSTS_TO_SHOW)
+    if settings.POSTS_CURSOR_PAGINATION and getattr(
+        post_list, 'supports_cursor', True
+    ):
+        cursor_paginator = CursorPaginator(post_list, settings.POSTS_PER_PAGE)
+        return cursor_paginator.get_page(request.GET.get('cursor'))
+
+    paginator = WindowedPaginator(post_list, settings.POSTS_PER_PAGE)
     page_number = request.GET.get('page')
     page_obj = paginator.get_page(page_number)
+    page_obj.page_window = paginator.get_elided_page_range(
+        page_obj.number,
+        on_each_side=settings.POSTS_PAGINATOR_WINDOW,
+    )
     return page_obj
@@ -1,23 +1,35 @@
+from django.conf import settings
 from django.contrib.auth.decorators import login_required
+from django.db import transaction
 from django.shortcuts import get_object_or_404, redirect, render
+from django.utils.http import urlencode
 
+from core.decorators import cache_anonymous_page
+
+from .feeds import feed_version, follow_feed
 from .forms import CommentForm, PostForm
 from .models import Follow, Group, Post, User
-from .utils import cache_clear, paginator
+from .pages import group_state, index_state, post_state, profile_state
+from .search import SearchResults
+from .utils import cache_version, paginator
 
 
+@cache_anonymous_page(index_state)
 def index(request):
-    post_list = Post.objects.all()
+    post_list = Post.objects.select_related('author', 'group')
     page_obj = paginator(post_list, request)
     context = {
-        'page_obj': page_obj
+        'page_obj': page_obj,
+        'cache_timeout': settings.POSTS_FRAGMENT_CACHE_TIMEOUT,
+        'cache_version': cache_version('posts'),
     }
     return render(request, 'posts/index.html', context)
 
 
+@cache_anonymous_page(group_state)
 def group_posts(request, slug):
     group = get_object_or_404(Group, slug=slug)
-    post_list = group.posts.all()
+    post_list = group.posts.select_related('author')
     page_obj = paginator(post_list, request)
     context = {
         'group': group,
@@ -26,10 +38,14 @@ def group_posts(request, slug):
     return render(request, 'posts/group_list.html', context)
 
 
+@cache_anonymous_page(profile_state)
 def profile(request, username):
-    user = get_object_or_404(User, username=username)
+    user = get_object_or_404(
+        User.objects.select_related('stats'),
+        username=username
+    )
 
-    post_list = user.posts.all()
+    post_list = user.posts.select_related('group')
     page_obj = paginator(post_list, request)
 
     if request.user.is_authenticated and Follow.objects.filter(
@@ -48,9 +64,24 @@ def profile(request, username):
     return render(request, 'posts/profile.html', context)
 
 
+def search(request):
+    query = request.GET.get('q', '').strip()
+    page_obj = paginator(SearchResults(query), request)
+    context = {
+        'query': query,
+        'page_obj': page_obj,
+        'page_query': urlencode({'q': query}) + '&' if query else '',
+    }
+    return render(request, 'posts/search.html', context)
+
+
+@cache_anonymous_page(post_state)
 def post_detail(request, post_id):
-    post = get_object_or_404(Post, pk=post_id)
-    comments = post.comments.all()
+    post = get_object_or_404(
+        Post.objects.select_related('author__stats', 'group'),
+        pk=post_id
+    )
+    comments = post.comments.select_related('author')
     context = {
         'post': post,
         'form': CommentForm(),
@@ -60,6 +91,7 @@ def post_detail(request, post_id):
 
 
 @login_required
+@transaction.atomic
 def post_create(request):
     form = PostForm(
         request.POST or None,
@@ -75,6 +107,7 @@ def post_create(request):
 
 
 @login_required
+@transaction.atomic
 def post_edit(request, post_id):
     post = get_object_or_404(Post, pk=post_id)
     form = PostForm(
@@ -96,6 +129,7 @@ def post_edit(request, post_id):
 
 
 @login_required
+@transaction.atomic
 def add_comment(request, post_id):
     post = get_object_or_404(Post, pk=post_id)
     form = CommentForm(request.POST or None)
@@ -109,24 +143,18 @@ def add_comment(request, post_id):
 
 @login_required
 def follow_index(request):
-    user = request.user
-    page_obj = {}
-    if Follow.objects.filter(user=user).exists():
-        follows = user.follower.all()
-        followed_authors = User.objects.filter(following__in=follows)
-        post_list = Post.objects.filter(author__in=followed_authors)
-        page_obj = paginator(post_list, request)
-        context = {
-            'page_obj': page_obj
-        }
-    else:
-        context = {
-            'page_obj': page_obj
-        }
+    post_list = follow_feed(request.user)
+    page_obj = paginator(post_list, request)
+    context = {
+        'page_obj': page_obj,
+        'cache_timeout': settings.POSTS_FRAGMENT_CACHE_TIMEOUT,
+        'cache_version': feed_version(request.user.pk),
+    }
     return render(request, 'posts/follow.html', context)
 
 
 @login_required
+@transaction.atomic
 def profile_follow(request, username):
     author = get_object_or_404(User, username=username)
     if request.user != author and Follow.objects.filter(
@@ -137,16 +165,15 @@ def profile_follow(request, username):
             user=request.user,
             author=author
         )
-        cache_clear('follow_index_page_cache', request.user)
     return redirect('posts:profile', username=username)
 
 
 @login_required
+@transaction.atomic
 def profile_unfollow(request, username):
     Follow.objects.filter(
         user=request.user,
         author = get_object_or_404(User, username=username)
     ).delete()
 
-    cache_clear('follow_index_page_cache', request.user)
     return redirect('posts:profile', username=username)
@@ -118,9 +118,62 @@ CSRF_FAILURE_VIEW = 'core.views.csrf_failure'
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+FILE_UPLOAD_HANDLERS = [
+    'django.core.files.uploadhandler.TemporaryFileUploadHandler',
+]
 
 CACHES = {
     'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
-    }
+        'BACKEND': 'core.cache.TwoTierCache',
+        'LOCATION': 'shared',
+        'OPTIONS': {
+            'MAX_ENTRIES': 1000,
+            'L1_TIMEOUT': 60,
+            'POLL_INTERVAL': 1,
+        },
+    },
+    'shared': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(BASE_DIR, 'cache'),
+        'OPTIONS': {
+            'MAX_ENTRIES': 100000,
+        },
+    },
+}
+TEST_RUNNER = 'core.testing.IsolatedCacheTestRunner'
+
+POSTS_PER_PAGE = 10
+POSTS_CURSOR_PAGINATION = False
+POSTS_PAGINATOR_WINDOW = 2
+POSTS_FEED_MAX_LENGTH = 1000
+POSTS_FEED_CELEBRITY_THRESHOLD = 10000
+POSTS_FEED_BACKEND = 'push'
+POSTS_TIMELINE_LENGTH = 200
+POSTS_TIMELINE_TIMEOUT = 60 * 60 * 24
+POSTS_FRAGMENT_CACHE_TIMEOUT = 60 * 60 * 6
+POSTS_CARD_CACHE_TIMEOUT = 60 * 60 * 24
+PAGE_CACHE_TIMEOUT = 60 * 60
+CACHE_LOCK_TIMEOUT = 10
+CACHE_EARLY_REFRESH_BETA = 1.0
+CACHE_STALE_TIMEOUT = 60 * 60
+CACHE_LATENCY_BUDGET = 2
+CACHE_REFRESH_IN_BACKGROUND = True
+BACKGROUND_WORKERS = 4
+
+THUMBNAIL_BACKEND = 'posts.thumbnails.PostThumbnailBackend'
+THUMBNAIL_KVSTORE = 'posts.thumbnails.PostKVStore'
+THUMBNAIL_ENGINE = 'posts.thumbnails.PostThumbnailEngine'
+POSTS_THUMBNAILS = {
+    'card': ('960x339', {'crop': 'center', 'upscale': True}),
+}
+POSTS_IMAGE_VARIANTS = {
+    'card': {
+        'widths': (320, 640, 960),
+        'formats': ('WEBP', 'JPEG'),
+        'sizes': '(min-width: 768px) 720px, 100vw',
+    },
 }
+POSTS_THUMBNAIL_RETRY_TIMEOUT = 60 * 10
+POSTS_IMAGE_MAX_SIZE = (2560, 2560)
+POSTS_IMAGE_QUALITY = 85
+POSTS_IMAGE_REUSE_GRACE = 10